@@ -0,0 +1,209 @@
+"""
+Times every libs/features helper and every bp_v0 route on synthetic views of growing size
+> python3 -m benchmarks.bench_api --sizes small,medium --output bench_api.json
+> python3 -m benchmarks.bench_api --baseline bench_api.json --threshold 1.5
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import *
+
+import yaml
+from fire import Fire
+
+from benchmarks.report import check_baseline, get_environment, summarize_timings, time_calls, write_report
+from benchmarks.synthetic_views import get_issue_metrics, write_views
+from libs import features as feat
+from libs.views import load_snapshot
+
+SIZES = {
+    "small": {"n_stores": 250, "n_companies": 10, "n_quarters": 4, "n_metrics": 9},
+    "medium": {"n_stores": 2500, "n_companies": 40, "n_quarters": 8, "n_metrics": 9},
+    "large": {"n_stores": 25000, "n_companies": 150, "n_quarters": 12, "n_metrics": 15},
+}
+
+
+def get_cases(views: "ViewSnapshot") -> dict:
+    """
+    Ids and metrics the benchmark queries: the biggest company and one of its stores with data on the latest period
+    """
+    company_id = max(views.store_dim.number_of_stores, key=views.store_dim.number_of_stores.get)
+    latest = views.stores_ranked_idx.latest
+    company_stores = latest.loc[latest.company == company_id].store_id.sort_values().values
+    issue = get_issue_metrics(1)[0]
+    return {"company_id": company_id,
+            "store_id": company_stores[len(company_stores) // 2],
+            "metric": "rating",
+            "issue": issue,
+            "issue_rank": feat.format_issues_columns(issue) + "_rank",
+            "metrics": ["rating", issue, "product_issues", "business_issues"]}
+
+
+def get_feature_calls(views: "ViewSnapshot", case: dict) -> Dict[str, Callable]:
+    store_id, company_id, metric = case["store_id"], case["company_id"], case["metric"]
+    type_idx, company_idx = views.stores_ranked_idx, views.stores_ranked_company_idx
+    latest_period = type_idx.latest_period
+    comparison_df = feat.get_store_bechmark_comparison(store_id, metric, type_idx, views.benchmark_df,
+                                                       views.store_dim)
+    return {
+        "get_number_of_stores": lambda: feat.get_number_of_stores(company_id, views.store_dim),
+        "get_lat_long": lambda: feat.get_lat_long(store_id, views.store_dim),
+        "get_best_worst_store": lambda: feat.get_best_worst_store(company_id, type_idx, views.store_dim),
+        "get_company_general_performance": lambda: feat.get_company_general_performance(
+            company_id, views.stores_performance_agg_view),
+        "get_metric_distribution": lambda: feat.get_metric_distribution(
+            metric, company_id, latest_period, views.distributions),
+        "get_company_bechmark_comparison": lambda: feat.get_company_bechmark_comparison(
+            company_id, metric, views.company_benchmarks),
+        "get_company_bechmark_comparisons": lambda: feat.get_company_bechmark_comparisons(
+            company_id, case["metrics"], views.company_benchmarks),
+        "get_companies_bechmark_comparison": lambda: feat.get_companies_bechmark_comparison(
+            metric, views.company_benchmarks),
+        "get_store_bechmark_comparison": lambda: feat.get_store_bechmark_comparison(
+            store_id, metric, type_idx, views.benchmark_df, views.store_dim),
+        "get_store_bechmark_comparisons": lambda: feat.get_store_bechmark_comparisons(
+            store_id, case["metrics"], type_idx, views.benchmark_df, views.store_dim),
+        "format_bechmark_comparison": lambda: feat.format_bechmark_comparison(comparison_df),
+        "get_store_ranking": lambda: feat.get_store_ranking(store_id, case["issue_rank"], type_idx, latest_period),
+        "get_store_highlights": lambda: feat.get_store_highlights(store_id, type_idx),
+        "get_store_main_rankings": lambda: feat.get_store_main_rankings(store_id, type_idx, company_idx),
+        "get_general_ranking": lambda: feat.get_general_ranking(store_id, type_idx, latest_period),
+        "get_store_general_rankings": lambda: feat.get_store_general_rankings(store_id, type_idx, company_idx),
+        "get_store_performance": lambda: feat.get_store_performance(store_id, views.store_trends,
+                                                                    exclude_macro_issues=True),
+        "get_store_rankings": lambda: feat.get_store_rankings(store_id, type_idx),
+        "get_store_worse_rankings": lambda: feat.get_store_worse_rankings(store_id, type_idx),
+        "get_store_best_rankings": lambda: feat.get_store_best_rankings(store_id, type_idx),
+    }
+
+
+def get_route_calls(case: dict) -> Dict[str, Tuple[str, str, Optional[str]]]:
+    """
+    {route template: (method, path, body)}
+    """
+    store_id, company_id, metric, issue = case["store_id"], case["company_id"], case["metric"], case["issue"]
+    batch = {"queries": [{"kind": kind, "metric": m, "id": store_id if kind == "store" else company_id}
+                         for kind in ["store", "company"] for m in case["metrics"]]}
+    return {
+        "/ranked/companies/<metric>": ("GET", f"/ranked/companies/{metric}", None),
+        "/geoMarkers/<metric>": ("GET", f"/geoMarkers/{metric}", None),
+        "/geoMarkers/<metric>/company/<company_id>": ("GET", f"/geoMarkers/{metric}/company/{company_id}", None),
+        "/metric/<metric>/store/<store_id>": ("GET", f"/metric/{issue}/store/{store_id}", None),
+        "/metric/<metric>/company/<company_id>": ("GET", f"/metric/{issue}/company/{company_id}", None),
+        "/metric/<metric>/companies": ("GET", f"/metric/{metric}/companies", None),
+        "/batch": ("POST", "/batch", json.dumps(batch)),
+        "/metric/distribution/<metric>/company/<company_id>/<dt_com>": (
+            "GET", f"/metric/distribution/{metric}/company/{company_id}/latest", None),
+        "/detail/stores/<store_id>": ("GET", f"/detail/stores/{store_id}", None),
+        "/stores": ("GET", f"/stores?prefix={company_id}&limit=100", None),
+        "/trends/<metric>/<direction>": ("GET", f"/trends/{feat.format_issues_columns(issue)}/worsening", None),
+        "/detail/company/<company_id>": ("GET", f"/detail/company/{company_id}", None),
+        "/cache/stats": ("GET", "/cache/stats", None),
+        "/views/version": ("GET", "/views/version", None),
+    }
+
+
+def build_app() -> "Sanic":
+    from main import Dashboard
+
+    config = yaml.safe_load(open("config.yaml"))
+    config["VIEWS"] = dict(config.get("VIEWS", {}), format="pickle", watch_interval=0)
+    return Dashboard._build_server(config)
+
+
+async def start_app(app: "Sanic"):
+    """
+    Run the before_server_start listeners, which the test client does not run in ASGI mode
+    """
+    for listener in app.listeners["before_server_start"]:
+        result = listener(app, asyncio.get_event_loop())
+        if asyncio.iscoroutine(result):
+            await result
+
+
+async def time_routes(app: "Sanic", route_calls: Dict[str, Tuple[str, str, Optional[str]]],
+                      repeat: int) -> Dict[str, dict]:
+    results = dict()
+    for route, (method, path, body) in route_calls.items():
+        timings = []
+        for _ in range(max(repeat, 1)):
+            start = time.perf_counter()
+            if method == "POST":
+                _, response = await app.asgi_client.post(path, data=body)
+            else:
+                _, response = await app.asgi_client.get(path)
+            timings.append((time.perf_counter() - start) * 1000)
+            if response.status != 200:
+                raise RuntimeError(f"{method} {path} returned {response.status}: {response.text[:200]}")
+        results[route] = summarize_timings(timings)
+        results[route]["bytes"] = len(response.content)
+    return results
+
+
+def bench_size(app: "Sanic", folder: str, params: dict, repeat: int, seed: int = 0) -> dict:
+    """
+    Write synthetic views of one size on folder, then time the snapshot build, the features and the routes
+    """
+    from blueprints import bp_v0
+
+    views_df = write_views(folder, seed=seed, **params)
+    snapshot = time_calls(lambda: load_snapshot(folder), max(repeat // 10, 1))
+    views = load_snapshot(folder)
+    case = get_cases(views)
+
+    features = {name: time_calls(call, repeat) for name, call in get_feature_calls(views, case).items()}
+
+    loop = asyncio.get_event_loop()
+    if bp_v0.view_registry.current() is None:
+        loop.run_until_complete(start_app(app))
+    else:
+        bp_v0.load_views(app.config)
+    routes = loop.run_until_complete(time_routes(app, get_route_calls(case), repeat))
+
+    return {"params": params,
+            "rows": {name: int(df.shape[0]) for name, df in views_df.items()},
+            "case": {key: value for key, value in case.items() if isinstance(value, str)},
+            "snapshot": {"load_snapshot": snapshot},
+            "features": features,
+            "routes": routes}
+
+
+def run(sizes: str = "small,medium", repeat: int = 20, output: str = "bench_api.json",
+        baseline: Optional[str] = None, threshold: float = 1.5, min_delta_ms: float = 0.05, seed: int = 0):
+    """
+    Benchmark the features helpers and the API routes on synthetic views
+    :param sizes: comma separated SIZES names
+    :param repeat: calls timed per function/route
+    :param output: JSON report path
+    :param baseline: report of a previous run, exits with 1 if a median got threshold times slower
+    :param threshold: slowdown ratio counted as a regression
+    :param min_delta_ms: slowdowns under this many ms are noise
+    :param seed: random seed of the synthetic views
+    """
+    sizes = sizes.split(",") if isinstance(sizes, str) else list(sizes)
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        raise ValueError(f"Unknown sizes {unknown}, expected some of {list(SIZES)}")
+
+    report = {"environment": get_environment(), "repeat": repeat, "sizes": dict()}
+    with tempfile.TemporaryDirectory() as folder:
+        app = build_app()
+        # After building the app, sanic may have switched the event loop policy to uvloop
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        for size in sizes:
+            print(f"Benchmarking {size} {SIZES[size]}")
+            app.config["VIEWS"]["path"] = os.path.join(folder, size)
+            report["sizes"][size] = bench_size(app, app.config["VIEWS"]["path"], SIZES[size], repeat, seed)
+
+    exit_code = check_baseline(report, baseline, [{"field": "median_ms", "threshold": threshold,
+                                                    "min_delta": min_delta_ms}])
+    write_report(report, output)
+    print(f"Report written to {output}")
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    Fire(run)
@@ -0,0 +1,113 @@
+"""
+Throughput (reviews/sec) and peak traced memory of the ingestion and NLP stages on a synthetic scraped corpus
+> python3 -m benchmarks.bench_ingestion --sizes small,medium --output bench_ingestion.json
+> python3 -m benchmarks.bench_ingestion --baseline bench_ingestion.json --threshold 1.5
+"""
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import *
+
+import pandas as pd
+from fire import Fire
+
+from benchmarks.report import check_baseline, get_environment, write_report
+from benchmarks.synthetic_corpus import StubEmbeddingModel, write_corpus
+from libs import cleaning, loading, model_inference, text_formatting
+
+SIZES = {"small": 2000, "medium": 20000, "large": 200000}
+
+
+def measure(func: Callable, n_reviews: int, memory: bool = True) -> Tuple[Any, dict]:
+    """
+    Time func, then run it again under tracemalloc for its peak memory (tracing slows it down).
+    Only allocations of this process are traced, worker processes are not.
+    :return: (func result, {seconds, reviews_per_sec, peak_mb})
+    """
+    gc.collect()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    measures = {"seconds": round(seconds, 4), "reviews_per_sec": round(n_reviews / seconds, 1)}
+
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func()
+            measures["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        finally:
+            tracemalloc.stop()
+    return result, measures
+
+
+def bench_size(folder: str, n_reviews: int, model: StubEmbeddingModel, chunk_size: int, workers: int,
+               memory: bool, seed: int = 0) -> dict:
+    write_corpus(folder, n_reviews, seed=seed)
+    reviews = list(loading.iter_unique_reviews(loading.list_jsonl_files(folder)))
+    n_unique = len(reviews)
+
+    stages = dict()
+    reviews_df, stages["build_RA_df"] = measure(
+        lambda: loading.build_RA_df(folder, chunk_size, workers), n_unique, memory)
+    if workers > 1:
+        _, stages["build_RA_df_serial"] = measure(lambda: loading.build_RA_df(folder, chunk_size), n_unique, memory)
+    _, stages["format_RA_to_df"] = measure(
+        lambda: pd.DataFrame([cleaning.format_RA_to_df(review) for review in reviews]), n_unique, memory)
+    _, stages["format_RA_batch_to_df"] = measure(
+        lambda: cleaning.format_RA_batch_to_df(reviews), n_unique, memory)
+    _, stages["get_tokens_from_RA_df"] = measure(
+        lambda: text_formatting.get_tokens_from_RA_df(reviews_df), n_unique, memory)
+    features_df, stages["get_text_feature_df"] = measure(
+        lambda: model_inference.get_text_feature_df(reviews_df, model, chunk_size), n_unique, memory)
+
+    return {"params": {"n_reviews": n_reviews, "unique_reviews": n_unique, "chunk_size": chunk_size,
+                       "workers": workers},
+            "rows": {"reviews_df": int(reviews_df.shape[0]), "features_df": int(features_df.shape[0])},
+            "stages": stages}
+
+
+def run(sizes: str = "small,medium", chunk_size: int = loading.DEFAULT_CHUNK_SIZE, workers: int = 1,
+        dims: int = 100, memory: bool = True, output: str = "bench_ingestion.json",
+        baseline: Optional[str] = None, threshold: float = 1.5, seed: int = 0):
+    """
+    Benchmark build_RA_df, format_RA_to_df (row by row and batched), get_tokens_from_RA_df and
+    get_text_feature_df on synthetic corpora
+    :param sizes: comma separated SIZES names
+    :param chunk_size: reviews formatted/embedded at a time
+    :param workers: build_RA_df processes (the serial build is also measured when > 1)
+    :param dims: stub embedding dimensions
+    :param memory: also measure the peak traced memory of every stage
+    :param output: JSON report path
+    :param baseline: report of a previous run, exits with 1 if a throughput dropped or a peak grew threshold times
+    :param threshold: ratio counted as a regression
+    :param seed: random seed of the corpus
+    """
+    sizes = sizes.split(",") if isinstance(sizes, str) else list(sizes)
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        raise ValueError(f"Unknown sizes {unknown}, expected some of {list(SIZES)}")
+
+    model = StubEmbeddingModel(dims=dims, seed=seed)
+    report = {"environment": get_environment(), "sizes": dict()}
+    with tempfile.TemporaryDirectory() as folder:
+        for size in sizes:
+            print(f"Benchmarking {size} ({SIZES[size]} reviews)")
+            report["sizes"][size] = bench_size(os.path.join(folder, size), SIZES[size], model, chunk_size,
+                                               workers, memory, seed)
+            for stage, measures in report["sizes"][size]["stages"].items():
+                print(f"  {stage}: {measures}")
+
+    exit_code = check_baseline(report, baseline, [
+        {"field": "reviews_per_sec", "threshold": threshold, "min_delta": 0, "higher_is_better": True},
+        {"field": "peak_mb", "threshold": threshold, "min_delta": 1}])
+    write_report(report, output)
+    print(f"Report written to {output}")
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    Fire(run)
@@ -0,0 +1,384 @@
+"""
+Concurrent load on the API: virtual users on keep-alive connections send a weighted route mix
+(or replay an access log) and the latency percentiles and throughput of every route are reported.
+Against a running server
+> python3 -m benchmarks.load_test run --url http://localhost:8000 --concurrency 64 --duration 30
+Starting `main.py run_server` once per worker count, on the shipped or on synthetic views
+> python3 -m benchmarks.load_test compare --workers 1,4 --size medium --output load_test.json
+"""
+import asyncio
+import os
+import random
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import *
+from urllib.parse import urlsplit
+
+import numpy as np
+import yaml
+from fire import Fire
+
+from benchmarks.report import get_environment, write_report
+
+# Route template -> default weight of the mix, the dashboard mostly opens store details and maps
+ROUTE_MIX = {
+    "/detail/stores/<store_id>": 30,
+    "/geoMarkers/<metric>": 15,
+    "/geoMarkers/<metric>/company/<company_id>": 10,
+    "/detail/company/<company_id>": 10,
+    "/metric/<metric>/store/<store_id>": 10,
+    "/metric/<metric>/company/<company_id>": 5,
+    "/metric/distribution/<metric>/company/<company_id>/<dt_com>": 5,
+    "/ranked/companies/<metric>": 5,
+    "/trends/<metric>/<direction>": 4,
+    "/stores": 4,
+    "/metric/<metric>/companies": 2,
+}
+METRICS = ["rating", "product_issues", "business_issues", "product_issues_Quality", "business_issues_Delivery"]
+
+# Sanic access log line: ...: GET http://host:8000/detail/stores/x  200 1658
+ACCESS_LOG_RE = re.compile(r"\b(GET|POST|PUT|DELETE) (\S+)\s+(\d{3})?")
+
+
+def get_template_patterns(templates: Iterable[str]) -> List[Tuple[str, "re.Pattern"]]:
+    """
+    Path regex of every route template, routes with more literal segments first
+    """
+    patterns = [(template, re.compile("^" + re.sub(r"<[^/]+>", "[^/]+", template) + "$")) for template in templates]
+    return sorted(patterns, key=lambda pattern: -len([s for s in pattern[0].split("/") if s and s[0] != "<"]))
+
+
+def match_template(path: str, patterns: List[Tuple[str, "re.Pattern"]]) -> str:
+    path = urlsplit(path).path
+    for template, pattern in patterns:
+        if pattern.match(path):
+            return template
+    return "other"
+
+
+def build_path(template: str, rng: random.Random, ids: dict) -> str:
+    """
+    Concrete path of a template with random store/company ids and metrics
+    """
+    store_id, company_id = rng.choice(ids["store_ids"]), rng.choice(ids["company_ids"])
+    metric = rng.choice(ids["metrics"])
+    issue = rng.choice([m for m in ids["metrics"] if "issues" in m] or ids["metrics"])
+    if template == "/stores":
+        return f"/stores?prefix={company_id}&limit=100"
+    if template == "/trends/<metric>/<direction>":
+        return f"/trends/{'_'.join(issue.split(' ')).lower()}/{rng.choice(['improving', 'worsening'])}"
+    return (template.replace("<store_id>", store_id).replace("<company_id>", company_id)
+            .replace("<metric>", metric).replace("<dt_com>", "latest"))
+
+
+def parse_mix(mix: Optional[str]) -> Dict[str, float]:
+    """
+    "template=weight,template=weight" route mix, ROUTE_MIX if None
+    """
+    if not mix:
+        return dict(ROUTE_MIX)
+    weights = dict()
+    for item in mix.split(","):
+        template, _, weight = item.partition("=")
+        if template not in ROUTE_MIX:
+            raise ValueError(f"Unknown route {template}, expected some of {list(ROUTE_MIX)}")
+        weights[template] = float(weight or 1)
+    return weights
+
+
+def read_access_log(path: str) -> List[Tuple[str, str]]:
+    """
+    (method, path) of every GET of an access log (Sanic access log or plain "GET path" lines),
+    other methods are skipped since the log has no request bodies
+    """
+    requests = []
+    with open(path) as f:
+        for line in f:
+            match = ACCESS_LOG_RE.search(line)
+            if match and match.group(1) == "GET":
+                url = urlsplit(match.group(2))
+                requests.append((match.group(1), url.path + (f"?{url.query}" if url.query else "")))
+    return requests
+
+
+class Connection:
+    """
+    Minimal HTTP/1.1 keep-alive client, so the load generator needs nothing beyond asyncio
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self.reader, self.writer = None, None
+
+    async def request(self, method: str, path: str, body: bytes = b"") -> Tuple[int, int]:
+        """
+        :return: (status, body bytes)
+        """
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                          f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+        status = int((await self.reader.readline()).split()[1])
+
+        headers = dict()
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            size = 0
+            while True:
+                chunk_size = int((await self.reader.readline()).split(b";")[0], 16)
+                await self.reader.readexactly(chunk_size + 2)
+                size += chunk_size
+                if chunk_size == 0:
+                    break
+        else:
+            size = int(headers.get("content-length", 0))
+            await self.reader.readexactly(size)
+
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, size
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader, self.writer = None, None
+
+
+async def _virtual_user(connection: Connection, next_request: Callable, deadline: float,
+                        samples: List[Tuple[str, float, int, int]]):
+    while time.perf_counter() < deadline:
+        request = next_request()
+        if request is None:
+            break
+        route, method, path = request
+        start = time.perf_counter()
+        try:
+            status, size = await connection.request(method, path)
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            connection.close()
+            status, size = 0, 0
+        samples.append((route, (time.perf_counter() - start) * 1000, status, size))
+    connection.close()
+
+
+def summarize_samples(samples: List[Tuple[str, float, int, int]], seconds: float) -> Dict[str, dict]:
+    """
+    Per route (and "all") requests, errors, p50/p95/p99 latency (ms), throughput (req/s) and mean response bytes
+    """
+    by_route = defaultdict(list)
+    for sample in samples:
+        by_route[sample[0]].append(sample)
+        by_route["all"].append(sample)
+
+    stats = dict()
+    for route, route_samples in sorted(by_route.items()):
+        latencies = np.array([sample[1] for sample in route_samples])
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        stats[route] = {"requests": len(route_samples),
+                        "errors": sum(1 for sample in route_samples if sample[2] != 200),
+                        "p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3),
+                        "p99_ms": round(float(p99), 3), "max_ms": round(float(latencies.max()), 3),
+                        "throughput_rps": round(len(route_samples) / seconds, 1),
+                        "mean_bytes": int(np.mean([sample[3] for sample in route_samples]))}
+    return stats
+
+
+async def _discover_ids(host: str, port: int) -> dict:
+    """
+    Store and company ids served by the server, from its /stores catalog
+    """
+    import json
+
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"GET /stores?limit=1000000 HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n\r\n"
+                 .encode("latin-1"))
+    response = await reader.read()
+    writer.close()
+    stores = json.loads(response.split(b"\r\n\r\n", 1)[1].decode("utf-8"))
+    if not stores:
+        raise RuntimeError("The server has no stores to query")
+    return {"store_ids": [store["store_id"] for store in stores],
+            "company_ids": sorted({store["company"] for store in stores}),
+            "metrics": METRICS}
+
+
+async def _load(url: str, concurrency: int, duration: float, mix: Dict[str, float],
+                replay: Optional[List[Tuple[str, str]]], seed: int) -> dict:
+    split_url = urlsplit(url)
+    host, port = split_url.hostname, split_url.port or 80
+    rng = random.Random(seed)
+
+    if replay is not None:
+        patterns = get_template_patterns(ROUTE_MIX)
+        requests = iter([(match_template(path, patterns), method, path) for method, path in replay])
+        next_request = lambda: next(requests, None)
+    else:
+        ids = await _discover_ids(host, port)
+        templates, weights = list(mix), list(mix.values())
+
+        def next_request():
+            template = rng.choices(templates, weights)[0]
+            return template, "GET", build_path(template, rng, ids)
+
+    samples = []
+    start = time.perf_counter()
+    await asyncio.gather(*[_virtual_user(Connection(host, port), next_request, start + duration, samples)
+                           for _ in range(concurrency)])
+    seconds = time.perf_counter() - start
+    return {"concurrency": concurrency, "seconds": round(seconds, 3), "routes": summarize_samples(samples, seconds)}
+
+
+def _run_loop(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def print_stats(title: str, stats: Dict[str, dict]):
+    print(title)
+    print(f"  {'route':<62}{'req':>7}{'err':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}")
+    for route, route_stats in stats.items():
+        print(f"  {route:<62}{route_stats['requests']:>7}{route_stats['errors']:>6}{route_stats['p50_ms']:>9.1f}"
+              f"{route_stats['p95_ms']:>9.1f}{route_stats['p99_ms']:>9.1f}{route_stats['throughput_rps']:>9.1f}")
+
+
+def run(url: str = "http://localhost:8000", concurrency: int = 32, duration: float = 30, mix: Optional[str] = None,
+        access_log: Optional[str] = None, output: Optional[str] = None, seed: int = 0):
+    """
+    Load a running server
+    :param url: server url
+    :param concurrency: virtual users, each on its own keep-alive connection
+    :param duration: seconds of load
+    :param mix: "template=weight,..." route mix (ROUTE_MIX by default)
+    :param access_log: replay the requests of this access log instead of the mix (in order, until done or duration)
+    :param output: JSON report path
+    :param seed: random seed of the mix
+    """
+    replay = read_access_log(access_log) if access_log else None
+    result = _run_loop(_load(url, int(concurrency), float(duration), parse_mix(mix), replay, seed))
+    print_stats(f"{url} - {concurrency} users, {result['seconds']}s", result["routes"])
+    if output:
+        write_report({"environment": get_environment(), "runs": {url: result}}, output)
+
+
+def _get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(port: int, process: subprocess.Popen, timeout: float):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1) as s:
+                s.sendall(b"GET /views/version HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+                if s.recv(12).startswith(b"HTTP/1.1 200"):
+                    return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Server not ready after {timeout}s")
+
+
+def start_server(workers: int, config: dict, folder: str, startup_timeout: float = 120) -> Tuple[subprocess.Popen, int]:
+    """
+    `main.py run_server` with WEB_CONCURRENCY workers on a free port
+    :return: (server process, port)
+    """
+    port = _get_free_port()
+    config = dict(config, APP=dict(config["APP"], host="127.0.0.1", port=port))
+    config_path = os.path.join(folder, f"config_{workers}.yaml")
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen([sys.executable, "main.py", f"--config_path={config_path}", "run_server"], cwd=root,
+                               env=dict(os.environ, WEB_CONCURRENCY=str(workers)), stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        _wait_ready(port, process, startup_timeout)
+    except Exception:
+        stop_server(process)
+        raise
+    return process, port
+
+
+def stop_server(process: subprocess.Popen):
+    # The workers share the master's process group
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=30)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+def compare(workers: str = None, concurrency: int = 64, duration: float = 30, warmup: float = 3,
+            mix: Optional[str] = None, access_log: Optional[str] = None, size: Optional[str] = None,
+            config_path: str = "config.yaml", output: str = "load_test.json", seed: int = 0):
+    """
+    Start `main.py run_server` once per worker count and put the same load on each
+    :param workers: comma separated worker counts, 1 and WEB_CONCURRENCY (or the cpu count) by default
+    :param concurrency: virtual users
+    :param duration: seconds of load per server
+    :param warmup: seconds of load before measuring (fills the response caches)
+    :param mix: "template=weight,..." route mix
+    :param access_log: replay this access log instead of the mix
+    :param size: serve synthetic views of this benchmarks.bench_api size instead of the configured ones
+    :param config_path: base app config
+    :param output: JSON report path
+    :param seed: random seed
+    """
+    if workers is None:
+        workers = f"1,{os.environ.get('WEB_CONCURRENCY', os.cpu_count())}"
+    worker_counts = [int(w) for w in (workers.split(",") if isinstance(workers, str) else
+                                      (workers if isinstance(workers, (list, tuple)) else [workers]))]
+    replay = read_access_log(access_log) if access_log else None
+
+    config = yaml.safe_load(open(config_path))
+    config["VIEWS"] = dict(config.get("VIEWS", {}), watch_interval=0)
+    report = {"environment": get_environment(), "concurrency": concurrency, "duration": duration, "runs": dict()}
+    with tempfile.TemporaryDirectory() as folder:
+        if size is not None:
+            from benchmarks.bench_api import SIZES
+            from benchmarks.synthetic_views import write_views
+
+            views_folder = os.path.join(folder, "views")
+            write_views(views_folder, seed=seed, **SIZES[size])
+            config["VIEWS"] = dict(config["VIEWS"], path=views_folder, format="pickle")
+
+        for worker_count in sorted(set(worker_counts)):
+            process, port = start_server(worker_count, config, folder)
+            try:
+                url = f"http://127.0.0.1:{port}"
+                if warmup > 0:
+                    _run_loop(_load(url, concurrency, warmup, parse_mix(mix), replay, seed))
+                result = _run_loop(_load(url, concurrency, duration, parse_mix(mix), replay, seed))
+            finally:
+                stop_server(process)
+            result["workers"] = worker_count
+            report["runs"][f"workers_{worker_count}"] = result
+            print_stats(f"{worker_count} worker(s) - {concurrency} users, {result['seconds']}s", result["routes"])
+
+    write_report(report, output)
+    print(f"Report written to {output}")
+
+
+if __name__ == '__main__':
+    Fire({"run": run, "compare": compare})
@@ -0,0 +1,99 @@
+import json
+import platform
+import time
+from typing import *
+
+import numpy as np
+import pandas as pd
+
+
+def time_calls(func: Callable, repeat: int) -> dict:
+    """
+    Call func repeat times
+    :return: {calls, cold_ms (first call), min_ms, median_ms, p95_ms, mean_ms}
+    """
+    timings = []
+    for _ in range(max(repeat, 1)):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return summarize_timings(timings)
+
+
+def summarize_timings(timings_ms: List[float]) -> dict:
+    timings = np.array(timings_ms, dtype=float)
+    return {"calls": int(timings.size),
+            "cold_ms": round(float(timings[0]), 4),
+            "min_ms": round(float(timings.min()), 4),
+            "median_ms": round(float(np.median(timings)), 4),
+            "p95_ms": round(float(np.percentile(timings, 95)), 4),
+            "mean_ms": round(float(timings.mean()), 4)}
+
+
+def get_environment() -> dict:
+    return {"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__}
+
+
+def write_report(report: dict, path: str):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def iter_measures(report: dict, field: str) -> Iterator[Tuple[str, float]]:
+    """
+    (size/group/name, value) of every measure of a report {"sizes": {size: {group: {name: {field: value}}}}}
+    """
+    for size, groups in report.get("sizes", {}).items():
+        for group, measures in groups.items():
+            if not isinstance(measures, dict):
+                continue
+            for name, measure in measures.items():
+                if isinstance(measure, dict) and field in measure:
+                    yield f"{size}/{group}/{name}", measure[field]
+
+
+def compare_reports(report: dict, baseline: dict, field: str = "median_ms", threshold: float = 1.5,
+                    min_delta: float = 0.05, higher_is_better: bool = False) -> List[dict]:
+    """
+    Measures that regressed against a baseline report
+    :param field: compared measure field
+    :param threshold: ratio over (or under, if higher_is_better) the baseline counted as a regression
+    :param min_delta: absolute difference under which a change is noise
+    :param higher_is_better: field is a throughput rather than a time
+    :return: [{measure, baseline, current, ratio}] sorted by ratio, worst first
+    """
+    previous = dict(iter_measures(baseline, field))
+    regressions = []
+    for measure, current in iter_measures(report, field):
+        before = previous.get(measure)
+        if not before or abs(current - before) < min_delta:
+            continue
+        ratio = before / current if higher_is_better else current / before
+        if ratio > threshold:
+            regressions.append({"measure": measure, "baseline": before, "current": current,
+                                "ratio": round(ratio, 2), "field": field})
+    return sorted(regressions, key=lambda regression: -regression["ratio"])
+
+
+def check_baseline(report: dict, baseline_path: Optional[str], checks: List[dict]) -> int:
+    """
+    Print the regressions of report against the baseline report file
+    :param checks: compare_reports params of every compared field
+    :return: exit code, 1 when something regressed
+    """
+    if baseline_path is None:
+        return 0
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = [regression for params in checks for regression in compare_reports(report, baseline, **params)]
+    report["regressions"] = regressions
+    for regression in regressions:
+        print(f"REGRESSION {regression['measure']} {regression['field']}: {regression['baseline']} -> {regression['current']} "
+              f"({regression['ratio']}x)")
+    if not regressions:
+        print(f"No regressions against {baseline_path}")
+    return 1 if regressions else 0
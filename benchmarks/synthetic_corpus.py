@@ -0,0 +1,134 @@
+import json
+import os
+import random
+from datetime import datetime, timedelta
+from typing import *
+
+import numpy as np
+
+from libs.cleaning import DATETIME_FORMAT
+from libs.maps import tag_map
+from libs.text_formatting import normalize_text, tokenize
+
+COMPANIES = ["Magazine Luiza", "Casas Bahia", "Ponto Frio", "Mobly", "Americanas", "Submarino", "Extra"]
+CITIES = [("SP", "São Paulo"), ("SP", "Ribeirão Preto"), ("RJ", "Niterói"), ("MG", "Belo Horizonte"),
+          ("PR", "Maringá"), ("BA", "Salvador"), ("PA", "Belém"), ("RS", "Porto Alegre")]
+
+# Complaint vocabulary, accented like the scraped texts
+WORDS = ("não consegui cancelar o pedido entrega atrasada produto com defeito reembolso até hoje ninguém "
+         "respondeu péssimo atendimento já liguei várias vezes geladeira chegou amassada técnico visita "
+         "sofá veio faltando peças cobrança indevida cartão crédito estorno prometeram solução prazo "
+         "loja física trocar aparelho televisão celular parou funcionar garantia nota fiscal "
+         "informação descaso absurdo ótimo rápido atenção obrigado você também então além").split()
+TITLE_WORDS = ["Entrega atrasada", "Produto com defeito", "Não recebi o reembolso", "Cobrança indevida",
+               "Péssimo atendimento", "Pedido cancelado sem aviso", "Garantia não cumprida"]
+SERVICE_SEAL, BUY_AGAIN_SEAL = "Nota do atendimento", "Voltaria a fazer negócio?"
+
+
+def get_tags(tags_by_macro: dict = tag_map) -> List[str]:
+    """
+    Every tag of tag_map, plus one no macro maps (scraped tags outside of the map are ignored by count_tags)
+    """
+    tags = set()
+    for macro, sub_tags in tags_by_macro.items():
+        if isinstance(sub_tags, dict):
+            for tag_names in sub_tags.values():
+                tags.update(tag_names)
+        else:
+            tags.update(sub_tags)
+    return sorted(tags) + ["Tag desconhecida"]
+
+
+def _format_datetime(dt: datetime) -> str:
+    return dt.strftime(DATETIME_FORMAT)
+
+
+def make_review(rng: random.Random, review_id: int, tags: List[str]) -> dict:
+    """
+    One scraped review: optional uf/datetime/tags, business responses, and a final reply/result/seals
+    """
+    uf, city = rng.choice(CITIES)
+    created = datetime(2019, 1, 1) + timedelta(minutes=rng.randint(0, 2 * 365 * 24 * 60))
+    review = {"review_ID": str(review_id),
+              "title": rng.choice(TITLE_WORDS) + rng.choice(["", "!", "!!!", " - urgente"]),
+              "description": " ".join(rng.choices(WORDS, k=rng.randint(10, 120))) + rng.choice(
+                  ["", " Pedido 123456.", " Paguei R$ 1.299,00.", " Protocolo 2020-445."]),
+              "business_name": rng.choice(COMPANIES), "uf": uf, "city": city,
+              "datetime": _format_datetime(created),
+              "timeCaptured": _format_datetime(created + timedelta(days=rng.randint(1, 60))),
+              "responses": {"business": [], "final": {}}}
+    if rng.random() < 0.05:
+        del review["uf"]
+    if rng.random() < 0.02:
+        del review["datetime"]
+    if rng.random() < 0.9:
+        review["tags"] = rng.sample(tags, rng.randint(0, 4))
+
+    if rng.random() < 0.7:
+        review["responses"]["business"] = [
+            {"datetime": _format_datetime(created + timedelta(hours=rng.randint(1, 24 * 20))),
+             "text": "Olá, sentimos muito pelo ocorrido. Entraremos em contato."}
+            for _ in range(rng.randint(1, 3))]
+
+    final = review["responses"]["final"]
+    if rng.random() < 0.6:
+        final["reply"] = [{"datetime": _format_datetime(created + timedelta(days=rng.randint(-1, 90))),
+                           "text": rng.choice(["Resolvido, obrigado.", "Até agora nada."])}]
+    if rng.random() < 0.5:
+        final["result"] = rng.choice(["Resolvido", "Não resolvido"])
+    if rng.random() < 0.4:
+        final["seals"] = [{"seal": SERVICE_SEAL, "value": str(rng.randint(0, 10))},
+                          {"seal": BUY_AGAIN_SEAL, "value": rng.choice(["Sim", "Não"])}]
+    return review
+
+
+def write_corpus(folder: str, n_reviews: int, n_files: int = 4, duplicates: float = 0.05,
+                 seed: int = 0) -> List[str]:
+    """
+    Write a scraped RA corpus of .jl files under folder (nested like the scraper output)
+    :param n_reviews: reviews written, duplicates included
+    :param n_files: .jl files the reviews are spread over
+    :param duplicates: share of reviews scraped again (same review_ID in a later line)
+    :param seed: random seed
+    :return: written files
+    """
+    rng = random.Random(seed)
+    tags = get_tags()
+    paths = [os.path.join(folder, f"page_{i // 2}", f"reviews_{i}.jl") for i in range(n_files)]
+    for path in paths:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    files = [open(path, "w", encoding="utf-8") for path in paths]
+    try:
+        for i in range(n_reviews):
+            review_id = rng.randint(0, i) if i > 0 and rng.random() < duplicates else i
+            review = make_review(rng, review_id, tags)
+            rng.choice(files).write(json.dumps(review, ensure_ascii=False) + "\n")
+    finally:
+        for f in files:
+            f.close()
+    return paths
+
+
+class StubKeyedVectors:
+    """
+    The part of gensim 4 KeyedVectors the feature builders use
+    """
+
+    def __init__(self, words: List[str], dims: int = 100, seed: int = 0):
+        self.key_to_index = {word: i for i, word in enumerate(words)}
+        self.vectors = np.random.RandomState(seed).randn(len(words), dims).astype(np.float32)
+
+    def __getitem__(self, word: str) -> np.ndarray:
+        return self.vectors[self.key_to_index[word]]
+
+
+class StubEmbeddingModel:
+    """
+    Stand-in for a trained gensim model: random vectors over the corpus vocabulary
+    """
+
+    def __init__(self, dims: int = 100, oov: float = 0.1, seed: int = 0):
+        words = sorted(set(tokenize(normalize_text(" ".join(WORDS + TITLE_WORDS)))))
+        rng = random.Random(seed)
+        self.wv = StubKeyedVectors([word for word in words if rng.random() >= oov], dims, seed)
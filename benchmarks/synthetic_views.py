@@ -0,0 +1,122 @@
+import os
+from typing import *
+
+import numpy as np
+import pandas as pd
+
+from libs import aggregation
+
+STORE_TYPES = [f"t{i}" for i in range(7)]
+REVIEW_METRICS = ["n_review_user", "rating", "len_comment", "relative"]
+
+# Issue metrics of the real views, extended with synthetic ones when more metrics are asked for
+ISSUE_METRICS = ["product_issues_Quality", "product_issues_Damaged", "product_issues_Electrical problems",
+                 "product_issues_Missing pieces", "business_issues_Payment", "business_issues_Maintenance",
+                 "business_issues_Customer Services", "business_issues_Delivery", "business_issues_Online Services"]
+
+
+def get_issue_metrics(n_metrics: int) -> List[str]:
+    """
+    n_metrics issue sub metrics, alternating product_issues_*/business_issues_* past the real ones
+    """
+    issues = ISSUE_METRICS[:n_metrics]
+    for i in range(len(issues), n_metrics):
+        issues.append(f"{['product', 'business'][i % 2]}_issues_Extra {i}")
+    return issues
+
+
+def make_stores_info(n_stores: int, n_companies: int, seed: int = 0) -> "pd.DataFrame":
+    """
+    Stores catalog [store_id, store_type, company, latitude, longitude], store counts per company skewed like the real ones
+    """
+    rng = np.random.RandomState(seed)
+    weights = 1 / np.arange(1, n_companies + 1)
+    companies = np.sort(rng.choice(n_companies, size=n_stores, p=weights / weights.sum()))
+    company_ids = np.array([f"company-{k}" for k in range(n_companies)])[companies]
+    store_numbers = pd.Series(company_ids).groupby(company_ids).cumcount().values
+
+    return pd.DataFrame({
+        "store_id": [f"{company}_{i}" for company, i in zip(company_ids, store_numbers)],
+        "store_type": rng.choice(STORE_TYPES, size=n_stores),
+        "company": company_ids,
+        # Stored as strings in the real views
+        "latitude": np.round(rng.uniform(-33.0, -3.0, size=n_stores), 7).astype(str),
+        "longitude": np.round(rng.uniform(-60.0, -35.0, size=n_stores), 7).astype(str),
+    })
+
+
+def make_stores_ts(stores_info: "pd.DataFrame", n_quarters: int, n_metrics: int, seed: int = 0,
+                   coverage: float = 0.9, missing_issues: float = 0.3) -> "pd.DataFrame":
+    """
+    Quarterly store means, same layout as stores_ts_quarterly
+    :param stores_info: stores catalog (make_stores_info)
+    :param n_quarters: quarters up to 2020-03-31
+    :param n_metrics: issue sub metrics
+    :param coverage: share of (store, quarter) pairs with reviews
+    :param missing_issues: share of NaN issue means (issues never tagged in the quarter)
+    :return: dataFrame [date_comment, *metrics, product_issues, business_issues, store_id, store_type]
+    """
+    rng = np.random.RandomState(seed + 1)
+    quarters = aggregation.to_quarter_end(pd.date_range(end="2020-03-31", periods=n_quarters, freq="Q"))
+    store_pos, quarter_pos = [a.ravel() for a in np.meshgrid(np.arange(stores_info.shape[0]), np.arange(n_quarters),
+                                                             indexing="ij")]
+    covered = rng.uniform(size=store_pos.size) < coverage
+    store_pos, quarter_pos = store_pos[covered], quarter_pos[covered]
+    n_rows = store_pos.size
+
+    stores_ts = pd.DataFrame({"date_comment": quarters[quarter_pos]})
+    stores_ts["n_review_user"] = rng.gamma(2.0, 2.0, size=n_rows)
+    stores_ts["rating"] = np.clip(rng.normal(3.9, 0.4, size=n_rows), 1, 5)
+    stores_ts["len_comment"] = rng.gamma(4.0, 5.0, size=n_rows)
+    stores_ts["relative"] = rng.gamma(1.5, 150.0, size=n_rows)
+
+    issues = get_issue_metrics(n_metrics)
+    for issue in issues:
+        values = rng.beta(1.0, 40.0, size=n_rows)
+        values[rng.uniform(size=n_rows) < missing_issues] = np.nan
+        stores_ts[issue] = values
+    for macro in ["product_issues", "business_issues"]:
+        stores_ts[macro] = stores_ts[[issue for issue in issues if issue.startswith(macro)]].sum(axis=1, min_count=1)
+
+    stores_ts["store_id"] = stores_info.store_id.values[store_pos]
+    stores_ts["store_type"] = stores_info.store_type.values[store_pos]
+    return stores_ts
+
+
+def make_benchmarks(stores_ts: "pd.DataFrame") -> "pd.DataFrame":
+    """
+    Store_type means per quarter, same layout as benchmarks_ts_quarterly
+    """
+    metrics = [col for col in stores_ts.columns if col not in ("date_comment", "store_id", "store_type")]
+    benchmarks = stores_ts.groupby(["store_type", "date_comment"])[metrics].mean().reset_index()
+    return benchmarks[["date_comment"] + metrics + ["store_type"]]
+
+
+def make_views(n_stores: int = 1000, n_companies: int = 20, n_quarters: int = 4, n_metrics: int = 9,
+               seed: int = 0) -> Dict[str, "pd.DataFrame"]:
+    """
+    Synthetic serving views (VIEW_FILES names, plus stores_ts), ranked like the real build
+    :param n_stores: stores in the catalog
+    :param n_companies: companies the stores belong to
+    :param n_quarters: quarters of history
+    :param n_metrics: issue sub metrics (each with its _rank column)
+    :param seed: random seed
+    :return: {view name: dataFrame}
+    """
+    stores_info = make_stores_info(n_stores, n_companies, seed)
+    stores_ts = make_stores_ts(stores_info, n_quarters, n_metrics, seed)
+    views = {"stores_ts": stores_ts}
+    views.update(aggregation.build_ranked_views(stores_ts, stores_info))
+    views["benchmark_df"] = make_benchmarks(stores_ts)
+    views["stores_performance_agg_view"] = aggregation.build_performance_agg_view(stores_ts, stores_info)
+    return views
+
+
+def write_views(folder: str, **params) -> Dict[str, "pd.DataFrame"]:
+    """
+    Publish make_views(**params) on folder
+    """
+    os.makedirs(folder, exist_ok=True)
+    views = make_views(**params)
+    aggregation.publish_views(views, folder)
+    return views
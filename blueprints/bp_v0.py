@@ -1,25 +1,70 @@
+import os
+import resource
+import time
 from sanic import Blueprint
-from sanic.response import json
-import pickle
+from sanic.log import logger
+from sanic.response import json, json_dumps, raw
 import numpy as np
+import pandas as pd
 from sanic.exceptions import ServerError
 from libs import features as feat
+from libs.response_cache import ResponseCache
+from libs.trends import TREND_LABELS
+from libs.views import ViewRegistry, ViewSnapshot
 
 bp_v0 = Blueprint('v0', url_prefix='/')
 
+view_registry = ViewRegistry()
+
+TREND_DIRECTIONS = {"improving": TREND_LABELS[:2], "worsening": TREND_LABELS[2:]}
+MAX_DISTRIBUTION_BINS = 1000
+
+
+def load_views(config) -> ViewSnapshot:
+    """
+    Configure the view registry from the app config, load the views and log the load report
+    :param config: app config
+    :return: loaded ViewSnapshot
+    """
+    views_config = config.get("VIEWS", {})
+    view_registry.folder = views_config.get("path", "views")
+    view_registry.view_format = views_config.get("format", "pickle")
+    snapshot = view_registry.load()
+
+    for name, report in snapshot.load_report.items():
+        logger.info(f"View {name}: {report}")
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    logger.info(f"Views version {snapshot.version} loaded by pid {os.getpid()}, peak RSS {peak_rss_mb:.1f} MB")
+    return snapshot
+
 
 @bp_v0.listener('before_server_start')
 async def setup_connection(app, loop):
-    global stores_ranked_df, stores_ranked_company_df, benchmark_df, stores_performance_agg_view
-    stores_ranked_df = pickle.load(open("views/ranked_stores_ts_quarterly.pckl", "rb"))
-    stores_ranked_company_df = pickle.load(open("views/ranked_company_stores_ts_quarterly.pckl", "rb"))
-    benchmark_df = pickle.load(open("views/benchmarks_ts_quarterly.pckl", "rb"))
-    stores_performance_agg_view = pickle.load(open("views/stores_performance_agg_view.pckl", "rb"))
+    # Views preloaded by the master process (VIEWS.preload) are inherited copy-on-write
+    if view_registry.current() is None:
+        load_views(app.config)
+
+    # Pick up new view files without restarting the workers
+    watch_interval = float(app.config.get("VIEWS", {}).get("watch_interval", 0))
+    if watch_interval > 0:
+        loop.create_task(view_registry.watch(watch_interval))
+
+    # Pre-serialized responses, keyed on the version of the loaded views
+    global response_cache
+    response_cache = ResponseCache(max_bytes=app.config.get("CACHE", {}).get("max_bytes", 32 * 1024 * 1024))
 
     global configuration
     configuration = app.config
 
 
+@bp_v0.listener('after_server_start')
+async def report_ready(app, loop):
+    started_at = app.config.get("STARTED_AT")
+    if started_at is not None:
+        logger.info(f"Worker {os.getpid()} ready {time.time() - started_at:.2f}s after start "
+                    f"(views version {view_registry.version})")
+
+
 @bp_v0.route('/ranked/companies/<metric>', methods=['GET', 'OPTIONS'])
 async def get_ranked_companies(request, metric):
     """
@@ -27,12 +72,17 @@ async def get_ranked_companies(request, metric):
     :param request:
     :return: JSON
     """
-    clean_metric = feat.format_issues_columns(metric)
-    metric_rank = clean_metric + "_rank"
-    if any([m not in stores_ranked_df.columns for m in [metric, metric_rank]]):
-        raise ServerError(status_code=400, message=f"Metric does not exist")
-    tmp_df = feat.get_company_rank(clean_metric, stores_ranked_df)
-    return json(tmp_df)
+    views = view_registry.current()
+    cache_key = ("ranked/companies", metric, None, views.version)
+    body = response_cache.get(cache_key)
+    if body is None:
+        clean_metric = feat.format_issues_columns(metric)
+        metric_rank = clean_metric + "_rank"
+        if any([m not in views.stores_ranked_df.columns for m in [metric, metric_rank]]):
+            raise ServerError(status_code=400, message=f"Metric does not exist")
+        ranking = views.leaderboard.get_metric_ranking(clean_metric)
+        body = response_cache.put(cache_key, json_dumps(ranking))
+    return raw(body, content_type="application/json")
 
 
 @bp_v0.route('/geoMarkers/<metric>', methods=['GET', 'OPTIONS'])
@@ -50,18 +100,22 @@ async def get_markers(request, metric):
     :param request:
     :return: JSON
     """
-    metric_rank = feat.format_issues_columns(metric) + "_rank"
-    if any([m not in stores_ranked_df.columns for m in [metric, metric_rank]]):
-        raise ServerError(status_code=400, message=f"Metric does not exist")
+    views = view_registry.current()
+    cache_key = ("geoMarkers", metric, None, views.version)
+    body = response_cache.get(cache_key)
+    if body is None:
+        metric_rank = feat.format_issues_columns(metric) + "_rank"
+        if any([m not in views.stores_ranked_df.columns for m in [metric, metric_rank]]):
+            raise ServerError(status_code=400, message=f"Metric does not exist")
 
-    latest_period = stores_ranked_df.date_comment.drop_duplicates().sort_values().iloc[-1]
-    variables = ["latitude", "longitude", "store_type", "store_id", metric, metric_rank]
+        variables = ["latitude", "longitude", "store_type", "store_id", metric, metric_rank]
 
-    tmp_df = stores_ranked_df.loc[stores_ranked_df.date_comment == latest_period][variables]
-    tmp_df.columns = ["latitude", "longitude", "store_type", "store_id", "metric", "metric_rank"]
-    tmp_df["metric_eval"] = tmp_df.metric_rank.apply(lambda x: feat.evaluation_results(x)["result"])
+        tmp_df = views.stores_ranked_idx.latest[variables]
+        tmp_df.columns = ["latitude", "longitude", "store_type", "store_id", "metric", "metric_rank"]
+        tmp_df["metric_eval"] = tmp_df.metric_rank.apply(lambda x: feat.evaluation_results(x)["result"])
+        body = response_cache.put(cache_key, json_dumps(tmp_df.dropna().to_dict("records")))
 
-    return json(tmp_df.dropna().to_dict("records"))
+    return raw(body, content_type="application/json")
 
 
 @bp_v0.route('/geoMarkers/<metric>/company/<company_id>', methods=['GET', 'OPTIONS'])
@@ -79,21 +133,27 @@ async def get_markers_company(request, metric, company_id):
     :param request:
     :return: JSON
     """
-    metric_rank = feat.format_issues_columns(metric) + "_rank"
-    if any([m not in stores_ranked_df.columns for m in [metric, metric_rank]]):
-        raise ServerError(status_code=400, message=f"Metric does not exist")
+    views = view_registry.current()
+    cache_key = ("geoMarkers/company", metric, company_id, views.version)
+    body = response_cache.get(cache_key)
+    if body is None:
+        metric_rank = feat.format_issues_columns(metric) + "_rank"
+        if any([m not in views.stores_ranked_df.columns for m in [metric, metric_rank]]):
+            raise ServerError(status_code=400, message=f"Metric does not exist")
 
-    latest_period = stores_ranked_df.date_comment.drop_duplicates().sort_values().iloc[-1]
-    variables = ["latitude", "longitude", "store_type", "store_id", metric, metric_rank]
+        stores_ranked_idx = views.stores_ranked_idx
+        if not stores_ranked_idx.contains("company", company_id):
+            # Unknown companies have no markers, and are not cached so arbitrary ids cannot fill the cache
+            return json([])
 
-    tmp_df = \
-        stores_ranked_df.loc[
-            (stores_ranked_df.date_comment == latest_period) & (stores_ranked_df.company == company_id)][
-            variables]
-    tmp_df.columns = ["latitude", "longitude", "store_type", "store_id", "metric", "metric_rank"]
-    tmp_df["metric_eval"] = tmp_df.metric_rank.apply(lambda x: feat.evaluation_results(x)["result"])
+        variables = ["latitude", "longitude", "store_type", "store_id", metric, metric_rank]
 
-    return json(tmp_df.dropna().to_dict("records"))
+        tmp_df = stores_ranked_idx.rows("company", company_id, stores_ranked_idx.latest_period)[variables]
+        tmp_df.columns = ["latitude", "longitude", "store_type", "store_id", "metric", "metric_rank"]
+        tmp_df["metric_eval"] = tmp_df.metric_rank.apply(lambda x: feat.evaluation_results(x)["result"])
+        body = response_cache.put(cache_key, json_dumps(tmp_df.dropna().to_dict("records")))
+
+    return raw(body, content_type="application/json")
 
 
 @bp_v0.route('/metric/<metric>/store/<store_id>', methods=['GET', 'OPTIONS'])
@@ -103,14 +163,13 @@ async def get_metric_ts(request, metric, store_id):
     :param request:
     :return: JSON
     """
+    views = view_registry.current()
     metric_rank = feat.format_issues_columns(metric) + "_rank"
-    if any([m not in stores_ranked_df.columns for m in [metric, metric_rank]]):
+    if any([m not in views.stores_ranked_df.columns for m in [metric, metric_rank]]):
         raise ServerError(status_code=400, message=f"Metric does not exist")
-    tmp_df = feat.get_store_bechmark_comparison(store_id, metric, stores_ranked_df, benchmark_df).dropna()
-    tmp_df.columns = ["metric", "benchmark"]
-    tmp_df.reset_index(inplace=True)
-    tmp_df.date_comment = tmp_df.date_comment.astype(str)
-    return json(tmp_df.to_dict("records"))
+    tmp_df = feat.get_store_bechmark_comparison(store_id, metric, views.stores_ranked_idx, views.benchmark_df,
+                                                views.store_dim)
+    return json(feat.format_bechmark_comparison(tmp_df))
 
 
 @bp_v0.route('/metric/<metric>/company/<company_id>', methods=['GET', 'OPTIONS'])
@@ -120,30 +179,128 @@ async def get_company_metric_ts(request, metric, company_id):
     :param request:
     :return: JSON
     """
+    views = view_registry.current()
     metric_rank = feat.format_issues_columns(metric) + "_rank"
-    if any([m not in stores_ranked_df.columns for m in [metric, metric_rank]]):
+    if any([m not in views.stores_ranked_df.columns for m in [metric, metric_rank]]):
         raise ServerError(status_code=400, message=f"Metric does not exist")
-    tmp_df = feat.get_company_bechmark_comparison(company_id, metric, stores_ranked_df)
+    tmp_df = feat.get_company_bechmark_comparison(company_id, metric, views.company_benchmarks)
     return json(tmp_df)
 
 
+@bp_v0.route('/metric/<metric>/companies', methods=['GET', 'OPTIONS'])
+async def get_companies_metric_ts(request, metric):
+    """
+    Get timeseries of every company against their benchmark
+    E.g:
+    {'magazine-luiza': [{'date_comment': '2019-06-30', 'metric': 4.0, 'benchmark': 3.87}, ...], ...}
+    :param request:
+    :return: JSON
+    """
+    views = view_registry.current()
+    metric_rank = feat.format_issues_columns(metric) + "_rank"
+    if any([m not in views.stores_ranked_df.columns for m in [metric, metric_rank]]):
+        raise ServerError(status_code=400, message=f"Metric does not exist")
+    return json(feat.get_companies_bechmark_comparison(metric, views.company_benchmarks))
+
+
+@bp_v0.route('/batch', methods=['POST', 'OPTIONS'])
+async def get_batch(request):
+    """
+    Run several metric timeseries queries against the same views snapshot
+    E.g. body:
+    {'queries': [{'kind': 'store', 'metric': 'rating', 'id': 'magazine-luiza_0'},
+                 {'kind': 'company', 'metric': 'business_issues', 'id': 'magazine-luiza'}]}
+    E.g. response (results in the queries order, 'data' as in the single query routes):
+    {'version': '72dc099a104c',
+     'results': [{'kind': 'store', 'metric': 'rating', 'id': 'magazine-luiza_0', 'status': 200, 'data': [...]},
+                 {'kind': 'company', 'metric': 'bad', 'id': 'magazine-luiza', 'status': 400,
+                  'error': 'Metric does not exist'}]}
+    :param request:
+    :return: JSON
+    """
+    views = view_registry.current()
+    queries = request.json.get("queries") if isinstance(request.json, dict) else request.json
+    if not isinstance(queries, list) or any([not isinstance(q, dict) for q in queries]):
+        raise ServerError(status_code=400, message=f"Expected a list of {{kind, metric, id}} queries")
+    max_queries = int(configuration.get("BATCH", {}).get("max_queries", 100))
+    if len(queries) > max_queries:
+        raise ServerError(status_code=400, message=f"Too many queries (max {max_queries})")
+
+    # Validate and group the metrics by (kind, id) so each store/company is filtered once
+    results = []
+    grouped_metrics = dict()
+    for query in queries:
+        kind, metric, query_id = query.get("kind"), query.get("metric"), query.get("id")
+        result = {"kind": kind, "metric": metric, "id": query_id, "status": 200}
+        metric_rank = feat.format_issues_columns(metric) + "_rank" if isinstance(metric, str) else None
+        if kind not in ["store", "company"]:
+            result.update(status=400, error="Invalid query kind")
+        elif metric_rank is None or any([m not in views.stores_ranked_df.columns for m in [metric, metric_rank]]):
+            result.update(status=400, error="Metric does not exist")
+        elif not isinstance(query_id, str):
+            result.update(status=400, error="Invalid query id")
+        elif kind == "store" and not views.store_dim.contains(query_id):
+            result.update(status=400, error="Invalid Store ID.")
+        else:
+            grouped_metrics.setdefault((kind, query_id), []).append(metric)
+        results.append(result)
+
+    data = dict()
+    for (kind, query_id), metrics in grouped_metrics.items():
+        if kind == "store":
+            comparisons = feat.get_store_bechmark_comparisons(query_id, metrics, views.stores_ranked_idx,
+                                                              views.benchmark_df, views.store_dim)
+            comparisons = {metric: feat.format_bechmark_comparison(df) for metric, df in comparisons.items()}
+        else:
+            comparisons = feat.get_company_bechmark_comparisons(query_id, metrics, views.company_benchmarks)
+        for metric, records in comparisons.items():
+            data[(kind, query_id, metric)] = records
+
+    for result in results:
+        if result["status"] == 200:
+            result["data"] = data[(result["kind"], result["id"], result["metric"])]
+    return json({"version": views.version, "results": results})
+
+
 @bp_v0.route('/metric/distribution/<metric>/company/<company_id>/<dt_com>', methods=['GET', 'OPTIONS'])
 async def get_company_metric_distribution(request, metric, company_id, dt_com):
     """
     Get distribution for company metric against their benchmark on a specific date
+    Optional query args: bins (number of bins, default 10) and range (min,max of the bins, e.g. range=0,5)
     :param request:
     :return: JSON
     """
-    if any([m not in stores_ranked_df.columns for m in [metric]]):
+    views = view_registry.current()
+    if metric not in views.distributions.metrics:
         raise ServerError(status_code=400, message=f"Metric does not exist")
 
+    try:
+        bins = int(request.args.get("bins", 10))
+        metric_range = request.args.get("range")
+        if metric_range is not None:
+            metric_range = [float(v) for v in metric_range.split(",")]
+    except ValueError:
+        raise ServerError(status_code=400, message=f"Invalid bins/range")
+    if not 0 < bins <= MAX_DISTRIBUTION_BINS:
+        raise ServerError(status_code=400, message=f"bins must be between 1 and {MAX_DISTRIBUTION_BINS}")
+    if metric_range is not None and (len(metric_range) != 2 or not np.isfinite(metric_range).all()
+                                     or not metric_range[0] < metric_range[1]):
+        raise ServerError(status_code=400, message=f"range must be finite min,max with min < max")
+
     if dt_com == "latest":  # Get the latest period
-        dt_com = stores_ranked_df.date_comment.drop_duplicates().sort_values().iloc[-1]
+        dt_com = views.stores_ranked_idx.latest_period
+    else:
+        try:
+            dt_com = pd.Timestamp(dt_com)
+        except ValueError:
+            raise ServerError(status_code=400, message=f"Invalid date")
 
     tmp_df = feat.get_metric_distribution(metric=metric,
                                           company_id=company_id,
                                           dt_com=dt_com,
-                                          store_ts=stores_ranked_df, bins=10)
+                                          distributions=views.distributions,
+                                          bins=bins,
+                                          metric_range=metric_range)
     return json(tmp_df)
 
 
@@ -155,19 +312,21 @@ async def get_store_detail(request, store_id):
     :param request:
     :return: JSON
     """
-    if store_id not in stores_ranked_df.store_id.unique():
+    views = view_registry.current()
+    if not views.store_dim.contains(store_id):
         raise ServerError(status_code=400, message=f"Invalid Store ID.")
 
     # Get store general rankings
-    general_ranking = feat.get_store_general_rankings(store_id, stores_ranked_df, stores_ranked_company_df)
+    general_ranking = feat.get_store_general_rankings(store_id, views.stores_ranked_idx,
+                                                      views.stores_ranked_company_idx)
 
     # Get store performance
-    performance = feat.get_store_performance(store_id, stores_ranked_df, exclude_macro_issues=True)
+    performance = feat.get_store_performance(store_id, views.store_trends, exclude_macro_issues=True)
 
     # Get store positive and negative highlights
-    best_highlight = feat.get_store_best_rankings(store_id, stores_ranked_df)
-    worst_highlight = feat.get_store_worse_rankings(store_id, stores_ranked_df)
-    general_highlight = feat.get_store_highlights(store_id, stores_ranked_df)
+    best_highlight = feat.get_store_best_rankings(store_id, views.stores_ranked_idx)
+    worst_highlight = feat.get_store_worse_rankings(store_id, views.stores_ranked_idx)
+    general_highlight = feat.get_store_highlights(store_id, views.stores_ranked_idx)
 
     return json({
         "store_id": store_id,
@@ -181,6 +340,53 @@ async def get_store_detail(request, store_id):
     })
 
 
+@bp_v0.route('/stores', methods=['GET', 'OPTIONS'])
+async def get_stores(request):
+    """
+    Get the stores catalog, optionally filtered by store_id prefix (?prefix=) and company (?company=)
+    E.g:
+    [{'store_id': 'magazine-luiza_0', 'company': 'magazine-luiza', 'store_type': 't3',
+      'latitude': '-23.5975251', 'longitude': '-46.6025457'}]
+    :param request:
+    :return: JSON
+    """
+    views = view_registry.current()
+    try:
+        limit = int(request.args.get("limit", 100))
+    except ValueError:
+        raise ServerError(status_code=400, message=f"Invalid limit")
+    if limit < 0:
+        raise ServerError(status_code=400, message=f"limit must not be negative")
+    tmp_df = views.store_dim.search(prefix=request.args.get("prefix", ""),
+                                    company_id=request.args.get("company"),
+                                    limit=limit)
+    return json(tmp_df.to_dict("records"))
+
+
+@bp_v0.route('/trends/<metric>/<direction>', methods=['GET', 'OPTIONS'])
+async def get_trending_stores(request, metric, direction):
+    """
+    Get every store improving or worsening on an issue metric
+    E.g:
+    [{'store_id': 'casas-bahia_5', 'performance': 'Consistently Improving'},
+     {'store_id': 'magazine-luiza_0', 'performance': 'Improving'}]
+    :param request:
+    :param metric: issue metric (e.g. product_issues_quality)
+    :param direction: improving/worsening
+    :return: JSON
+    """
+    views = view_registry.current()
+    store_trends = views.store_trends
+    issues = {feat.format_issues_columns(issue): issue for issue in store_trends.issues}
+    issue = issues.get(feat.format_issues_columns(metric))
+    if issue is None:
+        raise ServerError(status_code=400, message=f"Metric does not exist")
+    if direction not in TREND_DIRECTIONS:
+        raise ServerError(status_code=400, message=f"Direction must be one of {list(TREND_DIRECTIONS)}")
+    tmp_df = store_trends.get_trending_stores(issue, TREND_DIRECTIONS[direction])
+    return json(tmp_df.to_dict("records"))
+
+
 @bp_v0.route('/detail/company/<company_id>', methods=['GET', 'OPTIONS'])
 async def get_company_details(request, company_id):
     """
@@ -188,18 +394,19 @@ async def get_company_details(request, company_id):
     :param request:
     :return: JSON
     """
-    if company_id not in stores_ranked_df.company.unique():
+    views = view_registry.current()
+    if not views.stores_ranked_idx.contains("company", company_id):
         raise ServerError(status_code=400, message=f"Invalid Company ID.")
 
-    number_stores = feat.get_number_of_stores(company_id, stores_ranked_df)
-    ranked_companies = feat.get_ranked_companies(stores_ranked_df)
+    number_stores = feat.get_number_of_stores(company_id, views.store_dim)
+    ranked_companies = views.leaderboard.overall_ranking
 
     if company_id in ranked_companies:
         company_rank = ranked_companies[company_id]
     else:
         company_rank = "Not Available"
-    best_worst_stores = feat.get_best_worst_store(company_id, stores_ranked_df)
-    store_performants = feat.get_company_general_performance(company_id, stores_performance_agg_view)
+    best_worst_stores = feat.get_best_worst_store(company_id, views.stores_ranked_idx, views.store_dim)
+    store_performants = feat.get_company_general_performance(company_id, views.stores_performance_agg_view)
     return json({
         "company_id": company_id,
         "num_stores": number_stores,
@@ -207,3 +414,29 @@ async def get_company_details(request, company_id):
         "highlight_stores": best_worst_stores,
         "perfomants": store_performants
     })
+
+
+@bp_v0.route('/cache/stats', methods=['GET', 'OPTIONS'])
+async def get_cache_stats(request):
+    """
+    Get response cache usage (entries, size, hits/misses)
+    :param request:
+    :return: JSON
+    """
+    stats = response_cache.stats()
+    stats["views_version"] = view_registry.version
+    return json(stats)
+
+
+@bp_v0.route('/views/version', methods=['GET', 'OPTIONS'])
+async def get_views_version(request):
+    """
+    Get the active views version
+    E.g:
+    {'version': '72dc099a104c',
+     'loaded_at': '2020-05-20T13:02:11.120Z',
+     'rows': {'stores_ranked_df': 898, ...}}
+    :param request:
+    :return: JSON
+    """
+    return json(view_registry.current().describe())
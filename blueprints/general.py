@@ -1,9 +1,94 @@
+import hmac
+import os
+import resource
+import time
 from sanic import Blueprint
 from sanic.exceptions import ServerError, InvalidUsage
-from sanic.response import json
+from sanic.response import json, text
+from blueprints import bp_v0 as api_v0
+from libs import features
+from libs import metrics
 
 bp_admin = Blueprint('admin')
 
+views_load_seconds = metrics.registry.gauge("bnps_views_load_seconds", "Seconds spent loading each view",
+                                            labels=("view",))
+views_rows = metrics.registry.gauge("bnps_views_rows", "Rows of each loaded view", labels=("view",))
+views_memory = metrics.registry.gauge("bnps_views_memory_bytes", "Memory of each loaded view", labels=("view",))
+views_loaded_at = metrics.registry.gauge("bnps_views_loaded_timestamp_seconds",
+                                         "When the active views were loaded", labels=("version",))
+response_cache_bytes = metrics.registry.gauge("bnps_response_cache_bytes", "Size of the pre-serialized responses")
+max_rss = metrics.registry.gauge("bnps_process_max_resident_memory_bytes", "Peak resident memory of this worker")
+
+# libs.features helpers the routes call once per request. The single metric benchmark comparisons are
+# timed through the *_comparisons helpers they delegate to, per row helpers (evaluation_results,
+# format_issues_columns) are left out.
+TIMED_FEATURES = [
+    "get_number_of_stores",
+    "get_best_worst_store",
+    "get_company_general_performance",
+    "get_metric_distribution",
+    "get_company_bechmark_comparisons",
+    "get_companies_bechmark_comparison",
+    "get_store_bechmark_comparisons",
+    "format_bechmark_comparison",
+    "get_store_general_rankings",
+    "get_store_performance",
+    "get_store_highlights",
+    "get_store_best_rankings",
+    "get_store_worse_rankings",
+]
+
+
+def collect_views_metrics():
+    """
+    Refresh the view gauges from the load report of the active snapshot
+    """
+    snapshot = api_v0.view_registry.current()
+    if snapshot is None:
+        return
+    for gauge in [views_load_seconds, views_rows, views_memory, views_loaded_at]:
+        gauge.clear()
+    for name, report in snapshot.load_report.items():
+        views_load_seconds.set(report.get("seconds", 0), view=name)
+        if "rows" in report:
+            views_rows.set(report["rows"], view=name)
+        if "memory_mb" in report:
+            views_memory.set(int(report["memory_mb"] * 2 ** 20), view=name)
+    views_loaded_at.set(round(snapshot.loaded_at, 3), version=snapshot.version)
+
+    response_cache = getattr(api_v0, "response_cache", None)
+    if response_cache is not None:
+        response_cache_bytes.set(response_cache.stats()["size_bytes"])
+    max_rss.set(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+
+metrics.registry.add_collector(collect_views_metrics)
+
+
+async def start_request_timer(request):
+    request.ctx.started_at = time.perf_counter()
+
+
+async def record_request_metrics(request, response):
+    started_at = getattr(request.ctx, "started_at", None)
+    metrics.observe_request(method=request.method,
+                            route=request.uri_template,
+                            status=response.status,
+                            seconds=time.perf_counter() - started_at if started_at is not None else None,
+                            size=len(getattr(response, "body", None) or b""))
+
+
+def setup_metrics(app):
+    """
+    Record latency, status and size of every response, and time the TIMED_FEATURES helpers if METRICS.time_features
+    :param app: sanic app
+    """
+    app.register_middleware(start_request_timer, "request")
+    app.register_middleware(record_request_metrics, "response")
+    if app.config.get("METRICS", {}).get("time_features", False):
+        metrics.instrument_module(features, TIMED_FEATURES)
+
 
 @bp_admin.route('/health', methods=["GET"])
 async def bp_healthcheck(request):
@@ -16,3 +101,43 @@ async def bp_healthcheck(request):
         raise ServerError(str(err), status_code=400)
     except Exception as err:
         raise ServerError("Internal error.", status_code=500)
+
+
+def check_admin_access(request):
+    """
+    Admin actions need the X-Admin-Token header when ADMIN.token (or the ADMIN_TOKEN env var) is set,
+    and are only accepted from localhost otherwise
+    """
+    token = request.app.config.get("ADMIN", {}).get("token") or os.environ.get("ADMIN_TOKEN")
+    if token:
+        if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), str(token)):
+            raise ServerError("Invalid admin token.", status_code=403)
+    elif request.ip not in ("127.0.0.1", "::1", "localhost"):
+        raise ServerError("Admin actions are only accepted from localhost without ADMIN.token.", status_code=403)
+
+
+@bp_admin.route('/views/reload', methods=["POST"])
+async def reload_views(request):
+    """
+    Reload the views of the worker handling the request if the files changed, its active snapshot keeps
+    serving meanwhile. The other workers pick up the new files on their next VIEWS.watch_interval poll.
+    :param request:
+    :return: JSON
+    """
+    check_admin_access(request)
+    reloaded = await api_v0.view_registry.reload()
+    resp = api_v0.view_registry.current().describe()
+    resp["reloaded"] = reloaded
+    resp["pid"] = os.getpid()
+    return json(resp)
+
+
+@bp_admin.route('/metrics', methods=["GET"])
+async def get_metrics(request):
+    """
+    Metrics of this worker in the Prometheus text format: request latency/status/size per route template,
+    timed TIMED_FEATURES helpers (METRICS.time_features) and the loaded views
+    :param request:
+    :return: text
+    """
+    return text(metrics.registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,243 @@
+import os
+import pickle
+from typing import *
+
+import numpy as np
+import pandas as pd
+
+from libs.views import get_view_file_names, load_view, publish_view_files
+
+STORES_TS_FILE = "stores_ts_quarterly.pckl"
+
+# Metrics where a higher value ranks better, issue rates rank better the lower they are
+HIGHER_IS_BETTER = ["rating"]
+
+
+def to_quarter_end(dates) -> pd.DatetimeIndex:
+    """
+    Quarter of every date, as the quarter's last day (the date_comment of the quarterly views)
+    """
+    return pd.PeriodIndex(pd.DatetimeIndex(dates), freq="Q").to_timestamp(how="end").normalize()
+
+
+def get_ranked_metrics(columns: Iterable[str]) -> List[str]:
+    return [col for col in columns if col in HIGHER_IS_BETTER or ("issues" in col and not col.endswith("_rank"))]
+
+
+def get_rank_column(metric: str) -> str:
+    return "_".join(metric.split(" ")).lower() + "_rank"
+
+
+class QuarterlyAggregates:
+    """
+    Running sums and non null counts of every review metric per (store_id, quarter).
+
+    New reviews are folded in with one groupby over the new rows, so a day of data only touches the
+    (store, quarter) pairs it has reviews for. Store means and the store_type benchmarks are ratios of
+    these sums, i.e. review weighted like a full recompute.
+    """
+
+    def __init__(self, metrics: List[str]):
+        self.metrics = list(metrics)
+        index = pd.MultiIndex.from_arrays([[], []], names=["store_id", "date_comment"])
+        self.sums = pd.DataFrame(columns=self.metrics, index=index, dtype=float)
+        self.counts = pd.DataFrame(columns=self.metrics, index=index, dtype=float)
+        self.store_types = pd.Series(dtype=object)
+
+    def fold(self, reviews_df: "pd.DataFrame") -> List[pd.Timestamp]:
+        """
+        Add the reviews of a dataFrame [store_id, store_type, date_comment, *metrics] to the aggregates
+        :param reviews_df: new reviews, date_comment being the review datetime
+        :return: quarters that got new reviews
+        """
+        if reviews_df.shape[0] == 0:
+            return []
+        keys = pd.DataFrame({"store_id": reviews_df.store_id.values,
+                             "date_comment": to_quarter_end(reviews_df.date_comment.values)})
+        grouped = reviews_df[self.metrics].astype(float).set_index(pd.MultiIndex.from_frame(keys)).groupby(
+            level=["store_id", "date_comment"])
+
+        self.sums = self.sums.add(grouped.sum(), fill_value=0)
+        self.counts = self.counts.add(grouped.count().astype(float), fill_value=0)
+        store_types = reviews_df.dropna(subset=["store_type"]).drop_duplicates("store_id", keep="last")
+        self.store_types = pd.concat([self.store_types, store_types.set_index("store_id").store_type])
+        self.store_types = self.store_types[~self.store_types.index.duplicated(keep="last")]
+        return [pd.Timestamp(quarter) for quarter in sorted(keys.date_comment.unique())]
+
+    def get_stores_ts(self) -> "pd.DataFrame":
+        """
+        Store means per quarter, same layout as stores_ts_quarterly
+        :return: dataFrame [date_comment, *metrics, store_id, store_type]
+        """
+        means = (self.sums / self.counts).where(self.counts > 0).reset_index()
+        means["store_type"] = means.store_id.map(self.store_types)
+        return means[["date_comment"] + self.metrics + ["store_id", "store_type"]]
+
+    def get_benchmarks(self) -> "pd.DataFrame":
+        """
+        Review means per store_type and quarter, same layout as benchmarks_ts_quarterly
+        :return: dataFrame [date_comment, *metrics, store_type]
+        """
+        keys = [self.sums.index.get_level_values("store_id").map(self.store_types).rename("store_type"),
+                self.sums.index.get_level_values("date_comment")]
+        sums, counts = self.sums.groupby(keys).sum(), self.counts.groupby(keys).sum()
+        benchmarks = (sums / counts).where(counts > 0).reset_index()
+        return benchmarks[["date_comment"] + self.metrics + ["store_type"]]
+
+    def save(self, path: str):
+        _write_pickle(self, path)
+
+    @staticmethod
+    def load(path: str) -> "QuarterlyAggregates":
+        return pickle.load(open(path, "rb"))
+
+
+def rank_stores(stores_ts: "pd.DataFrame", by: str, quarters: Optional[List[pd.Timestamp]] = None,
+                previous: Optional["pd.DataFrame"] = None) -> "pd.DataFrame":
+    """
+    Percentile rank of every ranked metric among the stores of the same quarter and `by` cohort
+    :param stores_ts: store means [date_comment, *metrics, store_id, by]
+    :param by: cohort column (store_type or company)
+    :param quarters: only rank these quarters, taking the other ranks from previous
+    :param previous: previously ranked view of the same cohort
+    :return: dataFrame [*rank columns] aligned with stores_ts
+    """
+    metrics = get_ranked_metrics(stores_ts.columns)
+    rank_columns = [get_rank_column(metric) for metric in metrics]
+    ranks = pd.DataFrame(np.nan, index=stores_ts.index, columns=rank_columns)
+
+    rerank = np.ones(stores_ts.shape[0], dtype=bool)
+    if quarters is not None and previous is not None and set(rank_columns) <= set(previous.columns):
+        rerank = stores_ts.date_comment.isin(quarters).values
+        kept = stores_ts.loc[~rerank, ["store_id", "date_comment"]].merge(
+            previous[["store_id", "date_comment"] + rank_columns], how="left", on=["store_id", "date_comment"])
+        ranks.loc[~rerank, rank_columns] = kept[rank_columns].values
+
+    grouped = stores_ts.loc[rerank].groupby(["date_comment", by])
+    for metric, rank_column in zip(metrics, rank_columns):
+        ranks.loc[rerank, rank_column] = grouped[metric].rank(pct=True, ascending=metric in HIGHER_IS_BETTER)
+    return ranks
+
+
+def build_ranked_views(stores_ts: "pd.DataFrame", stores_info: "pd.DataFrame",
+                       quarters: Optional[List[pd.Timestamp]] = None,
+                       previous: Optional[Dict[str, "pd.DataFrame"]] = None) -> Dict[str, "pd.DataFrame"]:
+    """
+    Ranked views of the store means: by store_type among every store, by company among the company's stores
+    :param stores_ts: store means [date_comment, *metrics, store_id, store_type]
+    :param stores_info: dataFrame [store_id, company, latitude, longitude]
+    :param quarters: only re-rank these quarters (every quarter if None)
+    :param previous: views of the last build {view name: dataFrame}, to reuse the ranks of the other quarters
+    :return: {"stores_ranked_df": dataFrame, "stores_ranked_company_df": dataFrame}
+    """
+    previous = previous or {}
+    stores_ts = stores_ts.dropna(axis=1, how="all").reset_index(drop=True)
+
+    type_ranks = rank_stores(stores_ts, "store_type", quarters, previous.get("stores_ranked_df"))
+    stores_ranked_df = pd.concat([type_ranks, stores_ts], axis=1).merge(
+        stores_info[["store_id", "latitude", "longitude", "company"]], on="store_id")
+
+    company_ts = stores_ts.merge(stores_info[["store_id", "company", "latitude", "longitude"]], on="store_id")
+    company_ranks = rank_stores(company_ts, "company", quarters, previous.get("stores_ranked_company_df"))
+    stores_ranked_company_df = pd.concat([company_ranks, company_ts], axis=1)
+    return {"stores_ranked_df": stores_ranked_df, "stores_ranked_company_df": stores_ranked_company_df}
+
+
+def build_performance_agg_view(stores_ts: "pd.DataFrame", stores_info: "pd.DataFrame") -> "pd.DataFrame":
+    """
+    Number of issues each store is consistently improving (last two quarters down) and worsening (up) on
+    :param stores_ts: store means [date_comment, *metrics, store_id, store_type]
+    :param stores_info: dataFrame [store_id, company, latitude, longitude]
+    :return: dataFrame [worsening, improving, store_id, company, latitude, longitude]
+    """
+    issues = [col for col in stores_ts.columns if "issues_" in col]
+    stores_ts = stores_ts.sort_values(["store_id", "date_comment"])
+    diffs = stores_ts.groupby("store_id")[issues].diff()
+    previous = diffs.groupby(stores_ts.store_id.values).shift(1)
+    is_last = ~stores_ts.store_id.duplicated(keep="last").values
+    last, previous = diffs.values[is_last], previous.values[is_last]
+
+    with np.errstate(invalid="ignore"):
+        performance = pd.DataFrame({"worsening": ((last > 0) & (previous > 0)).sum(axis=1),
+                                    "improving": ((last < 0) & (previous < 0)).sum(axis=1),
+                                    "store_id": stores_ts.store_id.values[is_last]})
+    return performance.merge(stores_info[["store_id", "company", "latitude", "longitude"]], on="store_id")
+
+
+def build_views(aggregates: QuarterlyAggregates, stores_info: "pd.DataFrame",
+                quarters: Optional[List[pd.Timestamp]] = None,
+                previous: Optional[Dict[str, "pd.DataFrame"]] = None) -> Dict[str, "pd.DataFrame"]:
+    """
+    Every serving view (VIEW_FILES names, plus stores_ts) from the quarterly aggregates
+    """
+    stores_ts = aggregates.get_stores_ts()
+    views = {"stores_ts": stores_ts}
+    views.update(build_ranked_views(stores_ts, stores_info, quarters, previous))
+    views["benchmark_df"] = aggregates.get_benchmarks()
+    views["stores_performance_agg_view"] = build_performance_agg_view(stores_ts, stores_info)
+    return views
+
+
+def _write_pickle(obj, path: str):
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def publish_views(views: Dict[str, "pd.DataFrame"], folder: str = "views") -> str:
+    """
+    Publish the view pickles as a new version of a folder; servers watching it pick it up on their next poll
+    :return: published version
+    """
+    if "stores_ts" in views:
+        _write_pickle(views["stores_ts"], os.path.join(folder, STORES_TS_FILE))
+    return publish_view_files(views, folder)
+
+
+def get_stores_info(ranked_df: "pd.DataFrame") -> "pd.DataFrame":
+    """
+    dataFrame [store_id, company, latitude, longitude] of the stores of a ranked view
+    """
+    return ranked_df[["store_id", "company", "latitude", "longitude"]].drop_duplicates("store_id")
+
+
+def update_views(reviews_df: "pd.DataFrame", state_path: str, folder: str = "views",
+                 stores_info: Optional["pd.DataFrame"] = None) -> List[pd.Timestamp]:
+    """
+    Fold new reviews into the saved quarterly aggregates, re-rank the quarters they touch and publish the views.
+    The state has to hold the whole history (a first update_views over every review creates it).
+    :param reviews_df: new reviews [store_id, store_type, date_comment, *metrics]
+    :param state_path: pickle with the QuarterlyAggregates (created from reviews_df's metrics if missing)
+    :param folder: views folder
+    :param stores_info: dataFrame [store_id, company, latitude, longitude] of new (or changed) stores, the other
+    stores keep their info from the current views. Required when the folder has no views yet.
+    :return: updated quarters
+    """
+    if os.path.exists(state_path):
+        aggregates = QuarterlyAggregates.load(state_path)
+    else:
+        metrics = [col for col in reviews_df.columns
+                   if col not in ("store_id", "store_type", "date_comment") and reviews_df[col].dtype.kind in "biuf"]
+        aggregates = QuarterlyAggregates(metrics)
+
+    previous = {name: load_view(folder, file_name) for name, file_name in get_view_file_names(folder).items()
+                if os.path.exists(os.path.join(folder, file_name))}
+    if "stores_ranked_df" in previous:
+        known_stores = get_stores_info(previous["stores_ranked_df"])
+        stores_info = known_stores if stores_info is None else pd.concat(
+            [stores_info[known_stores.columns], known_stores]).drop_duplicates("store_id")
+    elif stores_info is None:
+        raise ValueError(f"No views on {folder} to take the stores info from, pass stores_info")
+
+    quarters = aggregates.fold(reviews_df)
+    # Stores without info would be ranked in their store_type cohort but dropped from the views
+    stores = aggregates.sums.index.get_level_values("store_id").unique()
+    missing = stores[~stores.isin(stores_info.store_id)]
+    if missing.size > 0:
+        raise ValueError(f"Stores missing from stores_info: {sorted(missing)[:10]} ({missing.size} stores)")
+
+    os.makedirs(folder, exist_ok=True)
+    publish_views(build_views(aggregates, stores_info, quarters, previous), folder)
+    aggregates.save(state_path)
+    return quarters
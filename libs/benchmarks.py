@@ -0,0 +1,73 @@
+from typing import *
+
+import numpy as np
+import pandas as pd
+
+
+class CompanyBenchmarks:
+    """
+    Grouped sums and counts of every numeric metric per (company, date_comment), computed once per view.
+
+    A company's benchmark on a date is the mean over every other store, i.e.
+    (total sum - company sum) / (total count - company count), so any company series (or all of
+    them at once) comes out of a few array operations instead of two groupbys over the view.
+    """
+
+    def __init__(self, type_ts: "pd.DataFrame"):
+        self.metrics = [col for col in type_ts.columns if type_ts[col].dtype.kind in "biuf"]
+
+        valid_dates = type_ts.date_comment.notna().values
+        date_codes, dates = pd.factorize(type_ts.date_comment.values[valid_dates], sort=True)
+        self.dates = pd.Series(pd.to_datetime(dates)).astype(str).values
+
+        has_company = type_ts.company.notna().values[valid_dates]
+        company_codes, self.companies = pd.factorize(type_ts.company.values[valid_dates][has_company], sort=True)
+        self._companies = {company: code for code, company in enumerate(self.companies)}
+
+        n_dates, n_companies = len(dates), len(self.companies)
+        groups = company_codes * n_dates + date_codes[has_company]
+        bincount = lambda weights, codes, size: np.bincount(codes, weights=weights, minlength=size)
+
+        # Rows per (company, date) and date: the dates a company/its benchmark have data for
+        self.rows = bincount(None, groups, n_dates * n_companies).reshape(n_companies, n_dates)
+        self.total_rows = bincount(None, date_codes, n_dates)
+
+        self.sums, self.counts, self.total_sums, self.total_counts = {}, {}, {}, {}
+        for metric in self.metrics:
+            values = type_ts[metric].values[valid_dates].astype(float)
+            has_value = ~np.isnan(values)
+            values = np.where(has_value, values, 0.)
+
+            self.sums[metric] = bincount(values[has_company], groups, n_dates * n_companies).reshape(
+                n_companies, n_dates)
+            self.counts[metric] = bincount(has_value[has_company].astype(float), groups,
+                                           n_dates * n_companies).reshape(n_companies, n_dates)
+            self.total_sums[metric] = bincount(values, date_codes, n_dates)
+            self.total_counts[metric] = bincount(has_value.astype(float), date_codes, n_dates)
+
+    def get_series(self, metric: str, company_ids: Optional[List[str]] = None) -> Dict[str, "pd.DataFrame"]:
+        """
+        Company mean x benchmark (every other store) series of a metric
+        :param metric: numeric metric
+        :param company_ids: companies to get, all of them by default
+        :return: {company_id: dataFrame [date_comment, metric, benchmark]} on the dates both have data for
+        """
+        if company_ids is None:
+            company_ids = list(self.companies)
+        codes = [self._companies[company_id] for company_id in company_ids if company_id in self._companies]
+
+        sums, counts = self.sums[metric][codes], self.counts[metric][codes]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            company_means = sums / counts
+            benchmark_means = (self.total_sums[metric] - sums) / (self.total_counts[metric] - counts)
+        company_means[counts == 0] = np.nan
+        benchmark_means[self.total_counts[metric] - counts == 0] = np.nan
+        has_dates = (self.rows[codes] > 0) & (self.total_rows - self.rows[codes] > 0)
+
+        resp = dict()
+        for row, code in enumerate(codes):
+            mask = has_dates[row]
+            resp[self.companies[code]] = pd.DataFrame({"date_comment": self.dates[mask],
+                                                       "metric": company_means[row][mask],
+                                                       "benchmark": benchmark_means[row][mask]})
+        return resp
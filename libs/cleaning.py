@@ -1,13 +1,16 @@
 from datetime import datetime
+from typing import *
 import numpy as np
 import pandas as pd
 from libs.maps import tag_map
 
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
 
 def extract_days_to_resolution(review: dict):
     if "datetime" in review and "reply" in review["responses"]["final"]:
-        init_dt = datetime.strptime(review["datetime"], '%Y-%m-%dT%H:%M:%SZ')
-        final_ans_dt = datetime.strptime(review["responses"]["final"]["reply"][0]["datetime"], '%Y-%m-%dT%H:%M:%SZ')
+        init_dt = datetime.strptime(review["datetime"], DATETIME_FORMAT)
+        final_ans_dt = datetime.strptime(review["responses"]["final"]["reply"][0]["datetime"], DATETIME_FORMAT)
         days_diff = (final_ans_dt - init_dt).days
         if days_diff < 0:
             return 0
@@ -17,8 +20,8 @@ def extract_days_to_resolution(review: dict):
 
 def extract_days_to_first_contact(review: dict):
     if "datetime" in review and "business" in review["responses"] and len(review["responses"]["business"]) > 0:
-        init_dt = datetime.strptime(review["datetime"], '%Y-%m-%dT%H:%M:%SZ')
-        final_ans_dt = datetime.strptime(review["responses"]["business"][0]["datetime"], '%Y-%m-%dT%H:%M:%SZ')
+        init_dt = datetime.strptime(review["datetime"], DATETIME_FORMAT)
+        final_ans_dt = datetime.strptime(review["responses"]["business"][0]["datetime"], DATETIME_FORMAT)
         days_diff = (final_ans_dt - init_dt).days
         if days_diff < 0:
             return 0
@@ -26,6 +29,36 @@ def extract_days_to_first_contact(review: dict):
     return np.nan
 
 
+def get_resolution_datetimes(review: dict) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Raw (review datetime, final reply datetime) used by extract_days_to_resolution, None when it has no resolution
+    """
+    if "datetime" in review and "reply" in review["responses"]["final"]:
+        return review["datetime"], review["responses"]["final"]["reply"][0]["datetime"]
+    return None, None
+
+
+def get_first_contact_datetimes(review: dict) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Raw (review datetime, first business reply datetime) used by extract_days_to_first_contact
+    """
+    if "datetime" in review and "business" in review["responses"] and len(review["responses"]["business"]) > 0:
+        return review["datetime"], review["responses"]["business"][0]["datetime"]
+    return None, None
+
+
+def extract_days_between(start_dts: Sequence[Optional[str]], end_dts: Sequence[Optional[str]]) -> pd.Series:
+    """
+    Vectorized extract_days_to_*: whole days from start to end datetime strings, negative values clipped to 0
+    :param start_dts: DATETIME_FORMAT strings, None when missing
+    :param end_dts: DATETIME_FORMAT strings, None when missing
+    :return: days per pair (NaN when missing), int64 when no pair is missing
+    """
+    start = pd.to_datetime(pd.Series(start_dts, dtype=object), format=DATETIME_FORMAT)
+    end = pd.to_datetime(pd.Series(end_dts, dtype=object), format=DATETIME_FORMAT)
+    return (end - start).dt.days.clip(lower=0)
+
+
 def extract_seals(review: dict):
     """
     Extract seals from review dict
@@ -46,17 +79,102 @@ def extract_seals(review: dict):
     return seal_struct
 
 
-def format_RA_to_df(review):
+def get_tag_columns(tags_by_macro: dict) -> List[str]:
     """
-    Format scrapped review dict into a pandas friendly data structure
-    :param review:
+    Tag count columns of the RA dataframe, in output order ("{macro}_{sub_tag}" or "{macro}")
+    :param tags_by_macro: tag map (maps.tag_map)
     :return:
     """
+    columns = []
+    for macro, vals in tags_by_macro.items():
+        if isinstance(vals, dict):
+            columns.extend(f"{macro}_{sub_t}" for sub_t in vals.keys())
+        else:
+            columns.append(macro)
+    return columns
+
+
+def build_tag_index(tags_by_macro: dict) -> Dict[str, List[int]]:
+    """
+    Inverted tag map: tag -> positions (in get_tag_columns) of the columns it counts for
+    :param tags_by_macro: tag map (maps.tag_map)
+    :return:
+    """
+    index = dict()
+    col = 0
+    for macro, vals in tags_by_macro.items():
+        for tags in (vals.values() if isinstance(vals, dict) else [vals]):
+            for tag in tags:
+                index.setdefault(tag, []).append(col)
+            col += 1
+    return index
+
+
+TAG_COLUMNS = get_tag_columns(tag_map)
+TAG_INDEX = build_tag_index(tag_map)
+
+
+def count_tags(tags: Iterable[str]) -> dict:
+    """
+    Tag counts of a single review
+    :param tags: review tags
+    :return: {tag column: count, NaN when the review has no tag of the column}
+    """
+    counts = {col: np.nan for col in TAG_COLUMNS}
+    for tag in tags:
+        for col in TAG_INDEX.get(tag, ()):
+            tag_name = TAG_COLUMNS[col]
+            counts[tag_name] = 1 if isinstance(counts[tag_name], float) else counts[tag_name] + 1
+    return counts
+
+
+def count_tags_batch(tag_lists: Iterable[Iterable[str]]) -> np.ndarray:
+    """
+    Tag count matrix of several reviews in one pass
+    :param tag_lists: tags of every review
+    :return: int array (n_reviews, len(TAG_COLUMNS))
+    """
+    rows, cols = [], []
+    n_reviews = 0
+    for row, tags in enumerate(tag_lists):
+        n_reviews += 1
+        for tag in tags:
+            tag_cols = TAG_INDEX.get(tag)
+            if tag_cols is not None:
+                rows.extend([row] * len(tag_cols))
+                cols.extend(tag_cols)
+
+    counts = np.zeros((n_reviews, len(TAG_COLUMNS)), dtype=np.int64)
+    np.add.at(counts, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), 1)
+    return counts
+
+
+def get_tag_count_df(tag_lists: Iterable[Iterable[str]], index=None) -> pd.DataFrame:
+    """
+    Tag count columns of several reviews, with the dtypes format_RA_to_df rows get
+    (NaN when a review has no tag of a column, int64 for columns every review counts)
+    :param tag_lists: tags of every review
+    :param index: dataFrame index
+    :return: dataFrame [TAG_COLUMNS]
+    """
+    counts = count_tags_batch(tag_lists)
+    columns = dict()
+    for col, tag_name in enumerate(TAG_COLUMNS):
+        values = counts[:, col]
+        columns[tag_name] = values if values.all() and values.size > 0 else np.where(values > 0, values, np.nan)
+    return pd.DataFrame(columns, index=index)
+
+
+def _format_RA_fields(review: dict, with_latencies: bool = True) -> dict:
+    """
+    Every format_RA_to_df column but the tag counts
+    :param with_latencies: compute days_to_resolution/days_to_first_contact (NaN placeholders otherwise)
+    """
     cols_for_df = ['title', 'description', 'business_name', 'uf', 'city', 'review_ID', 'datetime', 'timeCaptured']
     r_cp = {col: review[col] for col in cols_for_df if col in review}
 
-    r_cp["days_to_resolution"] = extract_days_to_resolution(review)
-    r_cp["days_to_first_contact"] = extract_days_to_first_contact(review)
+    r_cp["days_to_resolution"] = extract_days_to_resolution(review) if with_latencies else np.nan
+    r_cp["days_to_first_contact"] = extract_days_to_first_contact(review) if with_latencies else np.nan
     r_cp["resolution_outcome"] = review["responses"]["final"]["result"] if "responses" in review and "final" in review[
         "responses"] and "result" in review["responses"]["final"] else np.nan
 
@@ -64,38 +182,89 @@ def format_RA_to_df(review):
     seals = extract_seals(review)
     for seal_name, seal_value in seals.items():
         r_cp[seal_name] = seal_value
+    return r_cp
 
-    # Add macro-tags
-    macro_tags = tag_map.keys()
-    for t in macro_tags:
-        if isinstance(tag_map[t], dict):
-            for sub_t in tag_map[t].keys():
-                r_cp[f"{t}_{sub_t}"] = np.nan
-        else:
-            r_cp[t] = np.nan
 
-    # Count macro tags for complaint
-    if "tags" in review:
-        for tag in review["tags"]:
-            
-            for macro, vals in tag_map.items():
-                if isinstance(tag_map[macro], dict):
-                    
-                    for sub_t in tag_map[macro].keys():
-                        
-                        tag_name = f"{macro}_{sub_t}"
-                        
-                        if tag in tag_map[macro][sub_t]:
-                            if isinstance(r_cp[tag_name], type(np.nan)):
-                                r_cp[tag_name] = 1
-                            else:
-                                r_cp[tag_name] += 1
-                else:
-                    # Others type -> list
-                    if tag in vals:
-                        if isinstance(r_cp[macro], type(np.nan)):
-                            r_cp[macro] = 1
-                        else:
-                            r_cp[macro] += 1
+def format_RA_to_df(review):
+    """
+    Format scrapped review dict into a pandas friendly data structure
+    :param review:
+    :return:
+    """
+    r_cp = _format_RA_fields(review)
 
+    # Count macro tags for complaint
+    r_cp.update(count_tags(review.get("tags", [])))
     return r_cp
+
+
+def format_RA_batch_to_df(reviews: List[dict], index=None) -> pd.DataFrame:
+    """
+    Format several scrapped review dicts at once, same as pd.DataFrame([format_RA_to_df(r) for r in reviews])
+    :param reviews: scrapped reviews
+    :param index: dataFrame index
+    :return:
+    """
+    if len(reviews) == 0:
+        return pd.DataFrame(index=index)
+    fields_df = pd.DataFrame([_format_RA_fields(r, with_latencies=False) for r in reviews], index=index)
+
+    # Latencies: every datetime of the chunk parsed at once
+    for col, get_datetimes in [("days_to_resolution", get_resolution_datetimes),
+                               ("days_to_first_contact", get_first_contact_datetimes)]:
+        start_dts, end_dts = zip(*(get_datetimes(r) for r in reviews))
+        fields_df[col] = extract_days_between(start_dts, end_dts).values
+    tags_df = get_tag_count_df((r.get("tags", []) for r in reviews), index=fields_df.index)
+
+    # Keep the column order of the row by row build: first review fields, tags, fields only later reviews have
+    first_fields = _format_RA_fields(reviews[0]).keys()
+    later_fields = [col for col in fields_df.columns if col not in first_fields]
+    return pd.concat([fields_df.drop(columns=later_fields), tags_df, fields_df[later_fields]], axis=1)
+
+
+STORE_REVIEW_FIELDS = ['n_photo_user', 'n_review_user', 'rating', 'len_comment', 'relative']
+
+
+def get_store_tag_columns(tags_by_macro: dict) -> Tuple[List[str], Dict[str, List[str]]]:
+    """
+    Tag columns of the store views: a flag per single macro and per issue sub tag, and a total per macro
+    :param tags_by_macro: tag map (maps.tag_map)
+    :return: (flag columns, {macro total column: tag columns it sums})
+    """
+    flags, totals = [], dict()
+    for macro, vals in tags_by_macro.items():
+        if isinstance(vals, dict):
+            sub_columns = [f"{macro}_{sub_t}" for sub_t in vals.keys()]
+            totals[macro] = sub_columns
+            if "issues" in macro:
+                flags.extend(sub_columns)
+        else:
+            flags.append(macro)
+    return flags, totals
+
+
+STORE_TAG_COLUMNS, STORE_TAG_TOTALS = get_store_tag_columns(tag_map)
+
+
+def format_store_reviews_batch_to_df(reviews: List[dict], index=None) -> pd.DataFrame:
+    """
+    Format scrapped store reviews (review_ID, store_id, datetime, STORE_REVIEW_FIELDS, tags) into the
+    per review rows the quarterly store views average: 1/0 tag flags and per macro tag totals
+    :param reviews: scrapped store reviews
+    :param index: dataFrame index
+    :return: dataFrame [review_ID, store_id, date_comment, *STORE_REVIEW_FIELDS, *STORE_TAG_COLUMNS, *STORE_TAG_TOTALS]
+    """
+    df = pd.DataFrame({"review_ID": [r.get("review_ID") for r in reviews],
+                       "store_id": [r.get("store_id") for r in reviews],
+                       "date_comment": pd.to_datetime(pd.Series([r.get("datetime") for r in reviews], dtype=object),
+                                                      format=DATETIME_FORMAT).values}, index=index)
+    for field in STORE_REVIEW_FIELDS:
+        df[field] = pd.to_numeric(pd.Series([r.get(field) for r in reviews], dtype=object)).astype(float).values
+
+    flags = pd.DataFrame((count_tags_batch(r.get("tags", []) for r in reviews) > 0).astype(float),
+                         columns=TAG_COLUMNS, index=df.index)
+    for col in STORE_TAG_COLUMNS:
+        df[col] = flags[col]
+    for macro, sub_columns in STORE_TAG_TOTALS.items():
+        df[macro] = flags[sub_columns].sum(axis=1)
+    return df
@@ -0,0 +1,134 @@
+import json
+import os
+import uuid
+from typing import *
+
+import numpy as np
+import pandas as pd
+
+META_FILE = "meta.json"
+
+
+def _save_array(folder: str, file_name: str, values: np.ndarray):
+    """
+    Write an .npy file through a temp file + rename so processes mapping the previous file keep a valid mapping
+    """
+    tmp_path = os.path.join(folder, f".{file_name}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, values, allow_pickle=False)
+    os.replace(tmp_path, os.path.join(folder, file_name))
+
+
+def get_codes_dtype(n_categories: int) -> np.dtype:
+    """
+    Smallest int dtype pandas keeps the codes of n_categories categories in (a wider one would be copied)
+    """
+    for dtype in [np.int8, np.int16, np.int32]:
+        if n_categories < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def write_columnar(df: "pd.DataFrame", folder: str) -> str:
+    """
+    Write a dataFrame as memory-mappable .npy files
+
+    Numeric columns of the same dtype are stored as one (n_columns, n_rows) block, which is the
+    layout pandas keeps internally, so the loader can wrap the mapped block without copying it.
+    Datetimes are stored as int64 nanoseconds and string columns as categorical codes (in the int
+    width pandas keeps for that many categories) + sorted categories.
+    :param df: dataFrame to write
+    :param folder: output folder (one per dataFrame)
+    :return: build id of the written files
+    """
+    os.makedirs(folder, exist_ok=True)
+    build_id = uuid.uuid4().hex[:12]
+    columns = []
+    blocks = {}
+
+    for col in df.columns:
+        values = df[col].values
+        if values.dtype.kind in "biuf":
+            blocks.setdefault(values.dtype.str, []).append(col)
+            columns.append({"name": col, "kind": "block", "dtype": values.dtype.str})
+        elif values.dtype.kind == "M":
+            file_name = f"{build_id}.{len(columns)}.datetime.npy"
+            _save_array(folder, file_name, values.astype("datetime64[ns]").view("int64"))
+            columns.append({"name": col, "kind": "datetime", "file": file_name})
+        elif values.dtype.kind == "O" and all(isinstance(v, str) for v in df[col].dropna().values):
+            codes, categories = pd.factorize(values, sort=True)
+            file_name = f"{build_id}.{len(columns)}.codes.npy"
+            _save_array(folder, file_name, codes.astype(get_codes_dtype(len(categories))))
+            columns.append({"name": col, "kind": "string", "file": file_name, "categories": list(categories)})
+        else:
+            raise ValueError(f"Unsupported dtype '{values.dtype}' for column '{col}'")
+
+    block_files = {}
+    for dtype, cols in blocks.items():
+        file_name = f"{build_id}.{np.dtype(dtype).name}.npy"
+        _save_array(folder, file_name, np.ascontiguousarray(df[cols].values.T))
+        block_files[dtype] = {"file": file_name, "columns": cols}
+
+    if isinstance(df.index, pd.RangeIndex):
+        index = {"kind": "range", "start": df.index.start, "stop": df.index.stop, "step": df.index.step}
+    elif df.index.dtype.kind in "iu":
+        index = {"kind": "array", "file": f"{build_id}.index.npy"}
+        _save_array(folder, index["file"], df.index.values)
+    else:
+        raise ValueError(f"Unsupported index dtype '{df.index.dtype}'")
+
+    # meta.json goes last: readers only see the new build once every file it points to exists
+    meta = {"build_id": build_id, "rows": len(df), "columns": columns, "blocks": block_files, "index": index}
+    tmp_path = os.path.join(folder, f".{META_FILE}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(folder, META_FILE))
+
+    # Unlinking the previous build is safe for readers that already mapped it
+    for file_name in os.listdir(folder):
+        if file_name.endswith(".npy") and not file_name.startswith(build_id):
+            os.remove(os.path.join(folder, file_name))
+    return build_id
+
+
+def read_columnar(folder: str, mmap_mode: Optional[str] = "r") -> "pd.DataFrame":
+    """
+    Load a dataFrame written by write_columnar, mapping its files instead of reading them
+    :param folder: dataFrame folder
+    :param mmap_mode: numpy mmap mode ('r' read-only shared pages, None to read in memory)
+    :return: dataFrame whose largest numeric block is backed by the mapped files. Other columns are
+             private copies per process, string columns as categoricals over their small int codes
+    """
+    with open(os.path.join(folder, META_FILE)) as f:
+        meta = json.load(f)
+    load = lambda file_name: np.load(os.path.join(folder, file_name), mmap_mode=mmap_mode, allow_pickle=False)
+
+    if meta["index"]["kind"] == "range":
+        index = pd.RangeIndex(meta["index"]["start"], meta["index"]["stop"], meta["index"]["step"])
+    else:
+        index = pd.Index(load(meta["index"]["file"]))
+
+    # The largest numeric block becomes the frame's base block, wrapped without a copy
+    blocks = {dtype: (load(block["file"]), block["columns"]) for dtype, block in meta["blocks"].items()}
+    base_dtype = max(blocks, key=lambda dtype: len(blocks[dtype][1])) if blocks else None
+    if base_dtype is not None:
+        base_values, base_columns = blocks[base_dtype]
+        df = pd.DataFrame(base_values.T, columns=base_columns, index=index, copy=False)
+    else:
+        df = pd.DataFrame(index=index)
+
+    # Insert the remaining columns at their original positions
+    for position, col in enumerate(meta["columns"]):
+        if col["kind"] == "block":
+            if col["dtype"] == base_dtype:
+                continue
+            values, block_columns = blocks[col["dtype"]]
+            values = values[block_columns.index(col["name"])]
+        elif col["kind"] == "datetime":
+            values = load(col["file"]).view("datetime64[ns]")
+        else:
+            # Inserting copies the codes (1-2 bytes a row here) into each worker, still far below an object
+            # array of the strings; only the numeric base block stays shared through the mapping
+            values = pd.Categorical.from_codes(load(col["file"]), categories=col["categories"])
+        df.insert(position, col["name"], values)
+    return df
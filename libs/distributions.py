@@ -0,0 +1,91 @@
+from typing import *
+
+import numpy as np
+import pandas as pd
+
+
+class MetricDistributions:
+    """
+    Sorted values of every numeric metric per (date_comment, company) and per date_comment.
+
+    A histogram is then a searchsorted of the bin edges over two sorted slices, so its cost
+    depends on the number of bins and not on the number of stores. The benchmark (every store
+    but the company's) is the date histogram minus the company histogram.
+    """
+
+    def __init__(self, type_ts: "pd.DataFrame"):
+        self.metrics = [col for col in type_ts.columns if type_ts[col].dtype.kind in "biuf"]
+
+        dates = type_ts.date_comment.values.astype("datetime64[ns]").view("int64")
+        valid_dates = type_ts.date_comment.notna().values
+        date_codes, date_values = pd.factorize(dates[valid_dates], sort=True)
+        has_company = type_ts.company.notna().values
+        company_codes = np.full(type_ts.shape[0], -1)
+        codes, self.companies = pd.factorize(type_ts.company.values[has_company], sort=True)
+        company_codes[has_company] = codes
+        company_codes = company_codes[valid_dates]
+
+        self._dates = {date: code for code, date in enumerate(date_values)}
+        self._companies = {company: code for code, company in enumerate(self.companies)}
+        n_groups = len(date_values) * len(self.companies)
+
+        self._date_values, self._date_offsets = {}, {}
+        self._company_values, self._company_offsets = {}, {}
+        for metric in self.metrics:
+            values = type_ts[metric].values[valid_dates].astype(float)
+            has_value = ~np.isnan(values)
+
+            # Every store on a date (benchmark total)
+            self._date_values[metric], self._date_offsets[metric] = self._sort_groups(
+                values[has_value], date_codes[has_value], len(date_values))
+
+            # Stores of a company on a date
+            in_company = has_value & (company_codes >= 0)
+            group_codes = date_codes[in_company] * len(self.companies) + company_codes[in_company]
+            self._company_values[metric], self._company_offsets[metric] = self._sort_groups(
+                values[in_company], group_codes, n_groups)
+
+    @staticmethod
+    def _sort_groups(values: np.ndarray, group_codes: np.ndarray, n_groups: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Sort values by (group, value) and return them with the offsets of every group
+        """
+        order = np.lexsort((values, group_codes))
+        offsets = np.searchsorted(group_codes[order], np.arange(n_groups + 1), side="left")
+        return values[order], offsets
+
+    def _slice(self, values: np.ndarray, offsets: np.ndarray, group: Optional[int]) -> np.ndarray:
+        if group is None:
+            return values[0:0]
+        return values[offsets[group]:offsets[group + 1]]
+
+    def get_values(self, metric: str, dt_period, company_id: Optional[str] = None) -> np.ndarray:
+        """
+        Sorted non null values of a metric on a date (of a company's stores if company_id is given)
+        """
+        date_code = self._dates.get(pd.Timestamp(dt_period).value)
+        if company_id is None:
+            return self._slice(self._date_values[metric], self._date_offsets[metric], date_code)
+
+        company_code = self._companies.get(company_id)
+        group = None if date_code is None or company_code is None else date_code * len(self.companies) + company_code
+        return self._slice(self._company_values[metric], self._company_offsets[metric], group)
+
+    def get_histograms(self, metric: str, company_id: str, dt_period,
+                       edges: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Company and benchmark counts over the bins of edges (same binning as np.histogram)
+        :return: (company counts, benchmark counts)
+        """
+        company = sorted_histogram(self.get_values(metric, dt_period, company_id), edges)
+        total = sorted_histogram(self.get_values(metric, dt_period), edges)
+        return company, total - company
+
+
+def sorted_histogram(sorted_values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """
+    np.histogram of already sorted values: every bin is [edge_i, edge_i+1) but the last, which includes its right edge
+    """
+    positions = np.searchsorted(sorted_values, edges, side="left")
+    positions[-1] = np.searchsorted(sorted_values, edges[-1], side="right")
+    return np.diff(positions)
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import uuid
+from typing import *
+
+import numpy as np
+import pandas as pd
+
+from libs.model_inference import build_text_feature_matrix, get_vocabulary
+
+MANIFEST_FILE = "manifest.json"
+
+# Bump when tokenization or embedding averaging change, so stored vectors are not reused
+FEATURE_VERSION = 1
+# get_cached_text_feature_df merges the store into one segment past this many
+MAX_SEGMENTS = 16
+
+
+def get_model_fingerprint(model: "gensim.model") -> str:
+    """
+    Hash of the embedding model's vocabulary and vectors (and FEATURE_VERSION)
+    """
+    vocabulary, vectors = get_vocabulary(model)
+    digest = hashlib.sha1(f"v{FEATURE_VERSION}:{vectors.shape}:{vectors.dtype.str};".encode("utf-8"))
+    for word, row in sorted(vocabulary.items(), key=lambda item: item[1]):
+        digest.update(f"{word}\n".encode("utf-8"))
+    digest.update(memoryview(np.ascontiguousarray(vectors)).cast("B"))
+    return digest.hexdigest()[:16]
+
+
+def _save_array(folder: str, file_name: str, values: np.ndarray):
+    tmp_path = os.path.join(folder, f".{file_name}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, values, allow_pickle=False)
+    os.replace(tmp_path, os.path.join(folder, file_name))
+
+
+class FeatureStore:
+    """
+    On-disk review_ID -> text feature vector store of one embedding model.
+
+    Vectors are kept in append-only .npy segments under {folder}/{fingerprint}, each with the
+    review_IDs it holds and whether the review had any known word. manifest.json lists the live
+    segments and is replaced last, so a crash while writing never exposes a partial segment.
+    dims sizes the vectors read from a store with no segments yet.
+    """
+
+    def __init__(self, folder: str, fingerprint: str, dims: int = 0):
+        self.folder = os.path.join(folder, fingerprint)
+        self.fingerprint = fingerprint
+        self.dims = dims
+        os.makedirs(self.folder, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        manifest_path = os.path.join(self.folder, MANIFEST_FILE)
+        self.segments = []
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.segments = json.load(f)["segments"]
+
+        load = lambda file_name: np.load(os.path.join(self.folder, file_name), mmap_mode="r", allow_pickle=False)
+        self._vectors = [load(f"{segment}.vectors.npy") for segment in self.segments]
+        self._has_vector = np.concatenate(
+            [load(f"{segment}.mask.npy") for segment in self.segments]) if self.segments else np.array([], dtype=bool)
+        self._ids = pd.Index(np.concatenate(
+            [load(f"{segment}.ids.npy") for segment in self.segments]) if self.segments else np.array([], dtype=str))
+        self._starts = np.cumsum([0] + [vectors.shape[0] for vectors in self._vectors])
+        if self._vectors:
+            self.dims = self._vectors[0].shape[1]
+
+    def __len__(self) -> int:
+        return self._ids.size
+
+    def locate(self, review_ids: Sequence) -> np.ndarray:
+        """
+        Positions of review_ids in the store, -1 for unknown reviews
+        """
+        return self._ids.get_indexer(np.asarray(review_ids).astype(str))
+
+    def get(self, review_ids: Sequence) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Stored vectors of several reviews
+        :return: (float32 vectors (zeros when missing), found mask, has_vector mask)
+        """
+        positions = self.locate(review_ids)
+        found = positions >= 0
+        vectors = np.zeros((positions.size, self.dims), dtype=np.float32)
+        has_vector = np.zeros(positions.size, dtype=bool)
+        has_vector[found] = self._has_vector[positions[found]]
+
+        # Found rows grouped by segment, so each segment reads its own slice of them
+        rows = np.flatnonzero(found)
+        segments = np.searchsorted(self._starts, positions[rows], side="right") - 1
+        order = np.argsort(segments, kind="stable")
+        rows, segments = rows[order], segments[order]
+        bounds = np.searchsorted(segments, np.arange(len(self._vectors) + 1), side="left")
+        for segment, segment_vectors in enumerate(self._vectors):
+            segment_rows = rows[bounds[segment]:bounds[segment + 1]]
+            if segment_rows.size > 0:
+                vectors[segment_rows] = segment_vectors[positions[segment_rows] - self._starts[segment]]
+        return vectors, found, has_vector
+
+    def add(self, review_ids: Sequence, vectors: np.ndarray, has_vector: np.ndarray):
+        """
+        Store the vectors of new reviews (reviews already stored are ignored) as a new segment
+        """
+        review_ids = np.asarray(review_ids).astype(str)
+        is_new = self.locate(review_ids) < 0
+        _, first = np.unique(review_ids, return_index=True)
+        is_first = np.zeros(review_ids.size, dtype=bool)
+        is_first[first] = True
+        is_new &= is_first
+        if not is_new.any():
+            return
+        self._write_segments([(review_ids[is_new], np.asarray(vectors, dtype=np.float32)[is_new],
+                               np.asarray(has_vector, dtype=bool)[is_new])], keep_segments=self.segments)
+
+    def retain(self, review_ids: Sequence):
+        """
+        Evict every review not in review_ids (e.g. out of the feature window) and compact the store
+        """
+        self._compact(self._ids.isin(np.asarray(review_ids).astype(str)))
+
+    def compact(self):
+        """
+        Merge every segment into one
+        """
+        self._compact(np.ones(len(self), dtype=bool))
+
+    def _compact(self, keep: np.ndarray):
+        positions = np.flatnonzero(keep)
+        review_ids = self._ids.values[positions]
+        vectors, _, has_vector = self.get(review_ids)
+        self._write_segments([(review_ids, vectors, has_vector)] if positions.size > 0 else [], keep_segments=[])
+
+    def _write_segments(self, segments: List[Tuple[np.ndarray, np.ndarray, np.ndarray]], keep_segments: List[str]):
+        names = []
+        for review_ids, vectors, has_vector in segments:
+            name = uuid.uuid4().hex[:12]
+            _save_array(self.folder, f"{name}.ids.npy", np.asarray(review_ids).astype(str))
+            _save_array(self.folder, f"{name}.vectors.npy", vectors)
+            _save_array(self.folder, f"{name}.mask.npy", has_vector)
+            names.append(name)
+
+        tmp_path = os.path.join(self.folder, f".{MANIFEST_FILE}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"fingerprint": self.fingerprint, "segments": keep_segments + names}, f)
+        os.replace(tmp_path, os.path.join(self.folder, MANIFEST_FILE))
+
+        # Segments no longer in the manifest
+        live = set(keep_segments + names)
+        for file_name in os.listdir(self.folder):
+            if file_name.endswith(".npy") and file_name.split(".")[0] not in live:
+                os.remove(os.path.join(self.folder, file_name))
+        self._load()
+
+
+def get_cached_text_feature_df(reviews_df, embedding_model, store_folder: str,
+                               chunk_size: int = 10000, workers: int = 1) -> "pd.DataFrame":
+    """
+    get_text_feature_df through a FeatureStore: only reviews never embedded by this model are tokenized
+    and embedded (then stored), every other vector is read from the store. The store is compacted once it
+    has more than MAX_SEGMENTS segments.
+    :param reviews_df: RA dataframe
+    :param embedding_model: gensim model
+    :param store_folder: feature store folder
+    :param chunk_size: reviews tokenized and embedded at a time
+    :param workers: processes embedding the new reviews
+    :return: float32 dataFrame [feat_0 .. feat_n], indexed by the position of the review in reviews_df
+    """
+    dims = get_vocabulary(embedding_model)[1].shape[1]
+    store = FeatureStore(store_folder, get_model_fingerprint(embedding_model), dims=dims)
+    review_ids = reviews_df.review_ID.values
+
+    missing = np.flatnonzero(store.locate(review_ids) < 0)
+    if missing.size > 0:
+        new_df = build_text_feature_matrix(reviews_df.iloc[missing], embedding_model, chunk_size=chunk_size,
+                                           workers=workers)
+        new_vectors = np.zeros((missing.size, dims), dtype=np.float32)
+        new_vectors[new_df.index.values] = new_df.values
+        new_has_vector = np.zeros(missing.size, dtype=bool)
+        new_has_vector[new_df.index.values] = True
+        store.add(review_ids[missing], new_vectors, new_has_vector)
+        if len(store.segments) > MAX_SEGMENTS:
+            store.compact()
+
+    vectors, _, has_vector = store.get(review_ids)
+    indexes = np.flatnonzero(has_vector)
+    return pd.DataFrame(vectors[indexes], columns=[f"feat_{i}" for i in range(dims)], index=indexes)
@@ -5,34 +5,25 @@ from typing import *
 import numpy as np
 import pandas as pd
 
+from libs.views import ViewIndex
 
-def get_number_of_stores(company_id: str, type_ts) -> int:
-    return type_ts.loc[type_ts.company == company_id].store_id.unique().size
 
+def get_number_of_stores(company_id: str, store_dim: "StoreDimension") -> int:
+    return store_dim.number_of_stores.get(company_id, 0)
 
-def get_lat_long(store_id: str, typ_ts) -> dict:
+
+def get_lat_long(store_id: str, store_dim: "StoreDimension") -> dict:
     """
     Return {latitude: n, longitude: n} of a particular store
     :param store_id:
-    :param typ_ts:
-    :return:
-    """
-    return typ_ts.loc[typ_ts.store_id == store_id].iloc[0][["latitude", "longitude"]].to_dict()
-
-
-def get_ranked_companies(type_ts) -> dict:
-    """
-    Get ranked companies
-    :param type_ts:
+    :param store_dim:
     :return:
     """
-    latest_period = type_ts.date_comment.drop_duplicates().sort_values().iloc[-1]
-    issues_metrics = [col for col in type_ts.columns if "issues" in col and "rank" not in col]
-    return type_ts.loc[type_ts.date_comment == latest_period].groupby("company").mean()[issues_metrics].mean(
-        axis=1).dropna().rank().sort_values().to_dict()
+    store = store_dim.get(store_id)
+    return {"latitude": store["latitude"], "longitude": store["longitude"]}
 
 
-def get_best_worst_store(company_id: str, type_ts):
+def get_best_worst_store(company_id: str, type_idx: "ViewIndex", store_dim: "StoreDimension"):
     """
     Get best/worst store
     Ex:
@@ -45,20 +36,20 @@ def get_best_worst_store(company_id: str, type_ts):
       'latitude': '-23.4947944',
       'longitude': '-46.4409685'}}
     :param company_id:
-    :param type_ts:
+    :param type_idx:
+    :param store_dim:
     :return:
     """
-    issues_metrics = [col for col in type_ts.columns if "issues" in col and "rank" in col]
-    latest_period = type_ts.date_comment.drop_duplicates().sort_values().iloc[-1]
+    issues_metrics = [col for col in type_idx.view.columns if "issues" in col and "rank" in col]
     ranked_stores = \
-        type_ts.loc[(type_ts.company == company_id) & (type_ts.date_comment == latest_period)].set_index("store_id")[
+        type_idx.rows("company", company_id, type_idx.latest_period).set_index("store_id")[
             issues_metrics].mean(axis=1).sort_values(ascending=False).dropna().reset_index()
     ranked_stores.columns = ["store_id", "avg_rank"]
     resp = dict()
     for label, data in zip(["best_store", "worst_store"],
                            [ranked_stores.iloc[0].to_dict(), ranked_stores.iloc[-1].to_dict()]):
         tmp = data.copy()
-        tmp.update(get_lat_long(tmp["store_id"], type_ts))
+        tmp.update(get_lat_long(tmp["store_id"], store_dim))
         resp[label] = tmp
     return resp
 
@@ -80,9 +71,11 @@ def get_company_general_performance(company_id: str, stores_performance_agg_view
     return resp
 
 
-def get_metric_distribution(metric: str, company_id: str, dt_com: str, store_ts, bins: int = 10) -> dict:
+def get_metric_distribution(metric: str, company_id: str, dt_com: str, distributions: "MetricDistributions",
+                            bins: int = 10, metric_range: Optional[List[float]] = None) -> dict:
     """
     Get metric distribution for a company id against benchmark
+    :param metric_range: [min, max] of the bins, defaults to [0, 5] for rating and [0, 0.5] otherwise
     :return: Ex
     {'x_range': [0.0, 0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0],
      'benchmark': [0, 0, 0, 0, 0, 1, 4, 103, 31, 1],
@@ -90,16 +83,13 @@ def get_metric_distribution(metric: str, company_id: str, dt_com: str, store_ts,
      'metric': 'rating',
      'date': '2019-06-30'}
     """
-    if metric == "rating":
-        metric_range = [0, 5]
-    else:
-        metric_range = [0, 0.5]
-    binned_company, xrange = np.histogram(
-        store_ts.loc[(store_ts.company == company_id) & (store_ts.date_comment == dt_com)][metric].dropna().values,
-        bins=bins, range=metric_range)
-    binned_benchmark, _ = np.histogram(
-        store_ts.loc[(store_ts.company != company_id) & (store_ts.date_comment == dt_com)][metric].dropna().values,
-        bins=bins, range=metric_range)
+    if metric_range is None:
+        if metric == "rating":
+            metric_range = [0, 5]
+        else:
+            metric_range = [0, 0.5]
+    xrange = np.linspace(float(metric_range[0]), float(metric_range[1]), bins + 1)
+    binned_company, binned_benchmark = distributions.get_histograms(metric, company_id, dt_com, xrange)
 
     binned_benchmark = binned_benchmark / binned_benchmark.sum(axis=0, keepdims=1)
     binned_company = binned_company / binned_company.sum(axis=0, keepdims=1)
@@ -111,45 +101,81 @@ def get_metric_distribution(metric: str, company_id: str, dt_com: str, store_ts,
             "metric": metric}
 
 
-def get_company_bechmark_comparison(company_id: str, metric: str, stores_ts: "pd.DataFrame") -> pd.DataFrame:
+def get_company_bechmark_comparison(company_id: str, metric: str,
+                                    company_benchmarks: "CompanyBenchmarks") -> List[Dict[str, Any]]:
     """
     Provides a dict with company_id x benchmark on a particular metric
     """
-    # Filter and agg with benchmark data
-    tmp_df = stores_ts.loc[(stores_ts.company == company_id)][["date_comment", metric]].groupby(
-        "date_comment").mean().reset_index()
-    benchmark_ts = stores_ts.loc[(stores_ts.company != company_id)][["date_comment", metric]].groupby(
-        "date_comment").mean().reset_index()
-    tmp_df = tmp_df.merge(benchmark_ts, left_on="date_comment", right_on="date_comment",
-                          suffixes=('_company', '_benchmark'))
+    return get_company_bechmark_comparisons(company_id, [metric], company_benchmarks)[metric]
 
-    tmp_df.index = tmp_df.date_comment
-    tmp_df = tmp_df.drop("date_comment", axis=1)
 
-    tmp_df.columns = ["metric", "benchmark"]
-    tmp_df.reset_index(inplace=True)
-    tmp_df.date_comment = tmp_df.date_comment.astype(str)
+def get_company_bechmark_comparisons(company_id: str, metrics: List[str],
+                                     company_benchmarks: "CompanyBenchmarks") -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Company_id x benchmark records for several metrics
+    :return: {metric: [{'date_comment': '2019-06-30', 'metric': 4.0, 'benchmark': 3.87}, ...]}
+    """
+    resp = dict()
+    for metric in metrics:
+        tmp_df = company_benchmarks.get_series(metric, [company_id]).get(company_id)
+        resp[metric] = tmp_df.dropna(axis=1).to_dict("records") if tmp_df is not None else []
+    return resp
 
-    return tmp_df.dropna(axis=1).to_dict("records")
+
+def get_companies_bechmark_comparison(metric: str,
+                                      company_benchmarks: "CompanyBenchmarks") -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Every company x benchmark on a particular metric
+    :return: {company_id: [{'date_comment': '2019-06-30', 'metric': 4.0, 'benchmark': 3.87}, ...]}
+    """
+    return {company_id: tmp_df.dropna(axis=1).to_dict("records")
+            for company_id, tmp_df in company_benchmarks.get_series(metric).items()}
 
 
-def get_store_bechmark_comparison(store_id: str, metric: str, stores_ts: "pd.DataFrame",
-                                  benchmark_ts: "pd.DataFrame") -> pd.DataFrame:
+def get_store_bechmark_comparison(store_id: str, metric: str, stores_idx: "ViewIndex",
+                                  benchmark_ts: "pd.DataFrame", store_dim: "StoreDimension") -> pd.DataFrame:
     """
     Provides a dataframe with store_id x benchmark on a particular metric
     """
+    return get_store_bechmark_comparisons(store_id, [metric], stores_idx, benchmark_ts, store_dim)[metric]
+
+
+def get_store_bechmark_comparisons(store_id: str, metrics: List[str], stores_idx: "ViewIndex",
+                                   benchmark_ts: "pd.DataFrame",
+                                   store_dim: "StoreDimension") -> Dict[str, "pd.DataFrame"]:
+    """
+    Store_id x benchmark dataframes for several metrics, filtering the store/benchmark rows once
+    """
+    metrics = list(dict.fromkeys(metrics))
+
     # get benchmark class
-    store_class_map = stores_ts[["store_id", "store_type"]].drop_duplicates().set_index("store_id").to_dict()[
-        "store_type"]
-    store_class = store_class_map[store_id]
+    store_class = store_dim.get_store_type(store_id)
 
     # Filter and agg with benchmark data
-    tmp_df = stores_ts.loc[(stores_ts.store_id == store_id)][["date_comment", metric]]
-    tmp_df = tmp_df.merge(benchmark_ts.loc[(benchmark_ts.store_type == store_class)][["date_comment", metric]],
-                          left_on="date_comment", right_on="date_comment", suffixes=('_store', '_benchmark'))
-    tmp_df.index = tmp_df.date_comment
-    tmp_df = tmp_df.drop("date_comment", axis=1)
-    return tmp_df
+    store_ts = stores_idx.rows("store_id", store_id)[["date_comment"] + metrics]
+    store_benchmark_ts = benchmark_ts.loc[(benchmark_ts.store_type == store_class)][["date_comment"] + metrics]
+
+    resp = dict()
+    for metric in metrics:
+        tmp_df = store_ts[["date_comment", metric]].merge(store_benchmark_ts[["date_comment", metric]],
+                                                          left_on="date_comment", right_on="date_comment",
+                                                          suffixes=('_store', '_benchmark'))
+        tmp_df.index = tmp_df.date_comment
+        tmp_df = tmp_df.drop("date_comment", axis=1)
+        resp[metric] = tmp_df
+    return resp
+
+
+def format_bechmark_comparison(comparison_df: "pd.DataFrame") -> List[Dict[str, Any]]:
+    """
+    Format a store_id x benchmark dataframe into records
+    :return: [{'date_comment': '2019-06-30', 'metric': 3.97, 'benchmark': 3.9}, ...]
+    """
+    tmp_df = comparison_df.dropna()
+    tmp_df.columns = ["metric", "benchmark"]
+    tmp_df.reset_index(inplace=True)
+    tmp_df.date_comment = tmp_df.date_comment.astype(str)
+    return tmp_df.to_dict("records")
 
 
 def format_metric_display(metric):
@@ -159,24 +185,24 @@ def format_metric_display(metric):
     return " ".join(metric.split("_"))
 
 
-def get_store_ranking(store_id: str, metric: str, ranked_ts: "pd.DataFrame", dt_period: "datetime") -> float:
+def get_store_ranking(store_id: str, metric: str, ranked_idx: "ViewIndex", dt_period: "datetime") -> float:
     """
-    Get the ranking value for dt_period, metric, store_id on ranked_ts
+    Get the ranking value for dt_period, metric, store_id on ranked_idx
     :return: ranking float
     """
-    return ranked_ts.loc[(ranked_ts.store_id == store_id) & (ranked_ts.date_comment == dt_period)][metric].iloc[0]
+    return ranked_idx.rows("store_id", store_id, dt_period)[metric].iloc[0]
 
 
-def get_store_highlights(store_id: str, type_ts: "pd.DataFrame") -> List[Dict[str, Any]]:
+def get_store_highlights(store_id: str, type_idx: "ViewIndex") -> List[Dict[str, Any]]:
     """
     Get Store Highlights Ranking
     :param store_id: store id
-    :param type_ts: ranked store df
+    :param type_idx: ranked store view index
     :return: [{'index': 'product_issues_quality',
               'rank_val': 0.21739130434782608,
               'performance': 'Average'}...]
     """
-    return get_store_rankings(store_id, type_ts, 7)
+    return get_store_rankings(store_id, type_idx, 7)
 
 
 def evaluation_results(rank):
@@ -193,23 +219,21 @@ def evaluation_results(rank):
     return "Not Available"
 
 
-def get_store_main_rankings(store_id: str, type_ts, company_ts) -> dict:
-    latest_period = type_ts.date_comment.drop_duplicates().sort_values().iloc[-1]
+def get_store_main_rankings(store_id: str, type_idx: "ViewIndex", company_idx: "ViewIndex") -> dict:
+    latest_period = type_idx.latest_period
     rank_metric = "rating_rank"
-    within_type = evaluation_results(get_store_ranking(store_id, rank_metric, type_ts, latest_period))
-    within_company = evaluation_results(get_store_ranking(store_id, rank_metric, company_ts, latest_period))
+    within_type = evaluation_results(get_store_ranking(store_id, rank_metric, type_idx, latest_period))
+    within_company = evaluation_results(get_store_ranking(store_id, rank_metric, company_idx, latest_period))
     return {"type_ranking": within_type, "company_ranking": within_company}
 
 
-def get_general_ranking(store_id: str, ranked_ts: "pd.DataFrame", dt_period: "datetime") -> Optional["pd.DataFrame"]:
+def get_general_ranking(store_id: str, ranked_idx: "ViewIndex", dt_period: "datetime") -> Optional["pd.DataFrame"]:
     """
     Average ranking over all issue rankings
     """
     try:
-        ranking_vars = [col for col in ranked_ts.columns if "_rank" in col]
-        return \
-            ranked_ts.loc[(ranked_ts.store_id == store_id) & (ranked_ts.date_comment == dt_period)][ranking_vars].mean(
-                axis=1).iloc[0]
+        ranking_vars = [col for col in ranked_idx.view.columns if "_rank" in col]
+        return ranked_idx.rows("store_id", store_id, dt_period)[ranking_vars].mean(axis=1).iloc[0]
     except IndexError:
         logging.error(f"Store '{store_id}' does not have enough data...")
     except Exception as err:
@@ -218,15 +242,14 @@ def get_general_ranking(store_id: str, ranked_ts: "pd.DataFrame", dt_period: "da
         return None
 
 
-def get_store_general_rankings(store_id: str, type_ts, company_ts) -> dict:
+def get_store_general_rankings(store_id: str, type_idx: "ViewIndex", company_idx: "ViewIndex") -> dict:
     """
     Get latest store average ranking (within its type and own company)
     """
-    latest_period = type_ts.date_comment.drop_duplicates().sort_values()
-    if latest_period.size > 0:
-        latest_period = latest_period.iloc[-1]
-        within_type = evaluation_results(get_general_ranking(store_id, type_ts, latest_period))
-        within_company = evaluation_results(get_general_ranking(store_id, company_ts, latest_period))
+    latest_period = type_idx.latest_period
+    if latest_period is not None:
+        within_type = evaluation_results(get_general_ranking(store_id, type_idx, latest_period))
+        within_company = evaluation_results(get_general_ranking(store_id, company_idx, latest_period))
 
         if within_type is not None and within_company is not None:
             return {"type_ranking": within_type, "company_ranking": within_company}
@@ -242,42 +265,31 @@ def format_issues_columns(col):
     return "_".join(col.split(" ")).lower()
 
 
-def get_store_performance(store_id: str, type_ts: "pd.DataFrame", exclude_macro_issues: bool = False):
+def get_store_performance(store_id: str, store_trends: "StoreTrends", exclude_macro_issues: bool = False):
     """
     Get positive and negative aspects from a company
     :param store_id: store_id
-    :param type_ts: ranked pandas dataFrame by size type
+    :param store_trends: trends of the ranked pandas dataFrame by size type
     :return:
     """
-    issues_metrics = [col for col in type_ts.columns if "issues" in col and "rank" not in col]
-
-    # Remove macro issue tags from the filter
-    if exclude_macro_issues:
-        issues_metrics = [col for col in issues_metrics if col not in ["product_issues", "business_issues"]]
-
-    performance_df = type_ts.loc[type_ts.store_id == store_id].set_index("date_comment")[issues_metrics].diff()
     report_apects = {"positive": [], "negative": []}
 
-    # Labeling
-    for issue in issues_metrics:
-        if all(performance_df[issue].iloc[-2:] < 0):
-            report_apects["positive"].append(
-                {"metric": format_issues_columns(issue), "performance": "Consistently Improving"})
-        elif all(performance_df[issue].iloc[-1:] < 0):
-            report_apects["positive"].append({"metric": format_issues_columns(issue), "performance": "Improving"})
-        elif all(performance_df[issue].iloc[-1:] > 0):
-            report_apects["negative"].append({"metric": format_issues_columns(issue), "performance": "Worsening"})
-        elif all(performance_df[issue].iloc[-2:] > 0):
-            report_apects["negative"].append(
-                {"metric": format_issues_columns(issue), "performance": "Consistently Worsening"})
+    for issue, performance in store_trends.get_store_trends(store_id).items():
+        # Remove macro issue tags from the filter
+        if exclude_macro_issues and issue in ["product_issues", "business_issues"]:
+            continue
+        if performance in ["Consistently Improving", "Improving"]:
+            report_apects["positive"].append({"metric": format_issues_columns(issue), "performance": performance})
+        elif performance in ["Worsening", "Consistently Worsening"]:
+            report_apects["negative"].append({"metric": format_issues_columns(issue), "performance": performance})
     return report_apects
 
 
-def get_store_rankings(store_id: str, type_ts: "pd.DataFrame", n=3, by=None) -> List[Dict[str, Any]]:
+def get_store_rankings(store_id: str, type_idx: "ViewIndex", n=3, by=None) -> List[Dict[str, Any]]:
     """
     Get stores top/lowest N ranking metrics
     :param store_id: store id
-    :param type_ts: ranked time series dataFrame
+    :param type_idx: index over the ranked time series dataFrame
     :param n: Number of top/lowest N rankings
     :param by: [best/worst/None] to get the top/lowest N rankings
     :return: dataFrame with rank value and performance indicator
@@ -302,11 +314,10 @@ def get_store_rankings(store_id: str, type_ts: "pd.DataFrame", n=3, by=None) ->
         ascend_rank = True
 
     generic_issues = ["product_issues_rank", "business_issues_rank"]  # Remove general products/business issues
-    ranking_vars = [col for col in type_ts.columns if "_rank" in col and col not in generic_issues]
-    latest_period = type_ts.date_comment.drop_duplicates().sort_values().iloc[-1]
+    ranking_vars = [col for col in type_idx.view.columns if "_rank" in col and col not in generic_issues]
 
     # Filter ts dataFrame
-    tmp_ts = type_ts.loc[(type_ts.date_comment == latest_period) & (type_ts.store_id == store_id)][ranking_vars]
+    tmp_ts = type_idx.rows("store_id", store_id, type_idx.latest_period)[ranking_vars]
     if tmp_ts.size > 0:
         tmp_ts = tmp_ts.reset_index(drop=True).transpose().sort_values(by=0, ascending=ascend_rank).dropna(axis=0).iloc[
                  0:n]
@@ -327,21 +338,9 @@ def get_store_rankings(store_id: str, type_ts: "pd.DataFrame", n=3, by=None) ->
         return [{'performance': None, 'rank_val': None, "index": None}]
 
 
-def get_store_worse_rankings(store_id: str, type_ts: "pd.DataFrame", n=3):
-    return get_store_rankings(store_id, type_ts, n, by="worst")
-
-
-def get_store_best_rankings(store_id: str, type_ts: "pd.DataFrame", n=3):
-    return get_store_rankings(store_id, type_ts, n, by="best")
+def get_store_worse_rankings(store_id: str, type_idx: "ViewIndex", n=3):
+    return get_store_rankings(store_id, type_idx, n, by="worst")
 
 
-def get_company_rank(metric: str, type_ts: "pd.DataFrame") -> dict:
-    """
-    Get the average rank companies rank on a metric
-    Eg.
-    {'sylvia-design': 0.3849835318068351,
-     'mobly': 0.39418091356099483}
-    """
-    ranked_metric = metric + "_rank"
-    return type_ts.groupby("company").mean().sort_values(by=ranked_metric, ascending=False)[
-        ranked_metric].dropna().to_dict()
+def get_store_best_rankings(store_id: str, type_idx: "ViewIndex", n=3):
+    return get_store_rankings(store_id, type_idx, n, by="best")
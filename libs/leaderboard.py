@@ -0,0 +1,35 @@
+from typing import *
+
+import pandas as pd
+
+
+class CompanyLeaderboard:
+    """
+    Company rankings of a ranked view, computed once when the view is loaded.
+
+    metric_rankings: {metric_rank column: {company: mean rank over all periods}} sorted best first
+    overall_ranking: {company: rank of its mean issues on the latest period} sorted ascending
+    """
+
+    def __init__(self, type_idx: "ViewIndex"):
+        type_ts = type_idx.view
+
+        # Mean rank of every metric per company in a single groupby
+        rank_metrics = [col for col in type_ts.columns if col.endswith("_rank")]
+        company_means = type_ts.groupby("company")[rank_metrics].mean()
+        self.metric_rankings = {col: company_means.sort_values(by=col, ascending=False)[col].dropna().to_dict()
+                                for col in rank_metrics}
+
+        # Overall rank over the latest period issues
+        issues_metrics = [col for col in type_ts.columns if "issues" in col and "rank" not in col]
+        self.overall_ranking = type_idx.latest.groupby("company")[issues_metrics].mean().mean(
+            axis=1).dropna().rank().sort_values().to_dict()
+
+    def get_metric_ranking(self, metric: str) -> Dict[str, float]:
+        """
+        Get the average rank companies rank on a metric
+        Eg.
+        {'sylvia-design': 0.3849835318068351,
+         'mobly': 0.39418091356099483}
+        """
+        return self.metric_rankings.get(metric + "_rank", {})
@@ -1,16 +1,80 @@
 import json
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
+from typing import *
 import pandas as pd
 from libs import cleaning
 
+DEFAULT_CHUNK_SIZE = 10000
 
-def agg_jsonls(folder_path: str):
-    files = [file for file in Path(folder_path).rglob("*.jl")]
-    ad_ls = []
+
+def list_jsonl_files(folder_path: str) -> List[Path]:
+    """
+    Scraped .jl files under folder_path, sorted so every run reads them in the same order
+    """
+    return sorted(Path(folder_path).rglob("*.jl"))
+
+
+def iter_jsonl(files: Iterable[Path]) -> Iterator[dict]:
+    """
+    Stream the reviews of several .jl files, one line at a time
+    """
     for file in files:
-        for ad in file.open("r", encoding="utf-8"):
-            ad_ls.append(json.loads(ad))
-    return ad_ls
+        with file.open("r", encoding="utf-8") as f:
+            for ad in f:
+                if ad.strip():
+                    yield json.loads(ad)
+
+
+def iter_unique_reviews(files: Iterable[Path], unique_ids: Optional[Set[str]] = None) -> Iterator[dict]:
+    """
+    Stream the reviews with a review_ID, skipping the ones already seen (first occurrence wins)
+    :param files: .jl files
+    :param unique_ids: review_IDs already seen, updated in place
+    """
+    unique_ids = set() if unique_ids is None else unique_ids
+    for complaint in iter_jsonl(files):
+        if "review_ID" in complaint and complaint["review_ID"] not in unique_ids:
+            unique_ids.add(complaint["review_ID"])
+            yield complaint
+
+
+def _format_chunks(reviews: Iterable[dict], chunk_size: int,
+                   format_batch: Callable = cleaning.format_RA_batch_to_df) -> Iterator[pd.DataFrame]:
+    offset = 0
+    rows = []
+    for review in reviews:
+        rows.append(review)
+        if len(rows) == chunk_size:
+            yield format_batch(rows, index=pd.RangeIndex(offset, offset + len(rows)))
+            offset += len(rows)
+            rows = []
+    if rows:
+        yield format_batch(rows, index=pd.RangeIndex(offset, offset + len(rows)))
+
+
+def iter_RA_df_chunks(dataset_folder: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Stream the main RA dataframe in chunks of at most chunk_size unique reviews.
+    Only one chunk of raw reviews is held in memory at a time.
+    :param dataset_folder: scraped data folder
+    :param chunk_size: reviews per chunk
+    :return: dataFrame chunks, indexed by the position of the review in the full dataset
+    """
+    return _format_chunks(iter_unique_reviews(list_jsonl_files(dataset_folder)), chunk_size)
+
+
+def _build_file_df(file: Path, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Optional[pd.DataFrame]:
+    """
+    RA dataframe of a single .jl file (deduplicated within the file), run by the ingestion workers
+    """
+    chunks = list(_format_chunks(iter_unique_reviews([file]), chunk_size))
+    return pd.concat(chunks, sort=False) if chunks else None
+
+
+def agg_jsonls(folder_path: str):
+    return list(iter_jsonl(list_jsonl_files(folder_path)))
 
 
 def load_dataset(folder_path: str):
@@ -18,22 +82,55 @@ def load_dataset(folder_path: str):
     Load unique reviews from data folder path
     :return:
     """
-    # Unique reviews
-    unique_ids = set()
-    reviewsRA = []
+    return list(iter_unique_reviews(list_jsonl_files(folder_path)))
 
-    for complaint in agg_jsonls(folder_path):
-        if "review_ID" in complaint and complaint["review_ID"] not in unique_ids:
-            unique_ids.add(complaint["review_ID"])
-            reviewsRA.append(complaint)
 
-    return reviewsRA
+def build_RA_df(dataset_folder: str, chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int = 1) -> pd.DataFrame:
+    """
+    Build Main RA Dataframe
+    :param dataset_folder: scraped data folder
+    :param chunk_size: reviews formatted at a time
+    :param workers: processes parsing and formatting files in parallel (1 to run in this process)
+    :return:
+    """
+    if workers > 1:
+        return _build_RA_df_parallel(dataset_folder, chunk_size, workers)
+
+    chunks = list(iter_RA_df_chunks(dataset_folder, chunk_size))
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, sort=False)
 
 
-def build_RA_df(dataset_folder: str) -> pd.DataFrame:
+def _build_RA_df_parallel(dataset_folder: str, chunk_size: int, workers: int) -> pd.DataFrame:
     """
-    Build Main RA Dataframe
-    :param reviews:
+    Every file is parsed and formatted by a worker process. Results are merged in file order,
+    keeping the first occurrence of every review_ID, so rows come out as in the sequential build.
+    """
+    unique_ids = set()
+    chunks = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for file_df in executor.map(partial(_build_file_df, chunk_size=chunk_size), list_jsonl_files(dataset_folder)):
+            if file_df is None:
+                continue
+            file_df = file_df.loc[~file_df.review_ID.isin(unique_ids).values]
+            unique_ids.update(file_df.review_ID.values)
+            chunks.append(file_df)
+
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, sort=False, ignore_index=True)
+
+
+def build_store_reviews_df(dataset_folder: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> pd.DataFrame:
+    """
+    Build the store reviews dataframe (cleaning.format_store_reviews_batch_to_df rows) the quarterly views aggregate
+    :param dataset_folder: scraped store reviews folder
+    :param chunk_size: reviews formatted at a time
     :return:
     """
-    return pd.DataFrame([cleaning.format_RA_to_df(r) for r in load_dataset(dataset_folder)])
+    chunks = list(_format_chunks(iter_unique_reviews(list_jsonl_files(dataset_folder)), chunk_size,
+                                 cleaning.format_store_reviews_batch_to_df))
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, sort=False)
@@ -0,0 +1,205 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+from typing import *
+
+# Seconds, from cached responses (~1ms) to full store details on large views
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Bytes, from /health to the geoMarkers of every store
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    escaped = [str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in values]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    A metric family of one type, with a value per label values tuple
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """
+        (name suffix, formatted labels, value) of every sample
+        """
+        with self._lock:
+            return [("", _format_labels(self.labels, key), value) for key, value in sorted(self._values.items())]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{self.name}{suffix}{labels} {_format_value(value)}" for suffix, labels, value in self.samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def clear(self):
+        with self._lock:
+            self._values = dict()
+
+
+class Histogram(Metric):
+    """
+    Cumulative bucket counts, sum and count per label values
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Per bucket counts (last one is +Inf) and sum
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][bisect.bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        samples = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(("_bucket", _format_labels(self.labels + ("le",), key + (_format_value(bound),)),
+                                cumulative))
+            samples.append(("_sum", _format_labels(self.labels, key), total))
+            samples.append(("_count", _format_labels(self.labels, key), cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    The metrics of this process, rendered in the Prometheus text format.
+    Collectors are called on every render, to refresh gauges read from elsewhere (e.g. the loaded views).
+    """
+
+    def __init__(self):
+        self.metrics = dict()
+        self.collectors = []
+
+    def register(self, metric: Metric) -> Metric:
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            collector()
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+request_duration = registry.histogram("bnps_request_duration_seconds", "Request latency per route template",
+                                      labels=("method", "route"))
+requests_total = registry.counter("bnps_requests_total", "Responses per route template and status",
+                                  labels=("method", "route", "status"))
+response_size = registry.histogram("bnps_response_size_bytes", "Response body size per route template",
+                                   labels=("method", "route"), buckets=SIZE_BUCKETS)
+feature_duration = registry.histogram("bnps_feature_duration_seconds", "Time spent in the timed features helpers",
+                                      labels=("function",))
+
+
+def observe_request(method: str, route: Optional[str], status: int, seconds: Optional[float], size: int):
+    """
+    Record one response, route being the uri template of the handler (None when no route matched)
+    """
+    route = route or "unmatched"
+    requests_total.inc(method=method, route=route, status=status)
+    response_size.observe(size, method=method, route=route)
+    if seconds is not None:
+        request_duration.observe(seconds, method=method, route=route)
+
+
+def timed(func: Callable) -> Callable:
+    """
+    Record the duration of every call of func on bnps_feature_duration_seconds{function=func name}
+    """
+    if getattr(func, "_timed", False):
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            feature_duration.observe(time.perf_counter() - start, function=func.__name__)
+
+    wrapper._timed = True
+    return wrapper
+
+
+def instrument_module(module, names: Iterable[str]) -> List[str]:
+    """
+    Wrap the named functions of module with timed. Callers going through the module
+    (feat.get_store_performance(...)) and calls between its own functions are then timed,
+    so names should not include helpers called by other timed ones or once per row.
+    :param names: functions to time
+    :return: names of the timed functions
+    """
+    timed_names = []
+    for name in names:
+        func = getattr(module, name)
+        if not inspect.isfunction(func):
+            raise TypeError(f"{module.__name__}.{name} is not a function")
+        setattr(module, name, timed(func))
+        timed_names.append(name)
+    return timed_names
@@ -1,26 +1,155 @@
+import multiprocessing
 import numpy as np
+from numpy.lib.format import open_memmap
 from typing import *
-from libs.text_formatting import get_tokens_from_RA_df
+from libs.text_formatting import iter_tokens_from_RA_df
 import pandas as pd
-from tqdm import tqdm
+
+FEATURE_CHUNK_SIZE = 10000
+# Token vectors gathered at once when averaging a chunk (~20 MB of float32 with 300 dims)
+TOKEN_BATCH_SIZE = 16384
+
+# Vocabulary and vectors of the feature builder worker processes
+_worker_embeddings = None
+
+
+def get_vocabulary(model: "gensim.model") -> Tuple[Dict[str, int], np.ndarray]:
+    """
+    Word -> row of the embedding matrix, and the matrix, of a gensim 3 or 4 model
+    :param model: gensim model (anything with a .wv KeyedVectors)
+    :return: (vocabulary, vectors)
+    """
+    wv = model.wv
+    if hasattr(wv, "key_to_index"):
+        return wv.key_to_index, wv.vectors
+    return {w: v.index for w, v in wv.vocab.items()}, wv.vectors
+
+
+def get_batch_embeddings(review_seqs: List[List[str]], vocabulary: Dict[str, int],
+                         vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Mean word vector of several reviews. Words out of the vocabulary are skipped.
+    Token vectors are gathered TOKEN_BATCH_SIZE at a time and segment summed into a (reviews, dims) buffer,
+    so memory is bounded by the batch instead of the total number of tokens.
+    :param review_seqs: tokens of every review
+    :param vocabulary: word -> vectors row
+    :param vectors: embedding matrix
+    :return: (float32 embeddings of the reviews with at least one known word, mask of those reviews)
+    """
+    ids, lengths = [], np.zeros(len(review_seqs), dtype=np.int64)
+    for i, seq in enumerate(review_seqs):
+        seq_ids = [vocabulary[w] for w in seq if w in vocabulary]
+        ids.extend(seq_ids)
+        lengths[i] = len(seq_ids)
+
+    has_vector = lengths > 0
+    if not has_vector.any():
+        return np.empty((0, vectors.shape[1]), dtype=np.float32), has_vector
+
+    ids = np.array(ids, dtype=np.int64)
+    lengths = lengths[has_vector]
+    starts = np.zeros(lengths.size, dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    sums = np.zeros((lengths.size, vectors.shape[1]), dtype=np.float64)
+    for start in range(0, ids.size, TOKEN_BATCH_SIZE):
+        end = min(start + TOKEN_BATCH_SIZE, ids.size)
+        # Reviews with tokens on [start, end), the first one may have started on a previous batch
+        first = np.searchsorted(starts, start, side="right") - 1
+        last = np.searchsorted(starts, end, side="left")
+        segments = np.maximum(starts[first:last], start) - start
+        sums[first:last] += np.add.reduceat(vectors[ids[start:end]], segments, axis=0, dtype=np.float64)
+    sums /= lengths[:, None]
+    return sums.astype(np.float32), has_vector
 
 
 def get_review_embbedings(review_seq: List[str], model: "gensim.model"):
-    try:
-        return np.array([model.wv[w] for w in review_seq]).mean(axis=0)
-    except:
-        return None
+    embeddings, has_vector = get_batch_embeddings([review_seq], *get_vocabulary(model))
+    return embeddings[0] if has_vector[0] else None
+
+
+def _init_feature_worker(vocabulary: Dict[str, int], vectors: np.ndarray):
+    global _worker_embeddings
+    _worker_embeddings = (vocabulary, vectors)
+
+
+def _embed_texts_chunk(texts_df: "pd.DataFrame") -> Tuple[np.ndarray, np.ndarray]:
+    review_seqs = next(iter_tokens_from_RA_df(texts_df, chunk_size=max(texts_df.shape[0], 1)), [])
+    return get_batch_embeddings(review_seqs, *_worker_embeddings)
+
+
+def _iter_chunk_embeddings(reviews_df, vocabulary: Dict[str, int], vectors: np.ndarray, chunk_size: int,
+                           workers: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    (embeddings, has_vector mask) of every chunk of reviews, in order
+    """
+    if workers <= 1:
+        for review_seqs in iter_tokens_from_RA_df(reviews_df, chunk_size):
+            yield get_batch_embeddings(review_seqs, vocabulary, vectors)
+        return
+
+    texts_df = reviews_df[["title", "description"]]
+    chunks = (texts_df.iloc[start:start + chunk_size] for start in range(0, texts_df.shape[0], chunk_size))
+    with multiprocessing.Pool(workers, initializer=_init_feature_worker, initargs=(vocabulary, vectors)) as pool:
+        for result in pool.imap(_embed_texts_chunk, chunks):
+            yield result
+
+
+def build_text_feature_matrix(reviews_df, embedding_model, output_path: Optional[str] = None,
+                              chunk_size: int = FEATURE_CHUNK_SIZE, workers: int = 1) -> "pd.DataFrame":
+    """
+    Mean word vector of every review, written chunk by chunk into one preallocated float32 matrix.
+
+    With output_path the matrix is a memory-mapped .npy file (plus {output_path}.index.npy with the
+    review positions), so corpora larger than RAM can be embedded; load it back with
+    load_text_feature_matrix. Reviews without vectors are compacted out as chunks are written.
+    :param reviews_df: RA dataframe
+    :param embedding_model: gensim model
+    :param output_path: .npy file for the matrix, kept in memory if None
+    :param chunk_size: reviews tokenized and embedded at a time
+    :param workers: processes tokenizing and embedding chunks (1 to run in this process)
+    :return: float32 dataFrame [feat_0 .. feat_n] viewing the matrix, indexed by the position of the review in reviews_df
+    """
+    vocabulary, vectors = get_vocabulary(embedding_model)
+    shape = (reviews_df.shape[0], vectors.shape[1])
+    if output_path is not None:
+        matrix = open_memmap(output_path, mode="w+", dtype=np.float32, shape=shape)
+    else:
+        matrix = np.empty(shape, dtype=np.float32)
+    row_index = np.empty(shape[0], dtype=np.int64)
+
+    n_rows = 0
+    offset = 0
+    for embeddings, has_vector in _iter_chunk_embeddings(reviews_df, vocabulary, vectors, chunk_size, workers):
+        matrix[n_rows:n_rows + embeddings.shape[0]] = embeddings
+        row_index[n_rows:n_rows + embeddings.shape[0]] = offset + np.flatnonzero(has_vector)
+        n_rows += embeddings.shape[0]
+        offset += has_vector.size
+
+    if output_path is not None:
+        matrix.flush()
+        np.save(f"{output_path}.index.npy", row_index[:n_rows])
+    return _feature_df(matrix[:n_rows], row_index[:n_rows])
+
+
+def load_text_feature_matrix(output_path: str, mmap_mode: Optional[str] = "r") -> "pd.DataFrame":
+    """
+    Feature dataFrame written by build_text_feature_matrix, viewing the mapped matrix
+    """
+    row_index = np.load(f"{output_path}.index.npy")
+    matrix = np.load(output_path, mmap_mode=mmap_mode)
+    return _feature_df(matrix[:row_index.size], row_index)
 
 
-def get_text_feature_df(reviews_df, embedding_model) -> "pd.DataFrame":
-    # Get features
-    texts_vecs = [get_review_embbedings(seq, embedding_model) for seq in tqdm(get_tokens_from_RA_df(reviews_df))]
-    feat_num = texts_vecs[0].shape[0]
-    indexes = pd.Series(texts_vecs)
-    indexes = indexes[~indexes.isna()].index
+def _feature_df(matrix: np.ndarray, row_index: np.ndarray) -> "pd.DataFrame":
+    return pd.DataFrame(matrix, columns=[f"feat_{i}" for i in range(matrix.shape[1])], index=row_index, copy=False)
 
-    # Remove nans and maintain index order to df
-    feat_df = pd.DataFrame([i for i in texts_vecs if not isinstance(i, type(np.nan))],
-                           columns=[f"feat_{i}" for i in range(feat_num)], index=indexes)
 
-    return feat_df
+def get_text_feature_df(reviews_df, embedding_model, chunk_size: int = FEATURE_CHUNK_SIZE) -> "pd.DataFrame":
+    """
+    Mean word vector of every review (title + description), reviews without any known word are left out
+    :param reviews_df: RA dataframe
+    :param embedding_model: gensim model
+    :param chunk_size: reviews tokenized and embedded at a time
+    :return: float32 dataFrame [feat_0 .. feat_n], indexed by the position of the review in reviews_df
+    """
+    return build_text_feature_matrix(reviews_df, embedding_model, chunk_size=chunk_size)
@@ -0,0 +1,192 @@
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import *
+
+import pandas as pd
+
+from libs import aggregation, cleaning, loading, maps
+from libs.aggregation import QuarterlyAggregates
+
+logger = logging.getLogger(__name__)
+
+# Saved next to the published views, so aggregation.update_views can fold new reviews into them
+STATE_FILE = "quarterly_aggregates.pckl"
+
+
+class Stage:
+    """
+    A step of the view build: func(**upstream outputs, **params) -> output.
+
+    Its cache key hashes the source of func and of the modules it relies on, the content of its
+    path params, its other params and the keys of its inputs, so a stage only runs again when
+    something it depends on changed.
+    """
+
+    def __init__(self, name: str, func: Callable, inputs: Sequence[str] = (), params: Sequence[str] = (),
+                 paths: Sequence[str] = (), modules: Sequence[Any] = ()):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = list(params) + list(paths)
+        self.paths = list(paths)
+        self.modules = list(modules)
+
+    def get_key(self, params: dict, input_keys: Dict[str, str]) -> str:
+        digest = hashlib.sha1(f"{self.name};".encode("utf-8"))
+        digest.update(inspect.getsource(self.func).encode("utf-8"))
+        for module in self.modules:
+            digest.update(inspect.getsource(module).encode("utf-8"))
+        for param in self.params:
+            value = hash_path(params[param]) if param in self.paths else repr(params[param])
+            digest.update(f"{param}={value};".encode("utf-8"))
+        for name in self.inputs:
+            digest.update(f"{name}:{input_keys[name]};".encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+
+def hash_path(path: str) -> str:
+    """
+    Content hash of a file, or of every file (and its relative path) under a folder
+    """
+    digest = hashlib.sha1()
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, file_name) for root, _, file_names in os.walk(path)
+                       for file_name in file_names)
+    else:
+        files = [path]
+    for file in files:
+        digest.update(f"{os.path.relpath(file, path)};".encode("utf-8"))
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(2 ** 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_stores(stores_path: str) -> "pd.DataFrame":
+    return pd.read_pickle(stores_path)
+
+
+def ingest(reviews_folder: str, chunk_size: int) -> "pd.DataFrame":
+    return loading.build_store_reviews_df(reviews_folder, chunk_size)
+
+
+def clean(ingest: "pd.DataFrame", stores_path: str) -> "pd.DataFrame":
+    """
+    Reviews of the stores in the catalog, with their store_type
+    """
+    stores = _read_stores(stores_path)
+    reviews = ingest.dropna(subset=["store_id", "date_comment"])
+    return reviews.merge(stores[["store_id", "store_type"]], on="store_id")
+
+
+def aggregate(clean: "pd.DataFrame") -> QuarterlyAggregates:
+    aggregates = QuarterlyAggregates(
+        cleaning.STORE_REVIEW_FIELDS + cleaning.STORE_TAG_COLUMNS + list(cleaning.STORE_TAG_TOTALS))
+    aggregates.fold(clean)
+    return aggregates
+
+
+def rank(aggregate: QuarterlyAggregates, stores_path: str) -> Dict[str, "pd.DataFrame"]:
+    stores_ts = aggregate.get_stores_ts()
+    views = aggregation.build_ranked_views(stores_ts, _read_stores(stores_path))
+    views["stores_ts"] = stores_ts
+    return views
+
+
+def benchmarks(aggregate: QuarterlyAggregates) -> "pd.DataFrame":
+    return aggregate.get_benchmarks()
+
+
+def performance(aggregate: QuarterlyAggregates, stores_path: str) -> "pd.DataFrame":
+    return aggregation.build_performance_agg_view(aggregate.get_stores_ts(), _read_stores(stores_path))
+
+
+# cleaning derives its tag columns from maps.tag_map, so both are hashed wherever cleaning is
+VIEW_STAGES = [
+    Stage("ingest", ingest, params=["chunk_size"], paths=["reviews_folder"], modules=[loading, cleaning, maps]),
+    Stage("clean", clean, inputs=["ingest"], paths=["stores_path"]),
+    Stage("aggregate", aggregate, inputs=["clean"], modules=[aggregation, cleaning, maps]),
+    Stage("rank", rank, inputs=["aggregate"], paths=["stores_path"], modules=[aggregation]),
+    Stage("benchmarks", benchmarks, inputs=["aggregate"], modules=[aggregation]),
+    Stage("performance", performance, inputs=["aggregate"], paths=["stores_path"], modules=[aggregation]),
+]
+
+
+def _run_stage(func: Callable, params: dict, input_paths: Dict[str, str], output_path: str) -> float:
+    start = time.perf_counter()
+    inputs = {name: pickle.load(open(path, "rb")) for name, path in input_paths.items()}
+    output = func(**inputs, **params)
+
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(output, f)
+    os.replace(tmp_path, output_path)
+    return time.perf_counter() - start
+
+
+def run_stages(stages: List[Stage], params: dict, cache_folder: str, workers: int = 1) -> Dict[str, str]:
+    """
+    Run the stages whose output is not cached yet; stages whose inputs are all ready run in parallel
+    :param stages: stages, every stage after its inputs
+    :param params: run params (stage params and paths)
+    :param cache_folder: stage outputs folder ({stage}-{key}.pckl)
+    :param workers: processes running independent stages
+    :return: {stage name: output path}
+    """
+    os.makedirs(cache_folder, exist_ok=True)
+    keys, paths = dict(), dict()
+    for stage in stages:
+        keys[stage.name] = stage.get_key(params, keys)
+        paths[stage.name] = os.path.join(cache_folder, f"{stage.name}-{keys[stage.name]}.pckl")
+
+    done = {stage.name for stage in stages if os.path.exists(paths[stage.name])}
+    for name in done:
+        logger.info(f"Stage {name} cached ({keys[name]})")
+
+    pending = [stage for stage in stages if stage.name not in done]
+    while pending:
+        ready = [stage for stage in pending if set(stage.inputs) <= done]
+        jobs = [(stage.func, {param: params[param] for param in stage.params},
+                 {name: paths[name] for name in stage.inputs}, paths[stage.name]) for stage in ready]
+        if workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+                seconds = list(executor.map(_run_stage, *zip(*jobs)))
+        else:
+            seconds = [_run_stage(*job) for job in jobs]
+
+        for stage, elapsed in zip(ready, seconds):
+            logger.info(f"Stage {stage.name} built in {elapsed:.2f}s ({keys[stage.name]})")
+        done.update(stage.name for stage in ready)
+        pending = [stage for stage in pending if stage.name not in done]
+    return paths
+
+
+def build_views(reviews_folder: str, stores_path: str, output_folder: str = "views",
+                cache_folder: str = "views/.cache", workers: int = 1,
+                chunk_size: int = loading.DEFAULT_CHUNK_SIZE) -> Dict[str, str]:
+    """
+    Build the serving views from the scraped store reviews and publish them on output_folder
+    :param reviews_folder: scraped store reviews (.jl files)
+    :param stores_path: stores catalog pickle [store_id, store_type, company, latitude, longitude]
+    :param output_folder: views folder
+    :param cache_folder: stage outputs folder
+    :param workers: processes running independent stages
+    :param chunk_size: reviews formatted at a time
+    :return: {stage name: output path}
+    """
+    params = {"reviews_folder": reviews_folder, "stores_path": stores_path, "chunk_size": chunk_size}
+    paths = run_stages(VIEW_STAGES, params, cache_folder, workers)
+
+    load = lambda name: pickle.load(open(paths[name], "rb"))
+    views = load("rank")
+    views["benchmark_df"] = load("benchmarks")
+    views["stores_performance_agg_view"] = load("performance")
+    os.makedirs(output_folder, exist_ok=True)
+    aggregation.publish_views(views, output_folder)
+    load("aggregate").save(os.path.join(output_folder, STATE_FILE))
+    return paths
@@ -0,0 +1,93 @@
+import threading
+from collections import OrderedDict
+from typing import *
+
+# Bytes counted per entry on top of its body and key: the dict/linked list node, the key tuple and the bytes header
+ENTRY_OVERHEAD = 256
+
+
+def get_entry_size(key: Tuple, body: bytes) -> int:
+    """
+    Approximate memory of a cache entry
+    """
+    return len(body) + sum(len(str(part)) for part in key) + ENTRY_OVERHEAD
+
+
+class ResponseCache:
+    """
+    Bounded in-process LRU cache of already encoded response bodies.
+
+    Entries are keyed by (route, metric, company_id, view version) tuples and evicted in
+    least recently used order once the size of the cached entries (body, key and ENTRY_OVERHEAD)
+    exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = int(max_bytes)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[bytes]:
+        """
+        Get a cached body (and mark it as recently used)
+        :param key: cache key
+        :return: encoded body or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Tuple, body: Union[str, bytes]) -> bytes:
+        """
+        Cache an encoded body, evicting the least recently used entries over the memory cap
+        :param key: cache key
+        :param body: encoded body
+        :return: body as bytes
+        """
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        entry_size = get_entry_size(key, body)
+        if entry_size > self.max_bytes:
+            return body
+
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (body, entry_size)
+            self.size += entry_size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+        return body
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        """
+        Cache usage report
+        Ex:
+        {'entries': 12, 'size_bytes': 81234, 'max_bytes': 33554432,
+         'hits': 1520, 'misses': 12, 'evictions': 0, 'hit_ratio': 0.99}
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {"entries": len(self._entries),
+                    "size_bytes": self.size,
+                    "max_bytes": self.max_bytes,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "hit_ratio": round(self.hits / requests, 4) if requests > 0 else None}
@@ -0,0 +1,79 @@
+from typing import *
+
+import numpy as np
+import pandas as pd
+
+STORE_ATTRIBUTES = ["company", "store_type", "latitude", "longitude"]
+
+
+class StoreDimension:
+    """
+    One row per store of a ranked view, built once per view version.
+
+    Holds store_id -> company, store_type, latitude, longitude and the range of the store's rows
+    on the view index (positions start:stop of ViewIndex.sorted_positions("store_id")). Store ids
+    are kept sorted, so lookups and prefix searches are binary searches.
+    """
+
+    def __init__(self, type_idx: "ViewIndex"):
+        type_ts = type_idx.view
+        positions, store_ids = type_idx.sorted_positions("store_id")
+
+        new_store = np.ones(store_ids.size, dtype=bool)
+        new_store[1:] = store_ids[1:] != store_ids[:-1]
+        starts = np.flatnonzero(new_store)
+        stops = np.append(starts[1:], store_ids.size)
+
+        # Attributes of the first period of each store, store_type of its latest one
+        first_rows = type_ts.iloc[positions[starts]]
+        last_rows = type_ts.iloc[positions[stops - 1]]
+        self.frame = pd.DataFrame({"store_id": store_ids[starts],
+                                   "company": first_rows.company.values,
+                                   "store_type": last_rows.store_type.values,
+                                   "latitude": first_rows.latitude.values,
+                                   "longitude": first_rows.longitude.values,
+                                   "row_start": starts,
+                                   "row_stop": stops})
+        self.store_ids = self.frame.store_id.values
+        self.number_of_stores = self.frame.groupby("company").store_id.size().to_dict()
+
+    def _find(self, store_id: str) -> Optional[int]:
+        pos = np.searchsorted(self.store_ids, store_id, side="left")
+        if pos < self.store_ids.size and self.store_ids[pos] == store_id:
+            return pos
+        return None
+
+    def contains(self, store_id: str) -> bool:
+        return self._find(store_id) is not None
+
+    def get(self, store_id: str) -> dict:
+        """
+        Store attributes
+        Ex: {'store_id': 'magazine-luiza_0', 'company': 'magazine-luiza', 'store_type': 't3',
+             'latitude': '-23.5975251', 'longitude': '-46.6025457', 'row_start': 0, 'row_stop': 4}
+        :raise KeyError: unknown store_id
+        """
+        pos = self._find(store_id)
+        if pos is None:
+            raise KeyError(store_id)
+        return self.frame.iloc[pos].to_dict()
+
+    def get_store_type(self, store_id: str) -> str:
+        return self.get(store_id)["store_type"]
+
+    def search(self, prefix: str = "", company_id: Optional[str] = None, limit: Optional[int] = None) -> "pd.DataFrame":
+        """
+        Stores whose store_id starts with prefix, sorted by store_id
+        :param prefix: store_id prefix
+        :param company_id: only stores of a company
+        :param limit: max number of stores
+        :return: dataFrame [store_id] + STORE_ATTRIBUTES
+        """
+        lo = np.searchsorted(self.store_ids, prefix, side="left")
+        hi = np.searchsorted(self.store_ids, prefix + "\U0010FFFF", side="left")
+        tmp_df = self.frame.iloc[lo:hi][["store_id"] + STORE_ATTRIBUTES]
+        if company_id is not None:
+            tmp_df = tmp_df.loc[tmp_df.company == company_id]
+        if limit is not None:
+            tmp_df = tmp_df.iloc[:limit]
+        return tmp_df
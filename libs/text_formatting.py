@@ -1,8 +1,38 @@
 import string
 import re
+import sys
 import unicodedata
+from functools import lru_cache
 from typing import *
 
+import pandas as pd
+
+NORMALIZE_CACHE_SIZE = 2 ** 16
+TOKENS_CHUNK_SIZE = 10000
+
+_PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+_NUMBERS_RE = re.compile(r'\b[0-9]+\b')
+_combining_marks_table = None
+
+
+def _get_combining_marks_table() -> dict:
+    """
+    Translation table deleting every nonspacing mark (category Mn), built on first use
+    """
+    global _combining_marks_table
+    if _combining_marks_table is None:
+        _combining_marks_table = {c: None for c in range(sys.maxunicode + 1)
+                                  if unicodedata.category(chr(c)) == 'Mn'}
+    return _combining_marks_table
+
+
+def _is_ascii(s: str) -> bool:
+    try:
+        s.encode("ascii")
+    except UnicodeEncodeError:
+        return False
+    return True
+
 
 def normalize_text(text):
     """
@@ -12,16 +42,21 @@ def normalize_text(text):
     """
     text = strip_accents(text)
     text = text.lower().strip()
-    text = text.translate(str.maketrans("", "", string.punctuation))
+    text = text.translate(_PUNCTUATION_TABLE)
     return text
 
 
+cached_normalize_text = lru_cache(maxsize=NORMALIZE_CACHE_SIZE)(normalize_text)
+
+
 def strip_accents(s):
-    return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
+    if _is_ascii(s):
+        return s
+    return unicodedata.normalize('NFD', s).translate(_get_combining_marks_table())
 
 
 def remove_numbers(text):
-    return re.sub(r'\b[0-9]+\b', '', text)
+    return _NUMBERS_RE.sub('', text)
 
 
 def tokenize(data, sep=None):
@@ -30,10 +65,31 @@ def tokenize(data, sep=None):
     return data.split()
 
 
+def format_texts(texts: "pd.Series", cache: bool = False) -> List[str]:
+    """
+    remove_numbers(normalize_text(text)) of a whole series
+    :param texts: text series
+    :param cache: memoize normalize_text (for columns with many repeated values, like titles)
+    :return:
+    """
+    normalize = cached_normalize_text if cache else normalize_text
+    return [remove_numbers(normalize(text)) for text in texts.values]
+
+
+def iter_tokens_from_RA_df(df, chunk_size: int = TOKENS_CHUNK_SIZE) -> Iterator[List[List[str]]]:
+    """
+    Stream the tokens of a RA dataframe (title + description), chunk_size reviews at a time
+    """
+    for start in range(0, df.shape[0], chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        titles = format_texts(chunk['title'], cache=True)
+        descriptions = format_texts(chunk['description'])
+        yield [tokenize(f"{title} {description}") for title, description in zip(titles, descriptions)]
+
+
 def get_tokens_from_RA_df(df) -> List[List[str]]:
-    def format_text_input(row):
-        return f"{remove_numbers(normalize_text(row['title']))} {remove_numbers(normalize_text(row['description']))}"
     # Get input tokens
-    texts = df.apply(format_text_input, axis=1)
-    tokens_sq = [tokenize(i) for i in texts.values]
+    tokens_sq = []
+    for tokens in iter_tokens_from_RA_df(df):
+        tokens_sq.extend(tokens)
     return tokens_sq
@@ -0,0 +1,67 @@
+from typing import *
+
+import numpy as np
+import pandas as pd
+
+TREND_LABELS = ["Consistently Improving", "Improving", "Worsening", "Consistently Worsening"]
+NO_TREND = -1
+
+
+class StoreTrends:
+    """
+    Trend label of every (store, issue) pair of a ranked view, computed once when the view is loaded.
+
+    Issue diffs are taken over each store's periods in one vectorized pass; the last two diffs
+    give the label, stored as int8 codes of TREND_LABELS (NO_TREND when there is none) on a
+    (store × issue) matrix.
+    """
+
+    def __init__(self, type_idx: "ViewIndex"):
+        type_ts = type_idx.view
+        self.issues = [col for col in type_ts.columns if "issues" in col and "rank" not in col]
+
+        positions, store_ids = type_idx.sorted_positions("store_id")
+        values = type_ts[self.issues].values[positions].astype(float)
+
+        # Diffs between consecutive periods of the same store (NaN on each store's first period)
+        new_store = np.ones(store_ids.size, dtype=bool)
+        new_store[1:] = store_ids[1:] != store_ids[:-1]
+        diffs = np.full(values.shape, np.nan)
+        diffs[1:] = values[1:] - values[:-1]
+        diffs[new_store] = np.nan
+
+        starts = np.flatnonzero(new_store)
+        ends = np.append(starts[1:], store_ids.size)[:starts.size] - 1
+        last = diffs[ends]
+        previous = diffs[np.maximum(ends - 1, 0)]
+        previous[ends == starts] = np.nan
+
+        # Two consecutive moves in the same direction are checked before a single one
+        with np.errstate(invalid="ignore"):
+            codes = np.select([(last < 0) & (previous < 0), last < 0, (last > 0) & (previous > 0), last > 0],
+                              [0, 1, 3, 2], default=NO_TREND)
+
+        self.store_ids = store_ids[starts]
+        self.codes = codes.astype(np.int8)
+        self._store_rows = {store_id: row for row, store_id in enumerate(self.store_ids)}
+
+    def get_store_trends(self, store_id: str) -> Dict[str, Optional[str]]:
+        """
+        {issue: trend label or None} of a store
+        """
+        row = self._store_rows.get(store_id)
+        if row is None:
+            return {issue: None for issue in self.issues}
+        return {issue: TREND_LABELS[code] if code != NO_TREND else None
+                for issue, code in zip(self.issues, self.codes[row])}
+
+    def get_trending_stores(self, issue: str, labels: List[str]) -> "pd.DataFrame":
+        """
+        Stores whose trend on an issue is one of labels
+        :return: dataFrame [store_id, performance]
+        """
+        label_codes = [TREND_LABELS.index(label) for label in labels]
+        issue_codes = self.codes[:, self.issues.index(issue)]
+        mask = np.isin(issue_codes, label_codes)
+        return pd.DataFrame({"store_id": self.store_ids[mask],
+                             "performance": np.array(TREND_LABELS, dtype=object)[issue_codes[mask]]})
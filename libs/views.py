@@ -0,0 +1,387 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import *
+
+import numpy as np
+import pandas as pd
+
+from libs.benchmarks import CompanyBenchmarks
+from libs.columnar import META_FILE, read_columnar, write_columnar
+from libs.distributions import MetricDistributions
+from libs.leaderboard import CompanyLeaderboard
+from libs.stores import StoreDimension
+from libs.trends import StoreTrends
+
+logger = logging.getLogger(__name__)
+
+
+def get_latest_period(type_ts: "pd.DataFrame") -> Optional["pd.Timestamp"]:
+    """
+    Latest date_comment available on a view
+    :param type_ts: view dataFrame
+    :return: latest period or None for an empty view
+    """
+    periods = type_ts.date_comment.dropna()
+    if periods.size == 0:
+        return None
+    return periods.max()
+
+
+def to_period_value(dt_period) -> int:
+    """
+    Convert a period (Timestamp, datetime or 'YYYY-MM-DD' string) to its int64 nanoseconds representation
+    """
+    return pd.Timestamp(dt_period).value
+
+
+class ViewIndex:
+    """
+    Sorted (key, date_comment) index over a ranked view.
+
+    For every key column the index keeps the row positions sorted by (key, date_comment), so
+    finding the rows of a store/company (optionally on a single period) is a pair of binary
+    searches instead of a boolean mask over the whole view. Rows with equal (key, date_comment)
+    keep the view order.
+    """
+
+    def __init__(self, type_ts: "pd.DataFrame", keys: Tuple[str, ...] = ("store_id", "company")):
+        self.view = type_ts
+        self.latest_period = get_latest_period(type_ts)
+        if self.latest_period is not None:
+            self.latest = type_ts.loc[type_ts.date_comment == self.latest_period]
+        else:
+            self.latest = type_ts.iloc[0:0]
+
+        self._dates = type_ts.date_comment.values.astype("datetime64[ns]").view("int64")
+        self._sorted = {key: self._sort_key(type_ts, key) for key in keys}
+
+    def _sort_key(self, type_ts: "pd.DataFrame", key: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        positions = np.flatnonzero(type_ts[key].notna().values)
+        key_values = type_ts[key].values[positions]
+        codes, _ = pd.factorize(key_values, sort=True)
+        order = np.lexsort((self._dates[positions], codes))
+        positions = positions[order]
+        return positions, key_values[order], self._dates[positions]
+
+    def locate(self, key: str, value, dt_period=None) -> np.ndarray:
+        """
+        Row positions (sorted by date_comment) of key == value, optionally restricted to a period
+        :param key: indexed key column (store_id/company)
+        :param value: key value
+        :param dt_period: period to restrict to
+        :return: array of positions on the view
+        """
+        positions, key_values, dates = self._sorted[key]
+        lo = np.searchsorted(key_values, value, side="left")
+        hi = np.searchsorted(key_values, value, side="right")
+        if dt_period is not None:
+            period = to_period_value(dt_period)
+            key_dates = dates[lo:hi]
+            lo, hi = lo + np.searchsorted(key_dates, period, side="left"), \
+                lo + np.searchsorted(key_dates, period, side="right")
+        return positions[lo:hi]
+
+    def sorted_positions(self, key: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Positions of the rows with a non null key sorted by (key, date_comment) and their key values
+        """
+        positions, key_values, _ = self._sorted[key]
+        return positions, key_values
+
+    def rows(self, key: str, value, dt_period=None) -> "pd.DataFrame":
+        """
+        Rows of key == value (optionally on dt_period) as a dataFrame slice of the view
+        """
+        return self.view.iloc[self.locate(key, value, dt_period)]
+
+    def contains(self, key: str, value) -> bool:
+        """
+        Check if a key value exists on the view
+        """
+        _, key_values, _ = self._sorted[key]
+        pos = np.searchsorted(key_values, value, side="left")
+        return pos < key_values.size and key_values[pos] == value
+
+
+def get_views_version(paths: Iterable[str]) -> str:
+    """
+    Version tag of a set of view files, changes whenever any file is rewritten
+    :param paths: view file paths
+    :return: short hex digest over (path, size, mtime) of every file
+    """
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        stat = os.stat(path)
+        digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+VIEW_FILES = {
+    "stores_ranked_df": "ranked_stores_ts_quarterly.pckl",
+    "stores_ranked_company_df": "ranked_company_stores_ts_quarterly.pckl",
+    "benchmark_df": "benchmarks_ts_quarterly.pckl",
+    "stores_performance_agg_view": "stores_performance_agg_view.pckl",
+}
+# Version and files of the view set published on a folder, written after the files it names
+VIEWS_MANIFEST = "views_manifest.json"
+
+
+class ViewSnapshot:
+    """
+    One version of the serving views plus everything derived from them.
+
+    A snapshot is never mutated after it is built: handlers grab the current snapshot once
+    and use it for the whole request, so a reload never mixes two versions of the data.
+    """
+
+    def __init__(self, frames: Dict[str, "pd.DataFrame"], version: str, load_report: Optional[dict] = None):
+        start = time.perf_counter()
+        self.version = version
+        self.loaded_at = time.time()
+        self.stores_ranked_df = frames["stores_ranked_df"]
+        self.stores_ranked_company_df = frames["stores_ranked_company_df"]
+        self.benchmark_df = frames["benchmark_df"]
+        self.stores_performance_agg_view = frames["stores_performance_agg_view"]
+
+        # Sorted (store_id/company, date_comment) lookups and latest period of the ranked views
+        self.stores_ranked_idx = ViewIndex(self.stores_ranked_df, keys=("store_id", "company"))
+        self.stores_ranked_company_idx = ViewIndex(self.stores_ranked_company_df, keys=("store_id",))
+
+        # One row per store: company, store_type, location and row range
+        self.store_dim = StoreDimension(self.stores_ranked_idx)
+
+        # Materialized company rankings
+        self.leaderboard = CompanyLeaderboard(self.stores_ranked_idx)
+
+        # Store x issue trend labels
+        self.store_trends = StoreTrends(self.stores_ranked_idx)
+
+        # Sorted metric values per (date_comment, company) for the distribution histograms
+        self.distributions = MetricDistributions(self.stores_ranked_df)
+
+        # Grouped sums/counts per (company, date_comment) for the leave-one-out company benchmarks
+        self.company_benchmarks = CompanyBenchmarks(self.stores_ranked_df)
+
+        self.load_report = dict(load_report or {})
+        self.load_report["finalize"] = {"seconds": round(time.perf_counter() - start, 4)}
+
+    def describe(self) -> dict:
+        return {"version": self.version,
+                "loaded_at": datetime.utcfromtimestamp(self.loaded_at).isoformat() + "Z",
+                "rows": {name: len(getattr(self, name)) for name in VIEW_FILES},
+                "load_report": self.load_report}
+
+
+def get_columnar_folder(folder: str, file_name: str) -> str:
+    """
+    Columnar folder of a view file, e.g. views/columnar + ranked_stores_ts_quarterly.pckl
+    -> views/columnar/ranked_stores_ts_quarterly
+    """
+    return os.path.join(folder, os.path.splitext(file_name)[0])
+
+
+def get_view_paths(folder: str, view_format: str = "pickle") -> List[str]:
+    """
+    Files whose changes define the version of views copied in by hand (the pickles or the columnar meta files)
+    """
+    if view_format == "columnar":
+        return [os.path.join(get_columnar_folder(folder, file_name), META_FILE) for file_name in VIEW_FILES.values()]
+    return [os.path.join(folder, file_name) for file_name in VIEW_FILES.values()]
+
+
+def get_views_manifest(folder: str) -> Optional[dict]:
+    """
+    {"version": version, "files": {view name: file name}} of the last view set published on a folder,
+    None for folders whose views were copied in by hand (VIEW_FILES names)
+    """
+    manifest_path = os.path.join(folder, VIEWS_MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def get_view_files(folder: str, view_format: str = "pickle") -> Tuple[str, Dict[str, str]]:
+    """
+    Active version of a views folder and the file name of every view in it
+    :return: (version, {view name: file name})
+    """
+    manifest = get_views_manifest(folder)
+    if manifest is not None:
+        return manifest["version"], manifest["files"]
+    return get_views_version(get_view_paths(folder, view_format)), dict(VIEW_FILES)
+
+
+def get_view_file_names(folder: str) -> Dict[str, str]:
+    """
+    {view name: file name} of the views of a folder, which may not exist yet
+    """
+    manifest = get_views_manifest(folder)
+    return manifest["files"] if manifest is not None else dict(VIEW_FILES)
+
+
+def _is_published_view(entry: str) -> bool:
+    """
+    Whether a folder entry is a view file (or columnar folder) written by publish_view_files
+    """
+    return any(entry.startswith(os.path.splitext(file_name)[0] + ".") and entry != file_name
+               for file_name in VIEW_FILES.values())
+
+
+def publish_view_files(frames: Dict[str, "pd.DataFrame"], folder: str = "views",
+                       view_format: str = "pickle") -> str:
+    """
+    Write a consistent set of views: every view goes to a new file named after the new version, then
+    VIEWS_MANIFEST naming them replaces the previous one. Readers only follow the manifest, so a reload
+    never mixes views of two versions. Files of versions older than the previous one are removed.
+    :param frames: {view name: dataFrame} of every VIEW_FILES name
+    :param folder: views folder
+    :param view_format: pickle or columnar
+    :return: published version
+    """
+    os.makedirs(folder, exist_ok=True)
+    version = uuid.uuid4().hex[:12]
+    files = dict()
+    for name, file_name in VIEW_FILES.items():
+        stem, extension = os.path.splitext(file_name)
+        files[name] = f"{stem}.{version}{extension}"
+        if view_format == "columnar":
+            write_columnar(frames[name], get_columnar_folder(folder, files[name]))
+        elif view_format == "pickle":
+            with open(os.path.join(folder, files[name]), "wb") as f:
+                pickle.dump(frames[name], f)
+        else:
+            raise ValueError(f"Unknown views format '{view_format}'")
+
+    previous = get_views_manifest(folder)
+    tmp_path = os.path.join(folder, f".{VIEWS_MANIFEST}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"version": version, "files": files}, f)
+    os.replace(tmp_path, os.path.join(folder, VIEWS_MANIFEST))
+
+    # Workers may still be loading the previous version, only the older ones are removed
+    live = set(files.values()) | set(previous["files"].values() if previous is not None else [])
+    if view_format == "columnar":
+        live = {os.path.basename(get_columnar_folder(folder, file_name)) for file_name in live}
+    for entry in os.listdir(folder):
+        if _is_published_view(entry) and entry not in live:
+            path = os.path.join(folder, entry)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+    return version
+def load_view(folder: str, file_name: str, view_format: str = "pickle") -> "pd.DataFrame":
+    if view_format == "columnar":
+        return read_columnar(get_columnar_folder(folder, file_name))
+    elif view_format == "pickle":
+        return pickle.load(open(os.path.join(folder, file_name), "rb"))
+    raise ValueError(f"Unknown views format '{view_format}'")
+
+
+def load_snapshot(folder: str = "views", view_format: str = "pickle") -> ViewSnapshot:
+    """
+    Load the view files of a folder into a snapshot
+    :param folder: views folder
+    :param view_format: pickle or columnar (memory-mapped, pages shared by every worker)
+    :return: ViewSnapshot
+    """
+    version, file_names = get_view_files(folder, view_format)
+    frames = {}
+    load_report = {}
+    for name, file_name in file_names.items():
+        start = time.perf_counter()
+        frames[name] = load_view(folder, file_name, view_format)
+        load_report[name] = {"rows": len(frames[name]),
+                             "seconds": round(time.perf_counter() - start, 4),
+                             "memory_mb": round(frames[name].memory_usage(deep=True).sum() / 2 ** 20, 2)}
+    # Published files are never rewritten, but views copied in by hand may be replaced while loading
+    if get_views_manifest(folder) is None and get_views_version(get_view_paths(folder, view_format)) != version:
+        raise RuntimeError(f"View files on '{folder}' changed while loading")
+    return ViewSnapshot(frames, version, load_report)
+
+
+def convert_views(folder: str = "views", output_folder: str = "views/columnar"):
+    """
+    Convert the pickled views of a folder to the memory-mapped columnar format, published as a new version
+    of output_folder
+    :param folder: folder with the view pickles
+    :param output_folder: columnar views folder
+    """
+    _, file_names = get_view_files(folder)
+    frames = {name: load_view(folder, file_name) for name, file_name in file_names.items()}
+    version = publish_view_files(frames, output_folder, view_format="columnar")
+    for name, view in frames.items():
+        logger.info(f"Converted {name} ({len(view)} rows)")
+    logger.info(f"Columnar views version {version} published on '{output_folder}'")
+
+
+class ViewRegistry:
+    """
+    Holds the active ViewSnapshot and swaps in new versions of the view files.
+
+    Reloads build the new snapshot aside (in an executor when triggered from the event loop)
+    and publish it with a single reference assignment; requests that already hold the
+    previous snapshot finish on it.
+    """
+
+    def __init__(self, folder: str = "views", view_format: str = "pickle"):
+        self.folder = folder
+        self.view_format = view_format
+        self._snapshot = None
+        self._reload_lock = threading.Lock()
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._snapshot.version if self._snapshot is not None else None
+
+    def current(self) -> ViewSnapshot:
+        return self._snapshot
+
+    def load(self) -> ViewSnapshot:
+        """
+        Load the view files and make them the active snapshot
+        """
+        with self._reload_lock:
+            snapshot = load_snapshot(self.folder, self.view_format)
+            self._snapshot = snapshot
+        logger.info(f"Views version {snapshot.version} active")
+        return snapshot
+
+    def reload_if_changed(self) -> bool:
+        """
+        Reload the views if the files on disk differ from the active version
+        :return: True if a new snapshot was swapped in
+        """
+        try:
+            if get_view_files(self.folder, self.view_format)[0] == self.version:
+                return False
+            self.load()
+            return True
+        except Exception as err:
+            logger.error(f"Error reloading views from '{self.folder}', keeping version {self.version}")
+            logger.error(err)
+            return False
+
+    async def reload(self) -> bool:
+        """
+        Reload in the default executor so the event loop keeps serving from the active snapshot
+        """
+        return await asyncio.get_event_loop().run_in_executor(None, self.reload_if_changed)
+
+    async def watch(self, interval: float):
+        """
+        Poll the views folder every interval seconds and reload on changes
+        """
+        while True:
+            await asyncio.sleep(interval)
+            await self.reload()
@@ -1,9 +1,17 @@
+import gc
 from sanic import Sanic
-from blueprints.bp_v0 import bp_v0
+from blueprints.bp_v0 import bp_v0, load_views
+from blueprints.general import bp_admin, setup_metrics
+from libs.views import convert_views
+from libs.pipeline import build_views
 from fire import Fire
 import yaml
 from sanic_cors import CORS, cross_origin
 import os
+import time
+
+STARTED_AT = time.time()
+
 
 class Dashboard:
 
@@ -16,11 +24,31 @@ class Dashboard:
     def _build_server(config):
         app = Sanic("BNP_API")
         app.config.update(config)
+        app.config["STARTED_AT"] = STARTED_AT
         app.blueprint(bp_v0)
+        app.blueprint(bp_admin)
+        setup_metrics(app)
         CORS(app)
         return app
 
+    def convert_views(self, folder="views", output_folder="views/columnar"):
+        """
+        Convert the pickled views to the memory-mapped columnar format (served with VIEWS.format: columnar)
+        """
+        convert_views(folder, output_folder)
+
+    def build_views(self, reviews_folder, stores_path, output_folder="views", cache_folder="views/.cache", workers=1):
+        """
+        Build the views from the scraped store reviews (stages cached on cache_folder) and publish them on output_folder
+        """
+        build_views(reviews_folder, stores_path, output_folder, cache_folder, int(workers))
+
     def run_server(self):
+        if self.config.get('VIEWS', {}).get('preload', False):
+            # Load the views once before forking, workers inherit them copy-on-write
+            load_views(self.config)
+            if hasattr(gc, "freeze"):
+                gc.freeze()  # Keep the collector from touching (and copying) the inherited objects
         self.app.run(host=self.config['APP']['host'],
                      port=int(self.config['APP']['port']),
                      access_log=True,
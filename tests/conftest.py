@@ -0,0 +1,49 @@
+import asyncio
+import os
+
+import pytest
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ApiClient:
+    """
+    Calls the app through its ASGI test client on a dedicated event loop
+    """
+
+    def __init__(self, app, loop):
+        self.app = app
+        self.loop = loop
+
+    def get(self, path: str, **kwargs):
+        _, response = self.loop.run_until_complete(self.app.asgi_client.get(path, **kwargs))
+        return response
+
+    def post(self, path: str, **kwargs):
+        _, response = self.loop.run_until_complete(self.app.asgi_client.post(path, **kwargs))
+        return response
+
+
+@pytest.fixture(scope="session")
+def api():
+    """
+    The dashboard app serving the shipped views
+    """
+    from main import Dashboard
+
+    with open(os.path.join(ROOT, "config.yaml")) as f:
+        config = yaml.safe_load(f)
+    config["VIEWS"] = dict(config.get("VIEWS", {}), path=os.path.join(ROOT, "views"), format="pickle",
+                           watch_interval=0)
+    app = Dashboard._build_server(config)
+    # After building the app, sanic may have switched the event loop policy to uvloop
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # The ASGI test client does not run the before_server_start listeners
+    for listener in app.listeners["before_server_start"]:
+        result = listener(app, loop)
+        if asyncio.iscoroutine(result):
+            loop.run_until_complete(result)
+    yield ApiClient(app, loop)
+    loop.close()
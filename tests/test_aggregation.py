@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+
+from libs.aggregation import update_views
+from libs.views import get_view_files, load_view
+
+
+def make_reviews_df(reviews: list) -> "pd.DataFrame":
+    """
+    reviews being [(store_id, date, rating)], every store of type t1
+    """
+    return pd.DataFrame({"store_id": [store_id for store_id, _, _ in reviews], "store_type": "t1",
+                         "date_comment": pd.to_datetime([date for _, date, _ in reviews]),
+                         "rating": [rating for _, _, rating in reviews],
+                         "product_issues": [0.0] * len(reviews)})
+
+
+def make_stores_info(store_ids: list) -> "pd.DataFrame":
+    return pd.DataFrame({"store_id": store_ids, "company": [store_id.split("_")[0] for store_id in store_ids],
+                         "latitude": "-23.5", "longitude": "-46.6"})
+
+
+def load_ranked_df(folder) -> "pd.DataFrame":
+    _, file_names = get_view_files(str(folder))
+    return load_view(str(folder), file_names["stores_ranked_df"])
+
+
+def test_update_views_with_a_new_store(tmp_path):
+    folder, state_path = tmp_path / "views", str(tmp_path / "state.pckl")
+    update_views(make_reviews_df([("a_0", "2020-01-10", 4), ("a_1", "2020-01-11", 2)]), state_path, str(folder),
+                 stores_info=make_stores_info(["a_0", "a_1"]))
+    assert sorted(load_ranked_df(folder).store_id) == ["a_0", "a_1"]
+
+    # Only the new store needs its info, the others keep the info of the current views
+    quarters = update_views(make_reviews_df([("b_0", "2020-02-01", 5)]), state_path, str(folder),
+                            stores_info=make_stores_info(["b_0"]))
+    assert quarters == [pd.Timestamp("2020-03-31")]
+    ranked_df = load_ranked_df(folder).set_index("store_id")
+    assert sorted(ranked_df.index) == ["a_0", "a_1", "b_0"]
+    assert ranked_df.loc["b_0", "company"] == "b"
+    assert ranked_df.rating_rank.round(3).to_dict() == {"a_0": 0.667, "a_1": 0.333, "b_0": 1.0}
+
+
+def test_update_views_needs_the_info_of_every_store(tmp_path):
+    folder, state_path = tmp_path / "views", str(tmp_path / "state.pckl")
+    reviews_df = make_reviews_df([("a_0", "2020-01-10", 4)])
+    with pytest.raises(ValueError):
+        update_views(reviews_df, state_path, str(folder))
+    update_views(reviews_df, state_path, str(folder), stores_info=make_stores_info(["a_0"]))
+    with pytest.raises(ValueError):
+        update_views(make_reviews_df([("b_0", "2020-02-01", 5)]), state_path, str(folder))
+    assert sorted(load_ranked_df(folder).store_id) == ["a_0"]
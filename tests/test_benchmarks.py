@@ -0,0 +1,36 @@
+import pytest
+
+from libs import features as feat
+from libs.benchmarks import CompanyBenchmarks
+from tests.test_distributions import make_type_ts
+
+
+def get_groupby_comparison(company_id: str, metric: str, stores_ts: "pd.DataFrame") -> list:
+    """
+    Company x benchmark records as computed with two groupbys before CompanyBenchmarks
+    """
+    tmp_df = stores_ts.loc[(stores_ts.company == company_id)][["date_comment", metric]].groupby(
+        "date_comment").mean().reset_index()
+    benchmark_ts = stores_ts.loc[(stores_ts.company != company_id)][["date_comment", metric]].groupby(
+        "date_comment").mean().reset_index()
+    tmp_df = tmp_df.merge(benchmark_ts, on="date_comment", suffixes=('_company', '_benchmark'))
+    tmp_df.columns = ["date_comment", "metric", "benchmark"]
+    tmp_df.date_comment = tmp_df.date_comment.astype(str)
+    return tmp_df.dropna(axis=1).to_dict("records")
+
+
+def test_company_series_match_the_groupbys():
+    type_ts = make_type_ts()
+    # Company b has no rating at all on the first date
+    type_ts.loc[(type_ts.company == "b") & (type_ts.date_comment == "2019-12-31"), "rating"] = float("nan")
+    company_benchmarks = CompanyBenchmarks(type_ts)
+    for metric in ["rating", "product_issues"]:
+        for company_id in ["a", "b", "c", "unknown"]:
+            records = feat.get_company_bechmark_comparison(company_id, metric, company_benchmarks)
+            expected = get_groupby_comparison(company_id, metric, type_ts)
+            assert [sorted(record) for record in records] == [sorted(record) for record in expected]
+            assert [record["date_comment"] for record in records] == [record["date_comment"] for record in expected]
+            for column in ["metric", "benchmark"]:
+                if expected and column in expected[0]:
+                    assert [record[column] for record in records] == pytest.approx(
+                        [record[column] for record in expected])
@@ -0,0 +1,43 @@
+import json
+
+
+def get_store_id(api) -> str:
+    return api.get("/stores?limit=1").json()[0]["store_id"]
+
+
+def test_batch_rejects_non_string_ids(api):
+    store_id = get_store_id(api)
+    queries = [{"kind": "store", "metric": "rating", "id": store_id},
+               {"kind": "store", "metric": "rating", "id": 5},
+               {"kind": "store", "metric": "rating", "id": [store_id]},
+               {"kind": "company", "metric": "rating", "id": {"id": store_id}}]
+    response = api.post("/batch", data=json.dumps({"queries": queries}))
+    assert response.status == 200
+    statuses = [result["status"] for result in response.json()["results"]]
+    assert statuses == [200, 400, 400, 400]
+    assert all(result["error"] == "Invalid query id" for result in response.json()["results"][1:])
+
+
+def test_distribution_rejects_non_finite_range(api):
+    company_id = get_store_id(api).rsplit("_", 1)[0]
+    path = f"/metric/distribution/rating/company/{company_id}/latest"
+    assert api.get(path + "?range=0,5").status == 200
+    for metric_range in ["0,inf", "-inf,5", "nan,1", "0,nan"]:
+        assert api.get(f"{path}?range={metric_range}").status == 400
+
+
+def test_stores_rejects_negative_limit(api):
+    assert len(api.get("/stores?limit=2").json()) == 2
+    assert api.get("/stores?limit=-1").status == 400
+
+
+def test_unknown_company_markers_are_not_cached(api):
+    entries = api.get("/cache/stats").json()["entries"]
+    for i in range(3):
+        response = api.get(f"/geoMarkers/rating/company/unknown-{i}")
+        assert response.status == 200 and response.json() == []
+    assert api.get("/cache/stats").json()["entries"] == entries
+
+    company_id = get_store_id(api).rsplit("_", 1)[0]
+    assert len(api.get(f"/geoMarkers/rating/company/{company_id}").json()) > 0
+    assert api.get("/cache/stats").json()["entries"] == entries + 1
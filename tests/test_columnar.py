@@ -0,0 +1,55 @@
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from libs.columnar import get_codes_dtype, read_columnar, write_columnar
+from libs.views import VIEW_FILES
+from tests.conftest import ROOT
+
+
+def assert_round_trip(df: "pd.DataFrame", loaded: "pd.DataFrame"):
+    assert list(loaded.columns) == list(df.columns)
+    pd.testing.assert_index_equal(loaded.index, df.index)
+    for col in df.columns:
+        if df[col].dtype == object:
+            assert loaded[col].dtype == "category"
+            pd.testing.assert_series_equal(loaded[col].astype(object), df[col])
+        else:
+            pd.testing.assert_series_equal(loaded[col], df[col])
+
+
+@pytest.mark.parametrize("file_name", list(VIEW_FILES.values()))
+def test_round_trip_of_the_shipped_views(tmp_path, file_name):
+    df = pickle.load(open(os.path.join(ROOT, "views", file_name), "rb"))
+    write_columnar(df, str(tmp_path))
+    assert_round_trip(df, read_columnar(str(tmp_path)))
+    assert_round_trip(df, read_columnar(str(tmp_path), mmap_mode=None))
+
+
+def test_round_trip_of_nan_strings_and_int_index(tmp_path):
+    n = 300
+    df = pd.DataFrame({"store_id": [f"store_{i}" for i in range(n)],
+                       "company": [None if i % 7 == 0 else f"company_{i % 3}" for i in range(n)],
+                       "rating": np.linspace(0, 5, n),
+                       "reviews": np.arange(n, dtype=np.int64),
+                       "date_comment": pd.date_range("2019-01-01", periods=n, freq="D")},
+                      index=np.arange(n, dtype=np.int64)[::-1] * 2)
+    df.loc[df.index[5], "company"] = np.nan
+    write_columnar(df, str(tmp_path))
+    loaded = read_columnar(str(tmp_path))
+
+    assert_round_trip(df, loaded)
+    assert loaded.company.isna().sum() == df.company.isna().sum()
+    # 300 store ids do not fit int8 codes
+    assert loaded.store_id.cat.codes.dtype == get_codes_dtype(n) == np.int16
+    assert loaded.company.cat.codes.dtype == np.int8
+
+
+def test_rewrite_replaces_the_previous_build(tmp_path):
+    write_columnar(pd.DataFrame({"a": [1.0, 2.0]}), str(tmp_path))
+    build_id = write_columnar(pd.DataFrame({"a": [3.0], "b": ["x"]}), str(tmp_path))
+    assert all(file_name.startswith(build_id) for file_name in os.listdir(tmp_path) if file_name.endswith(".npy"))
+    assert read_columnar(str(tmp_path)).to_dict("list") == {"a": [3.0], "b": ["x"]}
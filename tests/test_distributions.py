@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from libs.distributions import MetricDistributions
+
+
+def make_type_ts() -> "pd.DataFrame":
+    """
+    Two dates (plus a row without date), values on bin edges, out of range and NaN, stores without company
+    """
+    rng = np.random.RandomState(0)
+    n = 300
+    df = pd.DataFrame({"date_comment": pd.to_datetime(rng.choice(["2019-12-31", "2020-03-31"], size=n)),
+                       "company": rng.choice(["a", "b", "c", None], size=n, p=[0.4, 0.3, 0.2, 0.1]),
+                       "rating": np.round(rng.uniform(-0.5, 5.5, size=n) * 4) / 4,
+                       "product_issues": rng.uniform(0, 0.6, size=n)})
+    df.loc[rng.rand(n) < 0.1, "rating"] = np.nan
+    df.loc[:9, "rating"] = [0, 0.5, 5, 5, 2.5, 2.5, -1, 6, 4.75, 0]
+    df.loc[10, "date_comment"] = pd.NaT
+    # Company c has no stores on the last date
+    return df.loc[~((df.company == "c") & (df.date_comment == "2020-03-31"))].reset_index(drop=True)
+
+
+def test_histograms_match_np_histogram():
+    type_ts = make_type_ts()
+    distributions = MetricDistributions(type_ts)
+    for metric, metric_range in [("rating", (0, 5)), ("rating", (1, 4.5)), ("product_issues", (0, 0.5))]:
+        for bins in [1, 4, 10, 20]:
+            edges = np.linspace(metric_range[0], metric_range[1], bins + 1)
+            for dt_period in ["2019-12-31", "2020-03-31", "2021-03-31"]:
+                on_date = type_ts.loc[type_ts.date_comment == dt_period]
+                for company_id in ["a", "c", "unknown"]:
+                    company, benchmark = distributions.get_histograms(metric, company_id, dt_period, edges)
+                    expected_company, _ = np.histogram(on_date.loc[on_date.company == company_id, metric].dropna(),
+                                                       bins=bins, range=metric_range)
+                    expected_benchmark, _ = np.histogram(on_date.loc[on_date.company != company_id, metric].dropna(),
+                                                         bins=bins, range=metric_range)
+                    np.testing.assert_array_equal(company, expected_company)
+                    np.testing.assert_array_equal(benchmark, expected_benchmark)
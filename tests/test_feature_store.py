@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic_corpus import WORDS, StubEmbeddingModel
+from libs import feature_store
+from libs.feature_store import FeatureStore, get_cached_text_feature_df
+
+
+def make_reviews_df(review_ids) -> "pd.DataFrame":
+    return pd.DataFrame({"review_ID": [str(review_id) for review_id in review_ids],
+                         "title": ["Produto com defeito"] * len(review_ids),
+                         "description": [" ".join(WORDS[review_id:review_id + 5]) for review_id in review_ids]})
+
+
+def test_cached_features_of_no_reviews(tmp_path):
+    model = StubEmbeddingModel(dims=16)
+    features_df = get_cached_text_feature_df(make_reviews_df([]), model, str(tmp_path))
+    assert features_df.shape == (0, 16)
+    assert list(features_df.columns) == [f"feat_{i}" for i in range(16)]
+
+
+def test_cached_features_match_a_fresh_build(tmp_path):
+    model = StubEmbeddingModel(dims=16, oov=0)
+    first_df = get_cached_text_feature_df(make_reviews_df([1, 2, 3]), model, str(tmp_path))
+    features_df = get_cached_text_feature_df(make_reviews_df([3, 4, 1]), model, str(tmp_path))
+    assert features_df.shape == (3, 16) and features_df.dtypes.eq(np.float32).all()
+    # Positions in the second reviews_df: 3 -> 0, 1 -> 2
+    np.testing.assert_array_equal(features_df.loc[0].values, first_df.loc[2].values)
+    np.testing.assert_array_equal(features_df.loc[2].values, first_df.loc[0].values)
+    assert not np.array_equal(features_df.loc[0].values, features_df.loc[1].values)
+
+
+def test_store_reads_and_retains_across_segments(tmp_path):
+    store = FeatureStore(str(tmp_path), "model")
+    for segment in range(3):
+        review_ids = [f"{segment}-{i}" for i in range(4)]
+        vectors = np.full((4, 2), segment, dtype=np.float32) + np.arange(4, dtype=np.float32)[:, None]
+        store.add(review_ids, vectors, np.arange(4) != 3)
+    assert len(store.segments) == 3
+
+    vectors, found, has_vector = store.get(["2-1", "x", "0-3", "1-0", "2-1"])
+    assert found.tolist() == [True, False, True, True, True]
+    assert has_vector.tolist() == [True, False, False, True, True]
+    np.testing.assert_array_equal(vectors[:, 0], [3, 0, 3, 1, 3])
+
+    # Duplicated ids are kept once
+    store.retain(["1-0", "1-0", "2-2", "unknown"])
+    assert len(store) == 2 and len(store.segments) == 1
+    np.testing.assert_array_equal(store.get(["2-2", "1-0"])[0][:, 0], [4, 1])
+
+
+def test_cached_features_compact_the_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(feature_store, "MAX_SEGMENTS", 2)
+    model = StubEmbeddingModel(dims=4, oov=0)
+    for review_id in range(4):
+        get_cached_text_feature_df(make_reviews_df([review_id]), model, str(tmp_path))
+    store = FeatureStore(str(tmp_path), feature_store.get_model_fingerprint(model))
+    assert len(store) == 4 and len(store.segments) <= 2
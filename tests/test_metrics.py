@@ -0,0 +1,22 @@
+import inspect
+import types
+
+from blueprints.general import TIMED_FEATURES
+from libs import features
+from libs import metrics
+
+
+def test_instrument_module_times_only_the_named_functions():
+    module = types.ModuleType("fake_features")
+    exec("def outer(x):\n    return inner(x) + 1\n\ndef inner(x):\n    return x * 2\n", module.__dict__)
+
+    assert metrics.instrument_module(module, ["outer"]) == ["outer"]
+    assert getattr(module.outer, "_timed", False) and not getattr(module.inner, "_timed", False)
+    assert module.outer(2) == 5
+    assert 'function="outer"' in metrics.registry.render()
+    assert 'function="inner"' not in metrics.registry.render()
+
+
+def test_timed_features_are_features_functions():
+    assert all(inspect.isfunction(getattr(features, name, None)) for name in TIMED_FEATURES)
+    assert not {"evaluation_results", "format_issues_columns"} & set(TIMED_FEATURES)
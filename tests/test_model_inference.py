@@ -0,0 +1,19 @@
+import numpy as np
+
+from libs import model_inference as mi
+
+
+def test_batch_embeddings_across_token_batches(monkeypatch):
+    rng = np.random.RandomState(0)
+    vectors = rng.rand(50, 8).astype(np.float32)
+    vocabulary = {f"w{i}": i for i in range(vectors.shape[0])}
+    review_seqs = [[f"w{i}" for i in rng.randint(0, 60, size=rng.randint(0, 12))] for _ in range(200)]
+
+    # Small batches so reviews span several of them
+    monkeypatch.setattr(mi, "TOKEN_BATCH_SIZE", 7)
+    embeddings, has_vector = mi.get_batch_embeddings(review_seqs, vocabulary, vectors)
+
+    expected = [vectors[[vocabulary[w] for w in seq if w in vocabulary]] for seq in review_seqs]
+    assert has_vector.tolist() == [rows.size > 0 for rows in expected]
+    assert embeddings.dtype == np.float32
+    np.testing.assert_allclose(embeddings, [rows.mean(axis=0) for rows in expected if rows.size], rtol=1e-6)
@@ -0,0 +1,43 @@
+import inspect
+import json
+import os
+
+import pandas as pd
+
+from libs import maps, pipeline
+from libs.views import get_views_manifest
+
+
+def write_store_reviews(folder) -> str:
+    os.makedirs(folder)
+    stores = ["a_0", "a_1", "b_0"]
+    with open(os.path.join(folder, "reviews.jl"), "w") as f:
+        for i in range(30):
+            review = {"review_ID": str(i), "store_id": stores[i % 3], "datetime": f"2019-{i % 12 + 1:02d}-10T10:00:00Z",
+                      "rating": i % 5 + 1, "n_review_user": 10, "len_comment": 50 + i, "relative": 100,
+                      "n_photo_user": None, "tags": []}
+            f.write(json.dumps(review) + "\n")
+    stores_path = os.path.join(folder, "stores.pckl")
+    pd.DataFrame({"store_id": stores, "store_type": "t1", "company": [s.split("_")[0] for s in stores],
+                  "latitude": "-23.5", "longitude": "-46.6"}).to_pickle(stores_path)
+    return stores_path
+
+
+def test_build_views_into_a_new_folder(tmp_path):
+    stores_path = write_store_reviews(str(tmp_path / "reviews"))
+    output_folder = str(tmp_path / "out" / "views")
+    pipeline.build_views(str(tmp_path / "reviews"), stores_path, output_folder, str(tmp_path / "cache"))
+    assert get_views_manifest(output_folder) is not None
+    assert os.path.exists(os.path.join(output_folder, pipeline.STATE_FILE))
+
+
+def test_tag_map_changes_invalidate_the_cleaning_stages(monkeypatch):
+    params = {"reviews_folder": os.path.dirname(__file__), "stores_path": __file__, "chunk_size": 10}
+    stages = {stage.name: stage for stage in pipeline.VIEW_STAGES}
+    before = stages["ingest"].get_key(params, {}), stages["aggregate"].get_key(params, {"clean": "x"})
+
+    get_source = inspect.getsource
+    monkeypatch.setattr(pipeline.inspect, "getsource",
+                        lambda obj: get_source(obj) + ("# edited" if obj is maps else ""))
+    after = stages["ingest"].get_key(params, {}), stages["aggregate"].get_key(params, {"clean": "x"})
+    assert before[0] != after[0] and before[1] != after[1]
@@ -0,0 +1,15 @@
+from libs.response_cache import ENTRY_OVERHEAD, ResponseCache
+
+
+def test_size_counts_keys_and_entry_overhead():
+    cache = ResponseCache(max_bytes=10 * ENTRY_OVERHEAD)
+    cache.put(("geoMarkers/company", "rating", "a", "v1"), "[]")
+    assert cache.stats()["size_bytes"] == len("[]") + len("geoMarkers/companyratingav1") + ENTRY_OVERHEAD
+
+    # Small bodies are still bounded by their overhead
+    for i in range(100):
+        cache.put(("geoMarkers/company", "rating", f"company-{i}", "v1"), "[]")
+    stats = cache.stats()
+    assert stats["entries"] < 10 and stats["size_bytes"] <= 10 * ENTRY_OVERHEAD
+    assert cache.get(("geoMarkers/company", "rating", "company-99", "v1")) == b"[]"
+    assert cache.get(("geoMarkers/company", "rating", "a", "v1")) is None
@@ -0,0 +1,27 @@
+import pandas as pd
+
+from libs.trends import StoreTrends
+from libs.views import ViewIndex
+
+
+def make_type_ts(issues: dict) -> "pd.DataFrame":
+    """
+    Ranked view with one row per (store, quarter), issues being {store_id: [product_issues per quarter]}
+    """
+    dates = pd.date_range("2020-01-01", periods=max(len(values) for values in issues.values()), freq="QS")
+    rows = [{"store_id": store_id, "company": "c", "date_comment": dates[i],
+             "product_issues": value, "product_issues_rank": 0.5}
+            for store_id, values in issues.items() for i, value in enumerate(values)]
+    return pd.DataFrame(rows)
+
+
+def test_trend_labels():
+    type_ts = make_type_ts({"better_twice": [3, 2, 1], "better": [1, 2, 1], "worse": [2, 1, 2],
+                            "worse_twice": [1, 2, 3], "flat": [1, 1, 1], "single": [1]})
+    trends = StoreTrends(ViewIndex(type_ts))
+    labels = {store_id: trends.get_store_trends(store_id)["product_issues"] for store_id in type_ts.store_id.unique()}
+    assert labels == {"better_twice": "Consistently Improving", "better": "Improving", "worse": "Worsening",
+                      "worse_twice": "Consistently Worsening", "flat": None, "single": None}
+    worsening = trends.get_trending_stores("product_issues", ["Worsening", "Consistently Worsening"])
+    assert dict(zip(worsening.store_id, worsening.performance)) == {"worse": "Worsening",
+                                                                    "worse_twice": "Consistently Worsening"}
@@ -0,0 +1,44 @@
+import os
+import pickle
+
+from benchmarks.synthetic_views import make_views
+from libs.aggregation import publish_views
+from libs.views import VIEW_FILES, ViewRegistry, convert_views, get_views_manifest, load_snapshot
+
+VIEWS_PARAMS = {"n_stores": 60, "n_companies": 4, "n_quarters": 3, "n_metrics": 3}
+
+
+def test_registry_follows_the_published_manifest(tmp_path):
+    folder = str(tmp_path)
+    first = publish_views(make_views(seed=0, **VIEWS_PARAMS), folder)
+    registry = ViewRegistry(folder)
+    assert registry.load().version == first
+
+    # A publish interrupted before its manifest leaves the active set untouched
+    stem, extension = os.path.splitext(VIEW_FILES["stores_ranked_df"])
+    with open(os.path.join(folder, f"{stem}.partial{extension}"), "wb") as f:
+        pickle.dump(make_views(seed=1, **VIEWS_PARAMS)["stores_ranked_df"], f)
+    assert not registry.reload_if_changed() and registry.version == first
+
+    second = publish_views(make_views(seed=2, **VIEWS_PARAMS), folder)
+    assert registry.reload_if_changed() and registry.version == second
+    third = publish_views(make_views(seed=3, **VIEWS_PARAMS), folder)
+
+    # Only the last two versions are kept
+    kept = {file_name.split(".")[1] for file_name in os.listdir(folder) if file_name.startswith(stem + ".")}
+    assert kept == {second, third}
+    assert get_views_manifest(folder)["version"] == third
+
+
+def test_columnar_conversion_is_published_as_one_version(tmp_path):
+    pickles, columnar = str(tmp_path / "pickle"), str(tmp_path / "columnar")
+    views = make_views(**VIEWS_PARAMS)
+    os.makedirs(pickles)
+    publish_views(views, pickles)
+    convert_views(pickles, columnar)
+    convert_views(pickles, columnar)
+
+    snapshot = load_snapshot(columnar, view_format="columnar")
+    assert snapshot.version == get_views_manifest(columnar)["version"]
+    assert len(snapshot.stores_ranked_df) == len(views["stores_ranked_df"])
+    assert len(os.listdir(columnar)) == 2 * len(VIEW_FILES) + 1